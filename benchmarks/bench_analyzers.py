@@ -0,0 +1,351 @@
+"""텍스트 분석 엔진 마이크로 벤치마크 - 메시지마다 실행되는 분석기의 처리량/지연/할당
+
+사용법:
+    python benchmarks/bench_analyzers.py --messages 2000 --repeat 5
+    python benchmarks/bench_analyzers.py --save-baseline bench_baseline.json
+    python benchmarks/bench_analyzers.py --baseline bench_baseline.json --tolerance 0.15
+
+코퍼스는 시드 고정 생성기로 만든다 (한국어/영어/혼합 × 길이 × 키워드 밀도).
+주입 키워드는 앱의 키워드 사전(build_keyword_lexicons)에서 뽑으므로 사전이 커지면 코퍼스도 따라간다.
+--baseline 비교에서 처리량/지연이 허용 범위를 넘게 나빠지면 종료 코드 1.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# ============================================================================
+# 코퍼스 생성
+# ============================================================================
+
+KO_FILLERS = (
+    "오늘은 아침부터 비가 왔어요",
+    "점심은 회사 근처에서 먹었어요",
+    "퇴근길 지하철이 많이 붐볐어요",
+    "주말에 뭘 할지 아직 정하지 못했어요",
+    "요즘 드라마를 하나 보고 있어요",
+    "동생이랑 통화를 잠깐 했어요",
+    "산책하면서 음악을 들었어요",
+    "내일은 일찍 일어나야 해요",
+    "커피를 두 잔이나 마셨어요",
+    "방 정리를 조금 했어요"
+)
+
+EN_FILLERS = (
+    "It rained all morning",
+    "I had lunch near the office",
+    "The subway was crowded on the way home",
+    "I have not decided what to do this weekend",
+    "I am watching a new show these days",
+    "I talked to my brother on the phone",
+    "I listened to music during a walk",
+    "I need to wake up early tomorrow",
+    "I drank two cups of coffee",
+    "I cleaned up my room a little"
+)
+
+# (문장 수 범위)
+LENGTHS = {
+    'short': (1, 1),
+    'medium': (2, 4),
+    'long': (8, 14)
+}
+
+# 문장당 키워드 주입 확률
+DENSITIES = {
+    'none': 0.0,
+    'sparse': 0.15,
+    'dense': 0.8
+}
+
+# 이름: (언어, 길이, 밀도)
+PROFILES = {
+    'ko-short-sparse': ('ko', 'short', 'sparse'),
+    'ko-medium-sparse': ('ko', 'medium', 'sparse'),
+    'ko-long-dense': ('ko', 'long', 'dense'),
+    'en-medium-sparse': ('en', 'medium', 'sparse'),
+    'mixed-medium-dense': ('mixed', 'medium', 'dense'),
+    'ko-long-none': ('ko', 'long', 'none')
+}
+
+HANGUL = re.compile(r'[가-힣ㄱ-ㆎ]')
+
+def split_keywords(lexicons):
+    """키워드 사전 → 한국어/영어 키워드 목록"""
+    korean, english = [], []
+    for _, _, keywords in lexicons:
+        for keyword in keywords:
+            (korean if HANGUL.search(keyword) else english).append(keyword)
+    return korean, english
+
+def make_sentence(rng, language, density, korean_keywords, english_keywords):
+    if language == 'mixed':
+        language = rng.choice(('ko', 'en'))
+
+    if language == 'ko':
+        sentence, keywords = rng.choice(KO_FILLERS), korean_keywords
+    else:
+        sentence, keywords = rng.choice(EN_FILLERS), english_keywords
+
+    if keywords and rng.random() < density:
+        sentence += " " + rng.choice(keywords)
+        if rng.random() < density / 2:
+            sentence += " " + rng.choice(keywords)
+
+    return sentence + "."
+
+def generate_corpus(profile, size, seed, lexicons):
+    """프로파일별 결정적 메시지 목록"""
+    language, length, density = PROFILES[profile]
+    korean_keywords, english_keywords = split_keywords(lexicons)
+    low, high = LENGTHS[length]
+    rng = random.Random(f"{seed}:{profile}")
+
+    return [
+        " ".join(
+            make_sentence(rng, language, DENSITIES[density], korean_keywords, english_keywords)
+            for _ in range(rng.randint(low, high))
+        )
+        for _ in range(size)
+    ]
+
+# ============================================================================
+# 대상 함수
+# ============================================================================
+
+def load_app():
+    """앱 모듈 import (bare 모드 경고 숨김)"""
+    import streamlit.logger
+    streamlit.logger.set_log_level('error')
+
+    import gini_rest_vi
+    return gini_rest_vi
+
+def build_targets(app):
+    """벤치마크 대상: 개별 분석기(각자 스캔) + 공용 스캔 1회로 4개 분석기를 돌리는 파이프라인"""
+    def pipeline(text):
+        hits = app.scan_keywords(text)
+        app.analyze_crisis_level(text, hits)
+        app.detect_emotion_level(text, hits)
+        app.detect_isolation_keywords(text, hits)
+        app.detect_toxic_social_pattern(text, hits)
+
+    return {
+        'scan_keywords': app.scan_keywords,
+        'analyze_crisis_level': app.analyze_crisis_level,
+        'detect_emotion_level': app.detect_emotion_level,
+        'detect_isolation_keywords': app.detect_isolation_keywords,
+        'detect_toxic_social_pattern': app.detect_toxic_social_pattern,
+        'pipeline': pipeline
+    }
+
+# ============================================================================
+# 측정
+# ============================================================================
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def measure_latency(func, corpus, repeat):
+    """호출별 지연(ns) 수집 - GC는 측정 동안 끔, 처리량은 가장 빠른 회차 기준 (timeit 방식)"""
+    for text in corpus[:100]:
+        func(text)  # 워밍업
+
+    samples = []
+    best_pass = None
+    perf_counter_ns = time.perf_counter_ns
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            pass_started = perf_counter_ns()
+            for text in corpus:
+                t0 = perf_counter_ns()
+                func(text)
+                samples.append(perf_counter_ns() - t0)
+            elapsed = perf_counter_ns() - pass_started
+            best_pass = elapsed if best_pass is None else min(best_pass, elapsed)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    samples.sort()
+    return {
+        'calls': len(samples),
+        'throughput_per_sec': len(corpus) / (best_pass / 1e9),
+        'mean_us': sum(samples) / len(samples) / 1000,
+        'p50_us': percentile(samples, 50) / 1000,
+        'p90_us': percentile(samples, 90) / 1000,
+        'p99_us': percentile(samples, 99) / 1000,
+        'max_us': samples[-1] / 1000
+    }
+
+def measure_allocations(func, corpus):
+    """호출당 할당량 - tracemalloc 피크(일시 할당 바이트) + 잔존 블록 수(누수 지표)"""
+    peaks = [0] * len(corpus)
+
+    tracemalloc.start()
+    try:
+        for index, text in enumerate(corpus):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            func(text)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks[index] = peak - baseline
+    finally:
+        tracemalloc.stop()
+
+    # 잔존 블록은 tracemalloc 없이 별도 회차로 측정
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    for text in corpus:
+        func(text)
+    gc.collect()
+    retained = sys.getallocatedblocks() - blocks_before
+
+    return {
+        'alloc_peak_mean_bytes': sum(peaks) / len(peaks),
+        'alloc_peak_max_bytes': max(peaks),
+        'retained_blocks_per_1k_calls': retained * 1000 / len(corpus)
+    }
+
+def run_benchmarks(args):
+    app = load_app()
+    lexicons = app.build_keyword_lexicons()
+    targets = build_targets(app)
+
+    selected_profiles = args.profiles or list(PROFILES)
+    selected_targets = args.functions or list(targets)
+
+    results = {}
+    for profile in selected_profiles:
+        corpus = generate_corpus(profile, args.messages, args.seed, lexicons)
+        results[profile] = {
+            'mean_chars': sum(len(text) for text in corpus) / len(corpus),
+            'functions': {}
+        }
+        for name in selected_targets:
+            stats = measure_latency(targets[name], corpus, args.repeat)
+            if not args.no_alloc:
+                stats.update(measure_allocations(targets[name], corpus))
+            results[profile]['functions'][name] = stats
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'messages': args.messages,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'keyword_count': sum(len(keywords) for _, _, keywords in lexicons),
+            'automaton_states': len(app.get_keyword_matcher()._goto)
+        },
+        'results': results
+    }
+
+# ============================================================================
+# 베이스라인 비교
+# ============================================================================
+
+def compare_with_baseline(current, baseline, tolerance):
+    """처리량 감소 / p50·p99 증가가 tolerance 비율을 넘으면 회귀로 보고"""
+    regressions = []
+    for profile, data in current['results'].items():
+        base_profile = baseline['results'].get(profile)
+        if base_profile is None:
+            continue
+        for name, stats in data['functions'].items():
+            base = base_profile['functions'].get(name)
+            if base is None:
+                continue
+
+            checks = (
+                ('throughput_per_sec', base['throughput_per_sec'] / stats['throughput_per_sec'] - 1),
+                ('p50_us', stats['p50_us'] / base['p50_us'] - 1),
+                ('p99_us', stats['p99_us'] / base['p99_us'] - 1)
+            )
+            for metric, slowdown in checks:
+                if slowdown > tolerance:
+                    regressions.append((profile, name, metric, base[metric], stats[metric], slowdown))
+
+    return regressions
+
+# ============================================================================
+# 출력
+# ============================================================================
+
+def print_report(report, show_alloc):
+    meta = report['meta']
+    print(f"Python {meta['python']} | 메시지 {meta['messages']} × {meta['repeat']}회 | "
+          f"키워드 {meta['keyword_count']}개, 오토마톤 상태 {meta['automaton_states']}개")
+
+    for profile, data in report['results'].items():
+        print()
+        print(f"[{profile}] 평균 {data['mean_chars']:.0f}자")
+        header = f"  {'함수':<28}{'msg/s':>11}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>10}  (µs)"
+        if show_alloc:
+            header += f"{'peak B':>10}{'잔존/1k':>9}"
+        print(header)
+        for name, stats in data['functions'].items():
+            line = (f"  {name:<28}{stats['throughput_per_sec']:>11,.0f}{stats['p50_us']:>9.1f}"
+                    f"{stats['p90_us']:>9.1f}{stats['p99_us']:>9.1f}{stats['max_us']:>10.1f}")
+            if show_alloc:
+                line += f"{stats['alloc_peak_mean_bytes']:>10.0f}{stats['retained_blocks_per_1k_calls']:>9.1f}"
+            print(line)
+
+def print_regressions(regressions, current, baseline):
+    base_keywords = baseline['meta'].get('keyword_count')
+    if base_keywords != current['meta']['keyword_count']:
+        print(f"\n키워드 수 변화: {base_keywords} → {current['meta']['keyword_count']}")
+
+    if not regressions:
+        print("\n✅ 베이스라인 대비 회귀 없음")
+        return
+
+    print(f"\n❌ 베이스라인 대비 회귀 {len(regressions)}건")
+    for profile, name, metric, before, after, slowdown in regressions:
+        print(f"  {profile} / {name} / {metric}: {before:,.1f} → {after:,.1f} ({slowdown:+.0%})")
+
+def main():
+    parser = argparse.ArgumentParser(description="GINI R.E.S.T. 텍스트 분석기 마이크로 벤치마크")
+    parser.add_argument('--messages', type=int, default=1000, help="프로파일당 메시지 수")
+    parser.add_argument('--repeat', type=int, default=5, help="코퍼스 반복 횟수")
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--profiles', nargs='*', choices=list(PROFILES), help="실행할 코퍼스 프로파일")
+    parser.add_argument('--functions', nargs='*', help="실행할 함수 (기본: 전체)")
+    parser.add_argument('--no-alloc', action='store_true', help="tracemalloc 할당 측정 생략")
+    parser.add_argument('--json', default="", help="결과 JSON 저장 경로")
+    parser.add_argument('--save-baseline', default="", help="결과를 베이스라인으로 저장")
+    parser.add_argument('--baseline', default="", help="비교할 베이스라인 JSON")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="회귀 판정 허용 비율")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    print_report(report, show_alloc=not args.no_alloc)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        print_regressions(regressions, report, baseline)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
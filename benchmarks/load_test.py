@@ -0,0 +1,490 @@
+"""동시 세션 부하 테스트 - Streamlit AppTest로 main()을 N개 세션에서 헤드리스 구동
+
+사용법:
+    python benchmarks/load_test.py --sessions 200 --workers 32 --turns 8 --llm-latency 0.3
+
+LLM은 앱 내장 스텁 프로바이더(--llm stub, 기본) 또는 tools/mock_llm_server.py를
+프로세스 안에 띄운 HTTP 목 서버(--llm mock)로 대체하므로 네트워크 없이 실행된다.
+
+리포트: 동작별 리런 지연 백분위, 세션당 메모리(session_state 크기 / RSS 증가분),
+스레드 사용률(워커 점유율, CPU 사용률, 최대 스레드 수). --json으로 결과 저장.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, 'gini_rest_vi.py')
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+# ============================================================================
+# 합성 트래픽
+# ============================================================================
+
+MENU_LABEL = "메뉴"
+MENU_CHAT = "💬 AI 상담"
+MENU_EXERCISE = "🏃 운동 대시보드"
+MENU_MEAL = "🍽️ 영양 대시보드"
+MENU_SOCIAL = "🤝 사회적 연결"
+BROWSE_MENUS = (
+    "🎯 Phase 2 설정",
+    "📊 위기 대시보드",
+    "💭 감정 패턴",
+    "📊 수면 기록",
+    "💤 수면 분석",
+    "🧠 CBT-I 교육",
+    "🫁 호흡 운동"
+)
+
+# 동작별 비중
+TRAFFIC_MIX = (
+    ('chat', 0.45),
+    ('meal', 0.2),
+    ('exercise', 0.15),
+    ('social', 0.1),
+    ('browse', 0.1)
+)
+
+CHAT_OPENERS = (
+    "요즘 잠이 잘 안 와요",
+    "오늘 회사에서 너무 지쳤어요",
+    "친구랑 연락을 안 한 지 오래됐어요",
+    "기분이 조금 나아진 것 같아요",
+    "아무것도 하기 싫고 무기력해요",
+    "I feel tired and a bit lonely today",
+    "I couldn't sleep well last night",
+    "Work was stressful but I'm okay"
+)
+
+CHAT_DETAILS = (
+    "",
+    " 밥도 제대로 못 먹었어요.",
+    " 운동을 해보려고 하는데 잘 안 돼요.",
+    " 가족이랑 이야기하면 조금 괜찮아져요.",
+    " 불안해서 계속 휴대폰만 봐요.",
+    " Maybe I should go for a walk.",
+    " 그래도 내일은 좀 나을 것 같아요."
+)
+
+# 개입/응급 화면(사이드바 없음)에서 빠져나가기 위해 누르는 버튼
+SCREEN_EXITS = ("✅ 운동 완료!", "✅ 식사 완료!", "✅ 접촉 기록하기", "안전 모드 해제", "확인")
+
+def pick_action(rng):
+    roll = rng.random()
+    for action, weight in TRAFFIC_MIX:
+        roll -= weight
+        if roll < 0:
+            return action
+    return TRAFFIC_MIX[-1][0]
+
+def make_chat_message(rng):
+    return rng.choice(CHAT_OPENERS) + rng.choice(CHAT_DETAILS)
+
+def find_by_label(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    return None
+
+# ============================================================================
+# 세션 구동
+# ============================================================================
+
+class SessionDriver:
+    """AppTest 1개 = 브라우저 세션 1개. 동작마다 at.run() 1회를 리런 1회로 계측"""
+
+    def __init__(self, index, seed, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.index = index
+        self.rng = random.Random(seed + index)
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.timings = []  # (action, seconds)
+        self.errors = defaultdict(int)
+
+    def rerun(self, action):
+        started = time.perf_counter()
+        self.at.run()
+        self.timings.append((action, time.perf_counter() - started))
+
+        if self.at.exception:
+            self.errors['app_exception'] += 1
+
+    def start(self):
+        """첫 접속 + 약관 동의"""
+        self.rerun('first_load')
+        self.at.checkbox[0].check()
+        self.rerun('onboarding')
+        find_by_label(self.at.button, "시작하기").click()
+        self.rerun('onboarding')
+
+    def menu(self):
+        return find_by_label(self.at.sidebar.radio, MENU_LABEL)
+
+    def navigate(self, label):
+        menu = self.menu()
+        if menu.value != label:
+            menu.set_value(label)
+            self.rerun('navigate')
+
+    def exit_screen(self):
+        """개입/응급 화면 처리 - 화면이 요구하는 버튼을 누름"""
+        for label in SCREEN_EXITS:
+            button = find_by_label(self.at.button, label)
+            if button is None:
+                continue
+            if label == "확인":
+                self.at.text_input(key="recovery_input").set_value("수면 복원")
+            button.click()
+            self.rerun('intervention')
+            return
+        self.errors['stuck_screen'] += 1
+        self.rerun('intervention')
+
+    def turn(self):
+        if self.menu() is None:
+            self.exit_screen()
+            return
+
+        action = pick_action(self.rng)
+        try:
+            getattr(self, 'do_' + action)()
+        except (KeyError, IndexError, AttributeError):
+            # 화면 구성이 예상과 다름 (중간에 개입 화면으로 전환 등)
+            self.errors['driver_' + action] += 1
+
+    def do_chat(self):
+        self.navigate(MENU_CHAT)
+        self.at.chat_input[0].set_value(make_chat_message(self.rng))
+        self.rerun('chat')
+
+    def choose(self, key):
+        box = self.at.selectbox(key=key)
+        box.set_value(self.rng.choice(box.options))
+
+    def do_meal(self):
+        self.navigate(MENU_MEAL)
+        self.choose("main_meal_type")
+        self.choose("main_quality")
+        find_by_label(self.at.button, "✅ 식사 기록 추가").click()
+        self.rerun('meal')
+
+    def do_exercise(self):
+        self.navigate(MENU_EXERCISE)
+        self.at.number_input(key="main_duration").set_value(self.rng.choice((10, 20, 30, 45)))
+        self.choose("main_intensity")
+        self.at.slider(key="main_mood").set_value(self.rng.randint(3, 9))
+        find_by_label(self.at.button, "✅ 운동 기록 추가").click()
+        self.rerun('exercise')
+
+    def do_social(self):
+        self.navigate(MENU_SOCIAL)
+        self.choose("main_contact_type")
+        self.choose("main_quality")
+        find_by_label(self.at.button, "✅ 접촉 기록 추가").click()
+        self.rerun('social')
+
+    def do_browse(self):
+        self.navigate(self.rng.choice(BROWSE_MENUS))
+
+# ============================================================================
+# 측정
+# ============================================================================
+
+def read_rss_bytes():
+    """현재 RSS (Linux /proc, 없으면 ru_maxrss로 근사)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def deep_sizeof(obj, seen=None):
+    """컨테이너/__slots__ 객체를 따라가며 합산한 메모리 크기 (공유 객체는 1회만)"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, type) or callable(obj):
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, array)) or obj is None:
+        return size
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    else:
+        if hasattr(obj, '__dict__'):
+            size += deep_sizeof(vars(obj), seen)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += deep_sizeof(getattr(obj, slot), seen)
+    return size
+
+def session_state_size(driver):
+    return deep_sizeof(dict(driver.at.session_state.items()))
+
+class ThreadSampler:
+    """주기적으로 스레드 수를 샘플링 (이름 접두사별 최대치)"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_by_group = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='load-sampler', daemon=True)
+
+    @staticmethod
+    def group_of(thread):
+        return thread.name.split(' ')[0].rstrip('0123456789_-') or 'unnamed'
+
+    def _run(self):
+        while not self._stop.is_set():
+            threads = threading.enumerate()
+            self.peak_total = max(self.peak_total, len(threads))
+            counts = defaultdict(int)
+            for thread in threads:
+                counts[self.group_of(thread)] += 1
+            for group, count in counts.items():
+                self.peak_by_group[group] = max(self.peak_by_group[group], count)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def summarize_latencies(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean_ms': (sum(values) / len(values) * 1000) if values else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p90_ms': percentile(values, 90) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': (values[-1] * 1000) if values else 0.0
+    }
+
+# ============================================================================
+# 실행
+# ============================================================================
+
+def configure_llm(args):
+    """LLM 백엔드를 로컬 대역으로 교체 - mock이면 목 서버 객체 반환"""
+    os.environ.pop('GINI_DB_PATH', None)
+    if args.db:
+        os.environ['GINI_DB_PATH'] = args.db
+
+    if args.llm == 'mock':
+        import mock_llm_server
+        server = mock_llm_server.serve(
+            port=0,
+            latency=args.llm_latency,
+            token_delay=args.token_delay,
+            error_rate=args.error_rate,
+            background=True
+        )
+        provider = {
+            'name': 'mock',
+            'kind': 'openai',
+            'url': f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+        }
+    else:
+        server = None
+        provider = {
+            'name': 'stub',
+            'kind': 'stub',
+            'latency': args.llm_latency,
+            'token_delay': args.token_delay
+        }
+
+    os.environ['LLM_PROVIDERS'] = json.dumps([provider])
+    os.environ['LLM_REPLY_CACHE_SIZE'] = str(args.reply_cache)
+    return server
+
+def allow_concurrent_apptests():
+    """AppTest를 여러 스레드에서 동시에 돌리기 위한 하네스 전용 보정
+
+    - AppTest는 리런마다 전역 Runtime 싱글턴을 mock으로 바꿨다가 None으로 되돌린다.
+      먼저 끝난 리런이 다른 리런의 Runtime을 지우지 않도록, 비어 있으면 마지막 mock을 돌려준다.
+    - 리런마다 새 ScriptCache로 스크립트를 다시 파싱한다 (동시 ast.parse는 3.11에서 깨짐).
+      실제 서버처럼 프로세스 공유 바이트코드 캐시를 쓰도록 한다.
+    - 리런마다 global.appTest 옵션을 켰다 끄므로, 다른 리런 도중 꺼지지 않게 프로세스 전체에서 켜 둔다.
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    compile_bytecode = ScriptCache.get_bytecode
+    bytecode = {}
+    compile_lock = threading.Lock()
+
+    def get_bytecode(self, script_path):
+        with compile_lock:
+            if script_path not in bytecode:
+                bytecode[script_path] = compile_bytecode(self, script_path)
+            return bytecode[script_path]
+
+    ScriptCache.get_bytecode = get_bytecode
+    config.get_config_options()
+    config._set_option("global.appTest", True, "load_test")
+
+    original = Runtime.instance.__func__
+    last = []
+
+    def instance(cls):
+        current = cls._instance
+        if current is not None:
+            last[:] = [current]
+            return current
+        if last:
+            return last[0]
+        return original(cls)
+
+    Runtime.instance = classmethod(instance)
+
+def run_session(index, args, busy):
+    started = time.perf_counter()
+    driver = SessionDriver(index, args.seed, args.timeout)
+    try:
+        driver.start()
+        for _ in range(args.turns):
+            driver.turn()
+    except Exception as e:
+        driver.errors['session_' + type(e).__name__] += 1
+    busy.append(time.perf_counter() - started)
+    return driver
+
+def run_load_test(args):
+    server = configure_llm(args)
+    allow_concurrent_apptests()
+    busy = []
+
+    rss_before = read_rss_bytes()
+    cpu_before = time.process_time()
+    wall_started = time.perf_counter()
+
+    with ThreadSampler() as sampler:
+        with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='load-worker') as pool:
+            drivers = list(pool.map(lambda i: run_session(i, args, busy), range(args.sessions)))
+
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_before
+    rss_after = read_rss_bytes()
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    by_action = defaultdict(list)
+    errors = defaultdict(int)
+    for driver in drivers:
+        for action, seconds in driver.timings:
+            by_action[action].append(seconds)
+        for name, count in driver.errors.items():
+            errors[name] += count
+
+    all_reruns = [seconds for values in by_action.values() for seconds in values]
+    state_sizes = sorted(session_state_size(driver) for driver in drivers)
+
+    return {
+        'config': {
+            'sessions': args.sessions,
+            'workers': args.workers,
+            'turns': args.turns,
+            'llm': args.llm,
+            'llm_latency': args.llm_latency,
+            'token_delay': args.token_delay,
+            'store': 'sqlite' if args.db else 'memory',
+            'seed': args.seed
+        },
+        'wall_seconds': wall,
+        'reruns_per_second': len(all_reruns) / wall if wall else 0.0,
+        'latency': {
+            'all': summarize_latencies(all_reruns),
+            'by_action': {action: summarize_latencies(values) for action, values in sorted(by_action.items())}
+        },
+        'memory': {
+            'session_state_mean_kb': sum(state_sizes) / len(state_sizes) / 1024 if state_sizes else 0.0,
+            'session_state_max_kb': state_sizes[-1] / 1024 if state_sizes else 0.0,
+            'rss_growth_per_session_kb': (rss_after - rss_before) / max(1, args.sessions) / 1024
+        },
+        'threads': {
+            'worker_utilization': sum(busy) / (wall * args.workers) if wall else 0.0,
+            'cpu_utilization': cpu / wall if wall else 0.0,
+            'peak_threads': sampler.peak_total,
+            'peak_by_group': dict(sorted(sampler.peak_by_group.items()))
+        },
+        'errors': dict(errors)
+    }
+
+def print_report(result):
+    config = result['config']
+    print(f"세션 {config['sessions']}개 × {config['turns']}턴, 워커 {config['workers']}, "
+          f"LLM={config['llm']} ({config['llm_latency']}s), 저장소={config['store']}")
+    print(f"총 {result['wall_seconds']:.1f}s, 리런 {result['reruns_per_second']:.1f}/s")
+    print()
+    print(f"{'동작':<14}{'횟수':>7}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    rows = [('all', result['latency']['all'])] + list(result['latency']['by_action'].items())
+    for action, stats in rows:
+        print(f"{action:<14}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}"
+              f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print()
+    memory = result['memory']
+    print(f"session_state: 평균 {memory['session_state_mean_kb']:.1f} KB, 최대 {memory['session_state_max_kb']:.1f} KB")
+    print(f"RSS 증가: 세션당 {memory['rss_growth_per_session_kb']:.1f} KB")
+    threads = result['threads']
+    print(f"워커 점유율 {threads['worker_utilization']:.0%}, CPU 사용률 {threads['cpu_utilization']:.0%}, "
+          f"최대 스레드 {threads['peak_threads']} {threads['peak_by_group']}")
+    if result['errors']:
+        print(f"오류: {result['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="GINI R.E.S.T. 동시 세션 부하 테스트 (AppTest)")
+    parser.add_argument('--sessions', type=int, default=50, help="시뮬레이션 세션 수")
+    parser.add_argument('--workers', type=int, default=16, help="동시에 구동할 세션 수")
+    parser.add_argument('--turns', type=int, default=8, help="세션당 동작 수")
+    parser.add_argument('--llm', choices=('stub', 'mock'), default='stub', help="stub: 앱 내장 스텁, mock: HTTP 목 서버")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="LLM 응답 지연 (초)")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="스트리밍 토큰 간 지연 (초)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="목 서버 장애 주입 비율 (--llm mock)")
+    parser.add_argument('--reply-cache', type=int, default=0, help="LLM 응답 캐시 크기 (0=끔)")
+    parser.add_argument('--db', default="", help="SQLite 저장소 경로 (없으면 세션에만 보관)")
+    parser.add_argument('--timeout', type=float, default=60.0, help="리런 1회 제한 시간 (초)")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--json', default="", help="결과 JSON 저장 경로")
+    args = parser.parse_args()
+
+    result = run_load_test(args)
+    print_report(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,39 @@
 import streamlit as st
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from dataclasses import dataclass, replace
+from collections import OrderedDict, deque
+from array import array
+from bisect import bisect_left, bisect_right, insort
+import functools
+import socket
+import threading
+import sqlite3
+import atexit
+import uuid
 import time
 import json
+import os
+import re
+import random
+import email.utils
+import hashlib
+import hmac
+import logging
+import textwrap
+import csv
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+import math
+import operator
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # 선택 의존성 - 없으면 순수 파이썬 경로
+    np = None
 
 # ============================================================================
 # GINI R.E.S.T. v3.0 - Groq AI Chat
@@ -15,9 +46,523 @@ st.set_page_config(
     layout="wide"
 )
 
+def get_setting(key, default=None):
+    """설정 조회 - Streamlit secrets 우선, 없으면 환경변수"""
+    try:
+        value = st.secrets.get(key)
+    except Exception:
+        value = None
+    
+    if value is None:
+        value = os.environ.get(key)
+    
+    return default if value is None else value
+
 # Groq API 설정
-GROQ_API_KEY = st.secrets.get("GROQ_API_KEY", "")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_API_KEY = get_setting("GROQ_API_KEY", "")
+GROQ_API_URL = get_setting("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+
+# ============================================================================
+# 0. 실행 구간 추적 (Tracing)
+# ============================================================================
+
+class NoopSpan:
+    """추적이 꺼져 있을 때 쓰는 공유 스팬 - 아무것도 하지 않음"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+# st.rerun()/st.stop()이 흐름 제어용으로 던지는 예외 (오류로 기록하지 않음)
+CONTROL_FLOW_EXCEPTIONS = ('RerunException', 'StopException')
+
+class Span:
+    """타이밍 스팬 - with 블록 동안 측정, 스레드별 스택으로 부모/자식 연결"""
+
+    __slots__ = ('tracer', 'name', 'attributes', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'start_wall_ns', 'duration_ns')
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = None
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = None
+        self.start_ns = 0
+        self.start_wall_ns = 0
+        self.duration_ns = 0
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start_wall_ns = time.time_ns()
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+        if exc_type is not None:
+            key = 'control' if exc_type.__name__ in CONTROL_FLOW_EXCEPTIONS else 'exception'
+            self.attributes[key] = exc_type.__name__
+        self.tracer._pop(self)
+        return False
+
+class Tracer:
+    """중첩 타이밍 스팬 수집 - 스팬별 최근 지속시간(백분위용) + 트레이스 단위 파일 내보내기
+
+    export_format: 'json' (스팬당 JSON 1줄) 또는 'otlp' (트레이스당 OTLP/JSON ExportTraceServiceRequest 1줄)
+    """
+
+    def __init__(self, enabled=False, export_path=None, export_format='json', window=1000):
+        self.enabled = enabled
+        self.export_path = export_path
+        self.export_format = export_format
+        self.window = window
+        self._durations = {}  # name -> deque(ms)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def annotate(self, **attributes):
+        """현재 스레드에서 열려 있는 가장 안쪽 스팬에 속성 추가"""
+        if not self.enabled:
+            return
+        stack = getattr(self._local, 'stack', None)
+        if stack:
+            stack[-1].attributes.update(attributes)
+
+    def _push(self, span):
+        local = self._local
+        stack = getattr(local, 'stack', None)
+        if stack is None:
+            stack = local.stack = []
+            local.finished = []
+        
+        if stack:
+            span.parent_id = stack[-1].span_id
+            span.trace_id = stack[-1].trace_id
+        else:
+            span.trace_id = uuid.uuid4().hex
+        stack.append(span)
+
+    def _pop(self, span):
+        local = self._local
+        local.stack.pop()
+        
+        durations = self._durations.get(span.name)
+        if durations is None:
+            with self._lock:
+                durations = self._durations.setdefault(span.name, deque(maxlen=self.window))
+        durations.append(span.duration_ns / 1e6)
+        
+        if self.export_path:
+            local.finished.append(span)
+            if not local.stack:
+                finished, local.finished = local.finished, []
+                self._export(finished)
+
+    def _export(self, spans):
+        if self.export_format == 'otlp':
+            lines = [json.dumps(self._to_otlp(spans), ensure_ascii=False)]
+        else:
+            lines = [json.dumps(self._to_json(span), ensure_ascii=False) for span in spans]
+        
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.export_path, 'a', encoding='utf-8')
+                atexit.register(self._file.close)
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+
+    @staticmethod
+    def _to_json(span):
+        return {
+            'trace_id': span.trace_id,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'name': span.name,
+            'start': span.start_wall_ns / 1e9,
+            'duration_ms': span.duration_ns / 1e6,
+            'attributes': span.attributes
+        }
+
+    @staticmethod
+    def _to_otlp(spans):
+        def attribute(key, value):
+            if isinstance(value, bool):
+                typed = {'boolValue': value}
+            elif isinstance(value, int):
+                typed = {'intValue': str(value)}
+            elif isinstance(value, float):
+                typed = {'doubleValue': value}
+            else:
+                typed = {'stringValue': str(value)}
+            return {'key': key, 'value': typed}
+        
+        return {'resourceSpans': [{
+            'resource': {'attributes': [attribute('service.name', 'gini-rest')]},
+            'scopeSpans': [{
+                'scope': {'name': 'gini_rest_vi'},
+                'spans': [{
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or "",
+                    'name': span.name,
+                    'kind': 1,  # SPAN_KIND_INTERNAL
+                    'startTimeUnixNano': str(span.start_wall_ns),
+                    'endTimeUnixNano': str(span.start_wall_ns + span.duration_ns),
+                    'attributes': [attribute(k, v) for k, v in span.attributes.items()],
+                    'status': {'code': 2 if 'exception' in span.attributes else 0}
+                } for span in spans]
+            }]
+        }]}
+
+    def stats(self):
+        """스팬별 호출 수와 p50/p95/max (ms, 최근 window개 기준, 전체 세션 합산)"""
+        rows = []
+        for name, durations in list(self._durations.items()):
+            values = sorted(durations)
+            if not values:
+                continue
+            rows.append({
+                'span': name,
+                'count': len(values),
+                'p50_ms': round(values[max(0, math.ceil(0.50 * len(values)) - 1)], 2),
+                'p95_ms': round(values[max(0, math.ceil(0.95 * len(values)) - 1)], 2),
+                'max_ms': round(values[-1], 2)
+            })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._durations = {}
+
+@st.cache_resource
+def get_shared_tracer():
+    """프로세스 공유 트레이서 (GINI_TRACE=1로 켬)"""
+    return Tracer(
+        enabled=str(get_setting("GINI_TRACE", "")).lower() in ('1', 'true', 'yes', 'on'),
+        export_path=get_setting("GINI_TRACE_FILE", "") or None,
+        export_format=get_setting("GINI_TRACE_FORMAT", "json"),
+        window=int(get_setting("GINI_TRACE_WINDOW", 1000))
+    )
+
+_tracer = None
+
+def get_tracer():
+    """트레이서 조회 - 실행(rerun)마다 1회만 캐시 조회"""
+    global _tracer
+    if _tracer is None:
+        _tracer = get_shared_tracer()
+    return _tracer
+
+def traced(name=None):
+    """함수 호출을 스팬으로 감싸는 데코레이터 (꺼져 있으면 플래그 확인 1회)"""
+    def decorate(func):
+        span_name = name or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = get_tracer()
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# ============================================================================
+# 0-1. 운영 지표 (Prometheus 텍스트 포맷)
+# ============================================================================
+
+def escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class ShardedMetric:
+    """스레드별 샤드에 쓰고 수집 시 합산 - 기록 경로에 락 없음
+
+    각 스레드는 자기 샤드 dict만 쓰고, 종료된 스레드의 샤드는 새 샤드 등록/수집 시 retired로 합친다.
+    (Streamlit은 리런마다 새 스레드 - 등록 시 정리하지 않으면 스크랩 전까지 샤드가 계속 쌓임)
+    """
+
+    metric_type = 'untyped'
+    enabled = True  # 내보내기가 없으면 레지스트리가 끔 (기록 생략)
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead_locked()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_locked(self):
+        """종료된 스레드의 샤드를 retired로 합침 (self._lock 보유 상태에서 호출)"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for key, value in list(shard.items()):
+                    self._merge(self._retired, key, value)
+        self._shards = alive
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _merge(self, total, key, value):
+        raise NotImplementedError
+
+    def collect(self):
+        """라벨 키별 합산 값"""
+        with self._lock:
+            self._retire_dead_locked()
+            
+            total = {}
+            for key, value in self._retired.items():
+                self._merge(total, key, value)
+            for _, shard in self._shards:
+                for key, value in list(shard.items()):
+                    self._merge(total, key, value)
+        return total
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+class Counter(ShardedMetric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self.enabled:
+            return
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, total, key, value):
+        total[key] = total.get(key, 0) + value
+
+    def render(self):
+        return [f"{self.name}{self._label_text(key)} {value}" for key, value in sorted(self.collect().items())]
+
+class Histogram(ShardedMetric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not self.enabled:
+            return
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _merge(self, total, key, value):
+        state = total.get(key)
+        if state is None:
+            total[key] = [list(value[0]), value[1], value[2]]
+            return
+        state[0] = [a + b for a, b in zip(state[0], value[0])]
+        state[1] += value[1]
+        state[2] += value[2]
+
+    def render(self):
+        lines = []
+        for key, (counts, total_sum, count) in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float('inf') else repr(float(bound))
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {total_sum}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+class ActiveSessionGauge:
+    """최근 idle_seconds 안에 리런이 있었던 세션 수"""
+
+    metric_type = 'gauge'
+    enabled = True
+
+    def __init__(self, name, help_text, idle_seconds=300):
+        self.name = name
+        self.help_text = help_text
+        self.idle_seconds = idle_seconds
+        self._last_seen = {}
+        self._next_prune = time.monotonic() + idle_seconds
+
+    def touch(self, session_key):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._last_seen[session_key] = now
+        
+        # 스크랩이 없어도 지난 세션 키가 쌓이지 않게 idle_seconds마다 한 번 정리
+        if now >= self._next_prune:
+            self._next_prune = now + self.idle_seconds
+            self._prune(now - self.idle_seconds)
+
+    def _prune(self, cutoff):
+        for session_key, last_seen in list(self._last_seen.items()):
+            if last_seen < cutoff:
+                self._last_seen.pop(session_key, None)
+
+    def value(self):
+        self._prune(time.monotonic() - self.idle_seconds)
+        return len(self._last_seen)
+
+    def render(self):
+        return [f"{self.name} {self.value()}"]
+
+class MetricsRegistry:
+    """지표 등록 + Prometheus 텍스트 포맷(0.0.4) 출력"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = []
+        self.export_status = []
+
+    def register(self, metric):
+        metric.enabled = self.enabled
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# LLM 지연 히스토그램 경계 (초)
+LLM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+class AppMetrics:
+    """앱 지표 모음"""
+
+    def __init__(self, registry, session_idle_seconds=300):
+        self.registry = registry
+        self.reruns = registry.register(Counter(
+            'gini_reruns_total', "스크립트 실행(리런) 수"))
+        self.messages_analyzed = registry.register(Counter(
+            'gini_messages_analyzed_total', "분석한 사용자 메시지 수"))
+        self.crisis_events = registry.register(Counter(
+            'gini_crisis_events_total', "기록된 위기 이벤트 수", labels=('level',)))
+        self.forced_interventions = registry.register(Counter(
+            'gini_forced_interventions_total', "메시지 분석 시 강제 개입 판정 수", labels=('priority',)))
+        self.llm_latency = registry.register(Histogram(
+            'gini_llm_request_seconds', "LLM 호출 지연 (스트리밍은 스트림 종료까지)", LLM_LATENCY_BUCKETS,
+            labels=('provider', 'mode', 'outcome')))
+        self.llm_tokens = registry.register(Counter(
+            'gini_llm_tokens_total', "LLM 토큰 수 (추정치)", labels=('provider', 'kind')))
+        self.llm_errors = registry.register(Counter(
+            'gini_llm_errors_total', "LLM 호출 오류 수", labels=('provider', 'category')))
+        self.active_sessions = registry.register(ActiveSessionGauge(
+            'gini_active_sessions', "최근 활동 세션 수", idle_seconds=session_idle_seconds))
+
+def start_metrics_http_server(registry, host, port):
+    """/metrics 텍스트 엔드포인트 (데몬 스레드)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0].rstrip('/') not in ('', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+def start_metrics_file_writer(registry, path, interval):
+    """주기적으로 파일에 원자적 기록 (node_exporter textfile collector 방식)"""
+    def write():
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(registry.render())
+        os.replace(temp_path, path)
+    
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write()
+            except OSError:
+                pass
+    
+    threading.Thread(target=loop, name='metrics-file', daemon=True).start()
+    atexit.register(write)
+
+@st.cache_resource
+def get_metrics():
+    """프로세스 공유 지표 (GINI_METRICS_PORT / GINI_METRICS_FILE로 내보내기)"""
+    port = get_setting("GINI_METRICS_PORT", "")
+    path = get_setting("GINI_METRICS_FILE", "")
+    
+    # 내보낼 곳이 없으면 기록 자체를 생략 (리런마다 드는 비용/메모리 없음)
+    registry = MetricsRegistry(enabled=bool(port or path))
+    metrics = AppMetrics(registry, session_idle_seconds=float(get_setting("GINI_SESSION_IDLE", 300)))
+    
+    if port:
+        host = get_setting("GINI_METRICS_HOST", "127.0.0.1")
+        try:
+            start_metrics_http_server(registry, host, int(port))
+            registry.export_status.append(f"http://{host}:{port}/metrics")
+        except OSError as e:
+            registry.export_status.append(f"HTTP 포트 {port} 열기 실패: {e}")
+    
+    if path:
+        start_metrics_file_writer(registry, path, float(get_setting("GINI_METRICS_INTERVAL", 15)))
+        registry.export_status.append(f"파일: {path}")
+    
+    return metrics
 
 # ============================================================================
 # 1. 초기화 및 세션 상태 관리
@@ -25,11 +570,16 @@ GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 
 def init_session_state():
     """세션 상태 초기화"""
+    if 'session_key' not in st.session_state:
+        st.session_state.session_key = uuid.uuid4().hex
+    
     if 'agreed_to_terms' not in st.session_state:
         st.session_state.agreed_to_terms = False
     
-    if 'sleep_data' not in st.session_state:
-        st.session_state.sleep_data = []
+    init_record_history('sleep_data', SleepRecord)
+    
+    if 'sleep_stats' not in st.session_state:
+        st.session_state.sleep_stats = SleepStats(st.session_state.sleep_data)
     
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
@@ -54,8 +604,10 @@ def init_session_state():
         st.session_state.last_reset_date = datetime.now().date()
     
     # V2.5 Crisis Engine
-    if 'crisis_history' not in st.session_state:
-        st.session_state.crisis_history = []
+    init_record_history('crisis_history', CrisisEvent)
+    
+    if 'crisis_counters' not in st.session_state:
+        st.session_state.crisis_counters = build_crisis_counters(st.session_state.crisis_history)
     
     if 'emotion_tracking' not in st.session_state:
         st.session_state.emotion_tracking = []
@@ -67,54 +619,874 @@ def init_session_state():
         st.session_state.last_crisis_time = None
     
     # ========== V2.5 Exercise Intervention ==========
-    if 'exercise_records' not in st.session_state:
-        st.session_state.exercise_records = []
-    
-    if 'last_exercise_date' not in st.session_state:
-        st.session_state.last_exercise_date = None
+    init_record_history('exercise_records', ExerciseRecord)
     
-    if 'exercise_streak' not in st.session_state:
-        st.session_state.exercise_streak = 0
+    if 'exercise_index' not in st.session_state:
+        st.session_state.exercise_index = ExerciseDayIndex(st.session_state.exercise_records.days)
     
     if 'exercise_warning_shown' not in st.session_state:
         st.session_state.exercise_warning_shown = False
     
     # ========== V2.5 Nutrition Intervention (NEW) ==========
-    if 'meal_records' not in st.session_state:
-        st.session_state.meal_records = []
+    init_record_history('meal_records', MealRecord)
     
-    if 'last_meal_time' not in st.session_state:
-        st.session_state.last_meal_time = None
+    if 'meal_index' not in st.session_state:
+        st.session_state.meal_index = MealDayIndex(st.session_state.meal_records)
     
     if 'nutrition_warnings' not in st.session_state:
         st.session_state.nutrition_warnings = 0
     
     # ========== V3.0 Social Connection Engine ==========
-    if 'social_interactions' not in st.session_state:
-        st.session_state.social_interactions = []
+    init_record_history('social_interactions', SocialInteraction)
     
     if 'last_social_contact' not in st.session_state:
-        st.session_state.last_social_contact = None
+        records = st.session_state.social_interactions
+        st.session_state.last_social_contact = records[-1].timestamp if records else None
     
     if 'isolation_score' not in st.session_state:
         st.session_state.isolation_score = 0
     
     if 'isolation_history' not in st.session_state:
-        st.session_state.isolation_history = []
+        st.session_state.isolation_history = load_isolation_history()
+    elif isinstance(st.session_state.isolation_history, list):
+        st.session_state.isolation_history = deque(
+            st.session_state.isolation_history, maxlen=ISOLATION_HISTORY_MAX
+        )
     
     if 'social_warnings' not in st.session_state:
         st.session_state.social_warnings = 0
     
     # ========== Phase 2 Emotion Pattern Engine ==========
-    if 'emotion_score' not in st.session_state:
-        st.session_state.emotion_score = 1  # E1-E5
+    init_record_history('emotion_history', EmotionEvent)
     
-    if 'emotion_history' not in st.session_state:
-        st.session_state.emotion_history = []
+    if 'emotion_score' not in st.session_state:
+        history = st.session_state.emotion_history
+        st.session_state.emotion_score = history[-1].e_score if history else 1  # E1-E5
     
     if 'last_emotion_check' not in st.session_state:
         st.session_state.last_emotion_check = None
 
+# ============================================================================
+# 1-1. 기록 타입 (epoch 타임스탬프 + 범주형 코드)
+# ============================================================================
+
+# 범주형 값 ↔ small int 코드 (튜플 인덱스)
+INTENSITY_LEVELS = ("가벼움", "보통", "강함")
+MEAL_TYPES = ("아침", "점심", "저녁", "간식/음료")
+MEAL_QUALITIES = ("양질", "보통", "부실")
+CONTACT_TYPES = ("대면 만남", "전화/영상", "SNS 댓글", "단톡방", "문자", "기타")
+CONTACT_QUALITIES = ("따뜻했다", "괜찮았다", "형식적이었다", "힘들었다")
+
+def encode_label(labels, value, default=0):
+    """라벨 → 코드 (알 수 없는 값은 default)"""
+    try:
+        return labels.index(value)
+    except ValueError:
+        return default
+
+def to_epoch(value):
+    """datetime / ISO 문자열 / 숫자 → epoch 초"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+def epoch_to_day(ts):
+    """epoch 초 → 로컬 날짜 ordinal"""
+    return datetime.fromtimestamp(ts).date().toordinal()
+
+class Record:
+    """__slots__ 기반 기록 베이스"""
+    __slots__ = ('ts',)
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.ts)
+
+class DayRecord(Record):
+    """날짜 ordinal을 함께 가지는 기록"""
+    __slots__ = ('day',)
+
+    @property
+    def date(self):
+        return date.fromordinal(self.day)
+
+class CrisisEvent(Record):
+    __slots__ = ('level', 'keywords', 'text_sample', 'is_metaphor')
+
+    def __init__(self, ts, level, keywords, text_sample, is_metaphor):
+        self.ts = ts
+        self.level = level
+        self.keywords = tuple(keywords)
+        self.text_sample = text_sample
+        self.is_metaphor = is_metaphor
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'level': self.level,
+            'keywords': list(self.keywords),
+            'text_sample': self.text_sample,
+            'is_metaphor': self.is_metaphor
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            to_epoch(data['timestamp']),
+            int(data['level']),
+            data.get('keywords', ()),
+            data.get('text_sample', ''),
+            bool(data.get('is_metaphor', False))
+        )
+
+class EmotionEvent(Record):
+    __slots__ = ('e_score', 'detected_emotions', 'text_sample')
+
+    def __init__(self, ts, e_score, detected_emotions, text_sample):
+        self.ts = ts
+        self.e_score = e_score
+        self.detected_emotions = detected_emotions
+        self.text_sample = text_sample
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'e_score': self.e_score,
+            'detected_emotions': self.detected_emotions,
+            'text_sample': self.text_sample
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            to_epoch(data['timestamp']),
+            int(data['e_score']),
+            dict(data.get('detected_emotions', {})),
+            data.get('text_sample', '')
+        )
+
+class ExerciseRecord(DayRecord):
+    __slots__ = ('duration_minutes', 'intensity_code', 'mood_after')
+
+    def __init__(self, ts, duration_minutes, intensity_code, mood_after, day=None):
+        self.ts = ts
+        self.day = epoch_to_day(ts) if day is None else day
+        self.duration_minutes = duration_minutes
+        self.intensity_code = intensity_code
+        self.mood_after = mood_after
+
+    @property
+    def intensity(self):
+        return INTENSITY_LEVELS[self.intensity_code]
+
+    def to_dict(self):
+        return {
+            'date': self.date.isoformat(),
+            'timestamp': self.timestamp.isoformat(),
+            'duration_minutes': self.duration_minutes,
+            'intensity': self.intensity,
+            'mood_after': self.mood_after
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            to_epoch(data['timestamp']),
+            int(data['duration_minutes']),
+            encode_label(INTENSITY_LEVELS, data.get('intensity'), 1),
+            int(data.get('mood_after', 0)),
+            date.fromisoformat(data['date']).toordinal() if data.get('date') else None
+        )
+
+class MealRecord(DayRecord):
+    __slots__ = ('meal_type_code', 'quality_code', 'notes')
+
+    def __init__(self, ts, meal_type_code, quality_code, notes="", day=None):
+        self.ts = ts
+        self.day = epoch_to_day(ts) if day is None else day
+        self.meal_type_code = meal_type_code
+        self.quality_code = quality_code
+        self.notes = notes
+
+    @property
+    def meal_type(self):
+        return MEAL_TYPES[self.meal_type_code]
+
+    @property
+    def quality(self):
+        return MEAL_QUALITIES[self.quality_code]
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'date': self.date.isoformat(),
+            'meal_type': self.meal_type,
+            'quality': self.quality,
+            'notes': self.notes
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            to_epoch(data['timestamp']),
+            encode_label(MEAL_TYPES, data.get('meal_type'), 3),
+            encode_label(MEAL_QUALITIES, data.get('quality'), 1),
+            data.get('notes', ''),
+            date.fromisoformat(data['date']).toordinal() if data.get('date') else None
+        )
+
+class SocialInteraction(DayRecord):
+    __slots__ = ('type_code', 'quality_code', 'notes')
+
+    def __init__(self, ts, type_code, quality_code, notes="", day=None):
+        self.ts = ts
+        self.day = epoch_to_day(ts) if day is None else day
+        self.type_code = type_code
+        self.quality_code = quality_code
+        self.notes = notes
+
+    @property
+    def contact_type(self):
+        return CONTACT_TYPES[self.type_code]
+
+    @property
+    def quality(self):
+        return CONTACT_QUALITIES[self.quality_code]
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'date': self.date.isoformat(),
+            'type': self.contact_type,
+            'quality': self.quality,
+            'notes': self.notes
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            to_epoch(data['timestamp']),
+            encode_label(CONTACT_TYPES, data.get('type'), 5),
+            encode_label(CONTACT_QUALITIES, data.get('quality'), 1),
+            data.get('notes', ''),
+            date.fromisoformat(data['date']).toordinal() if data.get('date') else None
+        )
+
+class SleepRecord(DayRecord):
+    """수면 일지 1건 - ts는 취침(잠자리에 든) 시각, day는 기상일"""
+    __slots__ = ('wake_ts', 'latency_minutes', 'awakenings', 'awake_minutes')
+
+    def __init__(self, ts, wake_ts, latency_minutes=0, awakenings=0, awake_minutes=0, day=None):
+        self.ts = ts
+        self.wake_ts = wake_ts
+        self.day = epoch_to_day(wake_ts) if day is None else day
+        self.latency_minutes = latency_minutes
+        self.awakenings = awakenings
+        self.awake_minutes = awake_minutes
+
+    @property
+    def wake_time(self):
+        return datetime.fromtimestamp(self.wake_ts)
+
+    @property
+    def time_in_bed_seconds(self):
+        return self.wake_ts - self.ts
+
+    @property
+    def total_sleep_seconds(self):
+        """실제 잠든 시간 = 누워 있던 시간 - 잠들기까지 - 중간에 깨어 있던 시간"""
+        return max(self.time_in_bed_seconds - (self.latency_minutes + self.awake_minutes) * 60, 0)
+
+    @property
+    def midpoint_minutes(self):
+        """수면 중간 시각 - 18:00 기준 경과 분 (자정을 넘어도 연속, 0-1439)"""
+        onset = self.ts + self.latency_minutes * 60
+        midpoint = datetime.fromtimestamp((onset + self.wake_ts) / 2)
+        return (midpoint.hour * 60 + midpoint.minute - 18 * 60) % 1440
+
+    @property
+    def wake_minutes(self):
+        """기상 시각 - 18:00 기준 경과 분 (midpoint_minutes와 같은 기준)"""
+        wake = self.wake_time
+        return (wake.hour * 60 + wake.minute - 18 * 60) % 1440
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'date': self.date.isoformat(),
+            'wake_time': self.wake_time.isoformat(),
+            'latency_minutes': self.latency_minutes,
+            'awakenings': self.awakenings,
+            'awake_minutes': self.awake_minutes,
+            'total_sleep_hours': round(self.total_sleep_seconds / 3600, 2)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            to_epoch(data['timestamp']),
+            to_epoch(data['wake_time']),
+            int(data.get('latency_minutes', 0)),
+            int(data.get('awakenings', 0)),
+            int(data.get('awake_minutes', 0)),
+            date.fromisoformat(data['date']).toordinal() if data.get('date') else None
+        )
+
+class RecordHistory:
+    """시간순 이력 컨테이너 - 레코드 리스트 + epoch/day array 컬럼 (bisect 윈도우 조회)
+
+    maxlen: 최대 개수, horizon_days: 오늘 포함 보관 일수 (day 기록만 - load_history와 같은 기준)
+    """
+
+    def __init__(self, record_type, maxlen=None, records=(), horizon_days=None):
+        self.record_type = record_type
+        self.maxlen = maxlen
+        self.horizon_days = horizon_days
+        self._records = []
+        self._ts = array('d')
+        self._day = array('l') if hasattr(record_type, 'day') else None
+        
+        for record in sorted(records, key=lambda r: r.ts):
+            self._push(len(self._records), record)
+        self._trim()
+
+    def _push(self, index, record):
+        self._records.insert(index, record)
+        self._ts.insert(index, record.ts)
+        if self._day is not None:
+            self._day.insert(index, record.day)
+
+    def _trim(self):
+        excess = 0
+        if self.maxlen is not None and len(self._records) > self.maxlen:
+            excess = len(self._records) - self.maxlen
+        if self.horizon_days is not None and self._day:
+            excess = max(excess, bisect_left(self._day, horizon_start_day(self.horizon_days)))
+        
+        if excess:
+            del self._records[:excess]
+            del self._ts[:excess]
+            if self._day is not None:
+                del self._day[:excess]
+
+    def append(self, record):
+        """기록 추가 (과거 시각이면 정렬 위치에 삽입)"""
+        if self._ts and record.ts < self._ts[-1]:
+            index = bisect_right(self._ts, record.ts)
+        else:
+            index = len(self._records)
+        self._push(index, record)
+        self._trim()
+
+    def extend(self, records):
+        """여러 기록 한 번에 추가 - 과거 기록이 섞이면 병합 정렬 1회 후 컬럼 재구성"""
+        records = sorted(records, key=lambda r: r.ts)
+        if not records:
+            return
+        
+        if self._ts and records[0].ts < self._ts[-1]:
+            merged = sorted(self._records + records, key=lambda r: r.ts)
+            self._records = []
+            self._ts = array('d')
+            self._day = array('l') if self._day is not None else None
+            records = merged
+        
+        for record in records:
+            self._push(len(self._records), record)
+        self._trim()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+    @property
+    def timestamps(self):
+        return self._ts
+
+    @property
+    def days(self):
+        return self._day
+
+    def since(self, ts):
+        """ts 이후(초과) 기록"""
+        return self._records[bisect_right(self._ts, ts):]
+
+    def count_since(self, ts):
+        return len(self._records) - bisect_right(self._ts, ts)
+
+    def count_since_day(self, day):
+        """day(ordinal) 이후(포함) 기록 수"""
+        return len(self._records) - bisect_left(self._day, day)
+
+    def count_on_day(self, day):
+        return bisect_right(self._day, day) - bisect_left(self._day, day)
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self._records]
+
+# ============================================================================
+# 1-2. 기록 저장소 (Storage Backend)
+# ============================================================================
+
+class RecordStore:
+    """기록 저장소 인터페이스 - 사용자/이력 종류별 append-only 기록"""
+
+    kind = 'base'
+
+    def append(self, user_id, history, record):
+        raise NotImplementedError
+
+    def extend(self, user_id, history, records):
+        """여러 기록 한 번에 저장 (대량 가져오기)"""
+        for record in records:
+            self.append(user_id, history, record)
+
+    def load(self, user_id, history, limit=None, since=None):
+        """최근 limit개 (since: 이 ISO 시각 이후 기록만)"""
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+class SessionOnlyRecordStore(RecordStore):
+    """저장하지 않음 - 기록은 세션 안에만 (저장소 미설정 시 기본값)"""
+
+    kind = 'session'
+
+    def append(self, user_id, history, record):
+        pass
+
+    def extend(self, user_id, history, records):
+        pass
+
+    def load(self, user_id, history, limit=None, since=None):
+        return []
+
+class MemoryRecordStore(RecordStore):
+    """프로세스 메모리 저장소 (테스트용 - 상한/만료가 없어 운영에는 쓰지 않음)"""
+
+    kind = 'memory'
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def append(self, user_id, history, record):
+        with self._lock:
+            self._data.setdefault((user_id, history), []).append(dict(record))
+
+    def extend(self, user_id, history, records):
+        with self._lock:
+            self._data.setdefault((user_id, history), []).extend(dict(r) for r in records)
+
+    def load(self, user_id, history, limit=None, since=None):
+        with self._lock:
+            records = self._data.get((user_id, history), [])
+            if since is not None:
+                records = [r for r in records if (r.get('timestamp') or '') >= since]
+            if limit is not None:
+                records = records[-limit:]
+            return [dict(r) for r in records]
+
+class SQLiteRecordStore(RecordStore):
+    """SQLite 저장소 - WAL 모드, 배치 쓰기"""
+
+    kind = 'sqlite'
+
+    def __init__(self, path, batch_size=50, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                history TEXT NOT NULL,
+                timestamp TEXT,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_records_user_history ON records (user_id, history, id)"
+        )
+        
+        atexit.register(self.flush)
+
+    def append(self, user_id, history, record):
+        row = (user_id, history, record.get('timestamp'), json.dumps(record, ensure_ascii=False, default=str))
+        
+        with self._lock:
+            self._pending.append(row)
+            if (len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def extend(self, user_id, history, records):
+        rows = [
+            (user_id, history, record.get('timestamp'), json.dumps(record, ensure_ascii=False, default=str))
+            for record in records
+        ]
+        
+        with self._lock:
+            self._pending.extend(rows)
+            self._flush_locked()
+
+    def load(self, user_id, history, limit=None, since=None):
+        with self._lock:
+            self._flush_locked()
+            if since is None:
+                rows = self._conn.execute(
+                    "SELECT payload FROM records WHERE user_id = ? AND history = ? ORDER BY id DESC LIMIT ?",
+                    (user_id, history, -1 if limit is None else limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT payload FROM records WHERE user_id = ? AND history = ? AND timestamp >= ?"
+                    " ORDER BY id DESC LIMIT ?",
+                    (user_id, history, since, -1 if limit is None else limit)
+                ).fetchall()
+        
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        
+        pending, self._pending = self._pending, []
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT INTO records (user_id, history, timestamp, payload) VALUES (?, ?, ?, ?)",
+                pending
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            self._pending = pending + self._pending
+            raise
+
+@st.cache_resource
+def get_record_store():
+    """공유 저장소 - GINI_DB_PATH 설정 시 SQLite, 아니면 세션에만 보관 (GINI_RECORD_STORE=memory는 테스트용)"""
+    db_path = get_setting("GINI_DB_PATH")
+    
+    if db_path:
+        return SQLiteRecordStore(
+            db_path,
+            batch_size=int(get_setting("GINI_DB_BATCH_SIZE", 50)),
+            flush_interval=float(get_setting("GINI_DB_FLUSH_INTERVAL", 2.0))
+        )
+    
+    if get_setting("GINI_RECORD_STORE", "") == 'memory':
+        return MemoryRecordStore()
+    
+    return SessionOnlyRecordStore()
+
+# 이력 종류별 세션 보관 개수 (저장소 로드 시)
+HISTORY_LIMITS = {
+    'crisis_history': 100,
+    'emotion_history': 50,
+    'social_interactions': 90
+}
+
+# 이력 종류별 보관 일수 (개수 대신 기간으로 자르는 이력)
+HISTORY_HORIZON_DAYS = {
+    'sleep_data': 365,
+    'exercise_records': 365,
+    'meal_records': 365
+}
+
+def horizon_start_day(horizon_days):
+    """보관 기간 첫날 (ordinal) - 오늘 포함 horizon_days일"""
+    return date.today().toordinal() - horizon_days + 1
+
+def horizon_since(horizon_days):
+    """저장소 load(since=)용 ISO 시각 - 수면은 기상일 기준이라 하루 앞서 읽고 RecordHistory가 날짜로 자름"""
+    return datetime.combine(date.fromordinal(horizon_start_day(horizon_days) - 1), datetime.min.time()).isoformat()
+
+def get_user_id():
+    """사용자 식별자 - URL의 uid 파라미터로 재접속 시 복원
+
+    uid를 아는 사람은 누구나 그 기록을 볼 수 있으므로, 저장소가 없을 때는 주소에 쓰지 않는다.
+    """
+    if 'user_id' not in st.session_state:
+        user_id = None
+        try:
+            user_id = st.query_params.get('uid')
+        except Exception:
+            pass
+        
+        if not user_id or not re.fullmatch(r'[0-9a-f]{32}', user_id):
+            user_id = uuid.uuid4().hex
+            if get_record_store().kind != 'session':
+                try:
+                    st.query_params['uid'] = user_id
+                except Exception:
+                    pass
+        
+        st.session_state.user_id = user_id
+    
+    return st.session_state.user_id
+
+def load_history(history):
+    """저장소에서 이력 로드 (세션 최초 접근 시)"""
+    since = None
+    if history in HISTORY_HORIZON_DAYS:
+        since = horizon_since(HISTORY_HORIZON_DAYS[history])
+    
+    return get_record_store().load(get_user_id(), history, HISTORY_LIMITS.get(history), since)
+
+def persist_record(history, record):
+    """기록을 저장소에 write-through"""
+    if hasattr(record, 'to_dict'):
+        record = record.to_dict()
+    get_record_store().append(get_user_id(), history, record)
+
+def persist_records(history, records):
+    """여러 기록을 저장소에 한 번에 (배치 1회)"""
+    get_record_store().extend(get_user_id(), history, [record.to_dict() for record in records])
+
+def init_record_history(history, record_type):
+    """세션 이력을 RecordHistory로 준비 (없으면 저장소에서 로드, 구버전 dict 리스트는 변환)"""
+    value = st.session_state.get(history)
+    
+    if value is None:
+        records = [record_type.from_dict(d) for d in load_history(history)]
+    elif isinstance(value, list):
+        records = [record_type.from_dict(d) for d in value]
+    else:
+        return
+    
+    st.session_state[history] = RecordHistory(
+        record_type,
+        HISTORY_LIMITS.get(history),
+        records,
+        HISTORY_HORIZON_DAYS.get(history)
+    )
+
+# ============================================================================
+# 1-3. 공통 키워드 매처 (Aho-Corasick)
+# ============================================================================
+
+class KeywordMatcher:
+    """여러 키워드 사전을 한 번에 스캔하는 Aho-Corasick 오토마톤
+
+    lexicons: [(category, level, keywords), ...]
+    scan() 결과: {(category, level): [keyword, ...]} - 사전에 등록된 순서 유지
+    """
+
+    def __init__(self, lexicons):
+        self.entries = []      # (keyword, category, level)
+        self._goto = [{}]      # 상태별 전이
+        self._fail = [0]       # 실패 링크
+        self._out = [[]]       # 상태별 매칭 entry 인덱스
+
+        for category, level, keywords in lexicons:
+            for keyword in keywords:
+                self._add(keyword.lower(), len(self.entries))
+                self.entries.append((keyword, category, level))
+
+        self._build()
+
+    def _add(self, keyword, entry_id):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(entry_id)
+
+    def _build(self):
+        # BFS로 실패 링크 계산 및 출력 병합
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail_target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = fail_target if fail_target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text):
+        """텍스트 1회 스캔 - 카테고리/레벨별 히트 반환"""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        matched = set()
+
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                matched.update(out[state])
+
+        hits = {}
+        for entry_id in sorted(matched):
+            keyword, category, level = self.entries[entry_id]
+            hits.setdefault((category, level), []).append(keyword)
+
+        return hits
+
+def build_keyword_lexicons():
+    """모든 분석기 키워드 사전 목록"""
+    lexicons = [
+        ('crisis', 3, CRISIS_KEYWORDS_L3),
+        ('crisis', 2, CRISIS_KEYWORDS_L2),
+        ('crisis', 1, CRISIS_KEYWORDS_L1),
+        ('mitigator', None, CONTEXT_MITIGATORS),
+    ]
+    lexicons += [('emotion', emotion, keywords) for emotion, keywords in EMOTION_KEYWORDS.items()]
+    lexicons += [('modifier', kind, words) for kind, words in CONTEXT_MODIFIERS.items()]
+    lexicons += [('isolation', level, keywords) for level, keywords in ISOLATION_KEYWORDS.items()]
+    lexicons += [('toxic', pattern_type, keywords) for pattern_type, keywords in TOXIC_PATTERNS.items()]
+    return lexicons
+
+@st.cache_resource
+def get_keyword_matcher():
+    """프로세스당 1회 생성되는 공유 매처"""
+    return KeywordMatcher(build_keyword_lexicons())
+
+@traced()
+def scan_keywords(text):
+    """메시지 1회 스캔 결과 (모든 분석기 공용)"""
+    return get_keyword_matcher().scan(text)
+
+# ============================================================================
+# 1-4. 리런 단위 지표 스냅샷 캐시
+# ============================================================================
+
+def begin_rerun():
+    """스크립트 실행 시작 - 지표 캐시 비우고 기준 시각 고정"""
+    st.session_state.metric_cache = {'now': datetime.now(), 'values': {}}
+
+def _get_metric_cache():
+    if 'metric_cache' not in st.session_state:
+        begin_rerun()
+    return st.session_state.metric_cache
+
+def rerun_now():
+    """이번 실행의 기준 시각 (모든 지표가 같은 now 사용)"""
+    return _get_metric_cache()['now']
+
+def invalidate_metrics(*names):
+    """지표 캐시 무효화 - 이름 없으면 전체 + 기준 시각 갱신"""
+    if not names:
+        begin_rerun()
+        return
+    
+    values = _get_metric_cache()['values']
+    for name in names:
+        values.pop(name, None)
+
+def rerun_cached(func):
+    """이번 실행 동안 1회만 계산하는 지표 함수용 데코레이터"""
+    @functools.wraps(func)
+    def wrapper():
+        values = _get_metric_cache()['values']
+        key = func.__name__
+        if key not in values:
+            values[key] = func()
+        return values[key]
+    return wrapper
+
+# ============================================================================
+# 1-5. 확인 메시지 (flash) - 다음 실행 1회만 표시
+# ============================================================================
+
+def flash(message, kind='success', details=(), balloons=False):
+    """st.rerun() 직전에 남기는 확인 메시지 - 스레드를 재우지 않고 다음 화면에서 표시"""
+    st.session_state.setdefault('flash_messages', []).append({
+        'kind': kind,
+        'message': message,
+        'details': list(details),
+        'balloons': balloons
+    })
+
+def show_flash_messages():
+    """이전 실행에서 남긴 확인 메시지를 표시하고 비움"""
+    messages = st.session_state.pop('flash_messages', None)
+    if not messages:
+        return
+    
+    for item in messages:
+        getattr(st, item['kind'])(item['message'])
+        for line in item['details']:
+            st.write(line)
+        if item['balloons']:
+            st.balloons()
+
+# ============================================================================
+# 1-6. 정적 콘텐츠 블록 - 프로세스당 1회 조립, 세션 간 공유
+# ============================================================================
+
+def markdown_lines(items, bullet="- "):
+    """목록을 한 번에 그릴 마크다운 한 덩어리로 (bullet 없으면 문단 구분)"""
+    if bullet:
+        return "\n".join(f"{bullet}{item}" for item in items)
+    return "\n\n".join(items)
+
+@st.cache_resource
+def get_static_blocks():
+    """페이지별 정적 마크다운 - 리런마다 다시 만들지 않음 (동적 값은 표시 시점에 치환)"""
+    return {
+        'reality_suggestions': {
+            category: markdown_lines(items)
+            for category, items in get_reality_social_suggestions().items()
+        },
+        'community_resources': {
+            category: markdown_lines(items)
+            for category, items in get_community_resources().items()
+        },
+        'digital_tips': {
+            category: markdown_lines(items)
+            for category, items in get_digital_connection_tips().items()
+        },
+        'sns_safety': {
+            category: markdown_lines(items, bullet="")
+            for category, items in get_sns_safety_guide().items()
+        },
+        'disclaimer_terms': textwrap.dedent(DISCLAIMER_TERMS_TEMPLATE).strip(),
+        'cbti_sections': tuple((title, textwrap.dedent(body).strip()) for title, body in CBTI_SECTIONS),
+        'cbti_prescription': CBTI_PRESCRIPTION_TEMPLATE.strip(),
+        'breathing_steps': {
+            name: breathing_steps_markdown(pattern) for name, pattern in BREATHING_PATTERNS.items()
+        },
+        'breathing_animation': {
+            name: breathing_animation_html(pattern) for name, pattern in BREATHING_PATTERNS.items()
+        }
+    }
+
 # ============================================================================
 # 2. ESP v2.5 - Enhanced Crisis Detection Engine
 # ============================================================================
@@ -140,28 +1512,18 @@ CONTEXT_MITIGATORS = [
     "느낌", "기분", "ㅋㅋ", "ㅎㅎ", "웃"
 ]
 
-def analyze_crisis_level(text):
+@traced()
+def analyze_crisis_level(text, hits=None):
     """다단계 위기 레벨 분석"""
-    text_lower = text.lower()
-    matched_keywords = []
-    is_metaphor = False
-    
-    for mitigator in CONTEXT_MITIGATORS:
-        if mitigator in text_lower:
-            is_metaphor = True
-            break
-    
-    for keyword in CRISIS_KEYWORDS_L3:
-        if keyword in text_lower:
-            matched_keywords.append((keyword, 3))
+    if hits is None:
+        hits = scan_keywords(text)
     
-    for keyword in CRISIS_KEYWORDS_L2:
-        if keyword in text_lower:
-            matched_keywords.append((keyword, 2))
+    is_metaphor = bool(hits.get(('mitigator', None)))
     
-    for keyword in CRISIS_KEYWORDS_L1:
-        if keyword in text_lower:
-            matched_keywords.append((keyword, 1))
+    matched_keywords = []
+    for level in (3, 2, 1):
+        for keyword in hits.get(('crisis', level), []):
+            matched_keywords.append((keyword, level))
     
     if not matched_keywords:
         return (0, [], False)
@@ -173,54 +1535,84 @@ def analyze_crisis_level(text):
     
     return (max_level, matched_keywords, is_metaphor)
 
+CRISIS_HISTORY_MAX = HISTORY_LIMITS['crisis_history']
+
+class SlidingWindowCounter:
+    """epoch 타임스탬프 deque 기반 슬라이딩 윈도우 카운터 (만료는 조회 시 지연 처리)"""
+
+    def __init__(self, window_seconds, maxlen=None):
+        self.window_seconds = window_seconds
+        self._times = deque(maxlen=maxlen)
+
+    def add(self, ts):
+        self._times.append(ts)
+
+    def count(self, now=None):
+        if now is None:
+            now = time.time()
+        
+        cutoff = now - self.window_seconds
+        times = self._times
+        while times and times[0] <= cutoff:
+            times.popleft()
+        
+        return len(times)
+
+def build_crisis_counters(crisis_history):
+    """7일/30일 위기 카운터 생성 (기존 이력은 1회만 파싱)"""
+    counters = {
+        '7d': SlidingWindowCounter(7 * 86400, maxlen=CRISIS_HISTORY_MAX),
+        '30d': SlidingWindowCounter(30 * 86400, maxlen=CRISIS_HISTORY_MAX)
+    }
+    
+    for event in crisis_history:
+        counters['7d'].add(event.ts)
+        counters['30d'].add(event.ts)
+    
+    return counters
+
 def record_crisis_event(level, keywords, text, is_metaphor):
     """위기 이벤트 기록"""
-    crisis_event = {
-        'timestamp': datetime.now().isoformat(),
-        'level': level,
-        'keywords': [kw[0] for kw in keywords],
-        'text_sample': text[:100],
-        'is_metaphor': is_metaphor
-    }
+    now = datetime.now()
+    crisis_event = CrisisEvent(
+        now.timestamp(),
+        level,
+        [kw[0] for kw in keywords],
+        text[:100],
+        is_metaphor
+    )
     
     st.session_state.crisis_history.append(crisis_event)
-    st.session_state.last_crisis_time = datetime.now()
+    persist_record('crisis_history', crisis_event)
+    st.session_state.last_crisis_time = now
     st.session_state.crisis_level = level
     
-    if len(st.session_state.crisis_history) > 100:
-        st.session_state.crisis_history = st.session_state.crisis_history[-100:]
+    st.session_state.crisis_counters['7d'].add(crisis_event.ts)
+    st.session_state.crisis_counters['30d'].add(crisis_event.ts)
+    
+    get_metrics().crisis_events.inc(level=level)
+    invalidate_metrics()
 
+@rerun_cached
 def get_crisis_pattern():
-    """위기 패턴 분석"""
-    if len(st.session_state.crisis_history) == 0:
-        return {
-            'total_count': 0,
-            'recent_7days': 0,
-            'trend': 'stable'
-        }
-    
-    now = datetime.now()
-    recent_7days = [
-        c for c in st.session_state.crisis_history
-        if datetime.fromisoformat(c['timestamp']) > now - timedelta(days=7)
-    ]
+    """위기 패턴 분석 (슬라이딩 윈도우 카운터 O(1) 조회)"""
+    counters = st.session_state.crisis_counters
+    now = rerun_now().timestamp()
     
-    recent_30days = [
-        c for c in st.session_state.crisis_history
-        if datetime.fromisoformat(c['timestamp']) > now - timedelta(days=30)
-    ]
+    recent_7days = counters['7d'].count(now)
+    recent_30days = counters['30d'].count(now)
     
-    if len(recent_7days) > 3:
+    if recent_7days > 3:
         trend = 'worsening'
-    elif len(recent_7days) > 0:
+    elif recent_7days > 0:
         trend = 'concerning'
     else:
         trend = 'stable'
     
     return {
         'total_count': len(st.session_state.crisis_history),
-        'recent_7days': len(recent_7days),
-        'recent_30days': len(recent_30days),
+        'recent_7days': recent_7days,
+        'recent_30days': recent_30days,
         'trend': trend
     }
 
@@ -338,46 +1730,25 @@ CONTEXT_MODIFIERS = {
     '의문': ['?', '일까', '건가', '까요']
 }
 
-def detect_emotions(text):
+def detect_emotions(text, hits=None):
     """텍스트에서 감정 감지"""
-    text_lower = text.lower()
-    detected = {emotion: [] for emotion in EMOTION_KEYWORDS.keys()}
+    if hits is None:
+        hits = scan_keywords(text)
     
-    for emotion, keywords in EMOTION_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                detected[emotion].append(keyword)
-    
-    return detected
+    return {emotion: list(hits.get(('emotion', emotion), [])) for emotion in EMOTION_KEYWORDS.keys()}
 
-def analyze_context(text):
+def analyze_context(text, hits=None):
     """문맥 분석 - 강도 수식어 감지"""
-    text_lower = text.lower()
+    if hits is None:
+        hits = scan_keywords(text)
+    
     modifiers = {
-        'intensifier': False,  # 강화
-        'weakener': False,     # 약화
-        'negation': False,     # 부정
-        'question': False      # 의문
+        'intensifier': bool(hits.get(('modifier', '강화'))),  # 강화
+        'weakener': bool(hits.get(('modifier', '약화'))),     # 약화
+        'negation': bool(hits.get(('modifier', '부정'))),     # 부정
+        'question': bool(hits.get(('modifier', '의문')))      # 의문
     }
     
-    for word in CONTEXT_MODIFIERS['강화']:
-        if word in text_lower:
-            modifiers['intensifier'] = True
-            break
-    
-    for word in CONTEXT_MODIFIERS['약화']:
-        if word in text_lower:
-            modifiers['weakener'] = True
-            break
-    
-    for word in CONTEXT_MODIFIERS['부정']:
-        if word in text_lower:
-            modifiers['negation'] = True
-            break
-    
-    if '?' in text or any(word in text_lower for word in CONTEXT_MODIFIERS['의문']):
-        modifiers['question'] = True
-    
     return modifiers
 
 def calculate_emotion_score(detected_emotions, context):
@@ -434,10 +1805,14 @@ def calculate_emotion_score(detected_emotions, context):
     else:
         return 5  # E5: 위기
 
-def detect_emotion_level(text):
+@traced()
+def detect_emotion_level(text, hits=None):
     """감정 레벨 전체 분석"""
-    detected = detect_emotions(text)
-    context = analyze_context(text)
+    if hits is None:
+        hits = scan_keywords(text)
+    
+    detected = detect_emotions(text, hits)
+    context = analyze_context(text, hits)
     e_score = calculate_emotion_score(detected, context)
     
     return {
@@ -448,20 +1823,21 @@ def detect_emotion_level(text):
 
 def record_emotion_event(e_score, detected_emotions, text_sample):
     """감정 이벤트 기록"""
-    emotion_event = {
-        'timestamp': datetime.now().isoformat(),
-        'e_score': e_score,
-        'detected_emotions': {k: v for k, v in detected_emotions.items() if v},
-        'text_sample': text_sample[:100]
-    }
+    now = datetime.now()
+    emotion_event = EmotionEvent(
+        now.timestamp(),
+        e_score,
+        {k: v for k, v in detected_emotions.items() if v},
+        text_sample[:100]
+    )
     
+    # 최근 50개만 유지 (RecordHistory maxlen)
     st.session_state.emotion_history.append(emotion_event)
+    persist_record('emotion_history', emotion_event)
     st.session_state.emotion_score = e_score
-    st.session_state.last_emotion_check = datetime.now()
+    st.session_state.last_emotion_check = now
     
-    # 최근 50개만 유지
-    if len(st.session_state.emotion_history) > 50:
-        st.session_state.emotion_history = st.session_state.emotion_history[-50:]
+    invalidate_metrics()
 
 def get_emotion_response(e_score, isolation_score, crisis_pattern):
     """E-Score 기반 반응 메시지 생성"""
@@ -581,6 +1957,7 @@ def get_emotion_response(e_score, isolation_score, crisis_pattern):
         # E5: 위기 - 즉시 Crisis Engine 발동
         return None  # Crisis Engine이 처리
 
+@traced()
 def check_emotion_intervention():
     """감정 개입 필요 여부 체크"""
     e_score = st.session_state.emotion_score
@@ -597,82 +1974,367 @@ def check_emotion_intervention():
     }
 
 # ============================================================================
-# Groq AI 상담 엔진 (라이라 + 제미나이 설계)
+# 메시지 분석 파이프라인 (채팅 1턴 = 1회 분석)
 # ============================================================================
 
-def determine_forced_intervention():
-    """강제 개입 필요성 판단 (제미나이 설계)"""
-    e_score = st.session_state.emotion_score
-    isolation = st.session_state.isolation_score
-    crisis = get_crisis_pattern()
-    days_exercise = days_since_last_exercise()
-    hours_meal = hours_since_last_meal()
+@dataclass(frozen=True)
+class MessageAnalysis:
+    """채팅 1턴 분석 결과 (불변) - 기록/프롬프트/로그가 모두 이 객체를 공유"""
+    text: str
+    hits: dict
+    emotion: dict                # detect_emotion_level 결과
+    crisis_level: int
+    crisis_keywords: tuple       # ((keyword, level), ...)
+    is_metaphor: bool
+    isolation: dict              # detect_isolation_keywords 결과
+    toxic_patterns: tuple
+    crisis_pattern: dict = None  # 기록 반영 후 위기 패턴
+    forced_intervention: dict = None
+
+    @property
+    def e_score(self):
+        return self.emotion['score']
+
+    @property
+    def has_crisis(self):
+        return self.crisis_level > 0
+
+def record_message_analysis(analysis):
+    """분석 결과를 감정/위기 이력에 기록"""
+    record_emotion_event(analysis.e_score, analysis.emotion['emotions'], analysis.text)
+    
+    if analysis.has_crisis:
+        record_crisis_event(
+            analysis.crisis_level,
+            list(analysis.crisis_keywords),
+            analysis.text,
+            analysis.is_metaphor
+        )
+
+@traced()
+def analyze_message(text, record=True):
+    """채팅 메시지 통합 분석 - 키워드 1회 스캔, 모든 신호 1회 계산"""
+    hits = scan_keywords(text)
+    crisis_level, crisis_keywords, is_metaphor = analyze_crisis_level(text, hits)
+    
+    analysis = MessageAnalysis(
+        text=text,
+        hits=hits,
+        emotion=detect_emotion_level(text, hits),
+        crisis_level=crisis_level,
+        crisis_keywords=tuple(crisis_keywords),
+        is_metaphor=is_metaphor,
+        isolation=detect_isolation_keywords(text, hits),
+        toxic_patterns=tuple(detect_toxic_social_pattern(text, hits))
+    )
     
-    # 1순위: E5 or Crisis Level 3
-    if e_score >= 5 or crisis['recent_7days'] >= 3:
-        return {
-            'required': True,
-            'tone': 'Crisis',
-            'priority': 1,
-            'message': f"🚨 위기 상태 감지\n- 감정: E{e_score}\n- 위기 신호: {crisis['recent_7days']}회\n\n즉각적인 안전 확보가 필요합니다."
-        }
+    if record:
+        record_message_analysis(analysis)
     
-    # 2순위: 고립 85+ or 24시간 공복
-    if isolation >= 85 or hours_meal >= 24:
-        return {
-            'required': True,
-            'tone': 'Crisis',
-            'priority': 2,
-            'message': f"🚨 긴급 개입 필요\n- 고립: {isolation}/100\n- 공복: {hours_meal:.0f}시간\n\n신체/정신 건강이 위험합니다."
-        }
+    crisis_pattern = get_crisis_pattern()
+    forced = determine_forced_intervention()
     
-    # 3순위: E4 + 고립 70+
-    if e_score >= 4 and isolation >= 70:
-        return {
-            'required': True,
-            'tone': 'Directive',
-            'priority': 3,
-            'message': f"⚠️ 복합 위험 감지\n- 감정: E4 (심각)\n- 고립: {isolation}/100\n\n즉시 행동이 필요합니다."
-        }
+    metrics = get_metrics()
+    metrics.messages_analyzed.inc()
+    if forced['required']:
+        metrics.forced_interventions.inc(priority=forced['priority'])
     
-    # 4순위: 운동 7일+ or 식사 18시간+
-    if days_exercise >= 7 or hours_meal >= 18:
-        return {
-            'required': True,
-            'tone': 'Directive',
-            'priority': 4,
-            'message': f"⚠️ 생활 패턴 붕괴\n- 운동: {days_exercise}일 미실시\n- 식사: {hours_meal:.0f}시간 전\n\n기본 루틴 회복이 시급합니다."
-        }
+    return replace(
+        analysis,
+        crisis_pattern=crisis_pattern,
+        forced_intervention=forced
+    )
+
+# ============================================================================
+# 개입 규칙 엔진 (선언적 규칙 테이블 → 우선순위 목록)
+# ============================================================================
+
+# 규칙 조건이 참조할 수 있는 지표 (intervention_decision()의 스냅샷 키)
+INTERVENTION_METRICS = (
+    'e_score', 'isolation', 'crisis_7d', 'exercise_days', 'meal_hours',
+    'emergency_mode', 'sleep_intervention', 'sleep_debt', 'boundary_zone', 'recovery_confirmed',
+    'forced_tone', 'forced_priority'
+)
+
+RULE_OPERATORS = {
+    '>=': operator.ge,
+    '>': operator.gt,
+    '<=': operator.le,
+    '<': operator.lt,
+    '==': operator.eq,
+    '!=': operator.ne
+}
+
+# forced/tone/screen: 우선순위 순 첫 일치 1개, warning: 일치하는 것 모두
+RULE_GROUPS = ('forced', 'tone', 'screen', 'warning')
+INTERVENTION_SCREEN_NAMES = ('emergency', 'sleep', 'exercise', 'nutrition', 'social')
+INTERVENTION_WARNING_NAMES = ('exercise', 'nutrition', 'social')
+
+# 조건 문법: [지표, 연산자, 값] | {"all": [조건...]} | {"any": [조건...]} ({"all": []}은 항상 참)
+# message는 스냅샷 값으로 format (예: {isolation}, {meal_hours:.0f})
+DEFAULT_INTERVENTION_RULES = [
+    # 강제 개입 (제미나이 설계) - AI 상담 톤/시스템 프롬프트
+    {'id': 'forced.crisis', 'group': 'forced', 'priority': 1, 'tone': 'Crisis',
+     'when': {'any': [['e_score', '>=', 5], ['crisis_7d', '>=', 3]]},
+     'message': "🚨 위기 상태 감지\n- 감정: E{e_score}\n- 위기 신호: {crisis_7d}회\n\n즉각적인 안전 확보가 필요합니다."},
+    {'id': 'forced.urgent', 'group': 'forced', 'priority': 2, 'tone': 'Crisis',
+     'when': {'any': [['isolation', '>=', 85], ['meal_hours', '>=', 24]]},
+     'message': "🚨 긴급 개입 필요\n- 고립: {isolation}/100\n- 공복: {meal_hours:.0f}시간\n\n신체/정신 건강이 위험합니다."},
+    {'id': 'forced.compound', 'group': 'forced', 'priority': 3, 'tone': 'Directive',
+     'when': {'all': [['e_score', '>=', 4], ['isolation', '>=', 70]]},
+     'message': "⚠️ 복합 위험 감지\n- 감정: E{e_score} (심각)\n- 고립: {isolation}/100\n\n즉시 행동이 필요합니다."},
+    {'id': 'forced.routine', 'group': 'forced', 'priority': 4, 'tone': 'Directive',
+     'when': {'any': [['exercise_days', '>=', 7], ['meal_hours', '>=', 18]]},
+     'message': "⚠️ 생활 패턴 붕괴\n- 운동: {exercise_days}일 미실시\n- 식사: {meal_hours:.0f}시간 전\n\n기본 루틴 회복이 시급합니다."},
+    {'id': 'forced.early', 'group': 'forced', 'priority': 5, 'tone': 'Directive',
+     'when': {'all': [['e_score', '>=', 3], {'any': [['exercise_days', '>=', 3], ['isolation', '>=', 40]]}]},
+     'message': "💛 주의 필요\n- 감정: E{e_score}\n- 운동/사회적 연결 부족\n\n조기 개입이 효과적입니다."},
+    
+    # Tone Engine - 강제 개입 톤이 있으면 우선, 없으면 4단계
+    {'id': 'tone.forced_crisis', 'group': 'tone', 'priority': 1,
+     'when': ['forced_tone', '==', 'Crisis'],
+     'tone': 'Crisis', 'label': "Crisis (위기)", 'description': "즉각적이고 단호한 어조",
+     'prompt': "톤: 즉각적이고 단호하게. '지금 당장' 강조. 전문가 연락처(1577-0199) 제공."},
+    {'id': 'tone.forced_directive', 'group': 'tone', 'priority': 2,
+     'when': ['forced_tone', '==', 'Directive'],
+     'tone': 'Directive', 'label': "Directive (강력 지시)", 'description': "단호하지만 공감적",
+     'prompt': "톤: 단호하지만 공감적으로. 명확한 행동 지시."},
+    {'id': 'tone.crisis', 'group': 'tone', 'priority': 3,
+     'when': {'any': [['e_score', '>=', 4], ['isolation', '>=', 85], ['crisis_7d', '>=', 3]]},
+     'tone': 'Crisis', 'label': "Crisis (위기)", 'description': "즉각적 안전 확보 우선",
+     'prompt': "톤: Crisis - 즉각 안전 확보"},
+    {'id': 'tone.directive', 'group': 'tone', 'priority': 4,
+     'when': {'any': [['e_score', '>=', 3], ['isolation', '>=', 70], ['crisis_7d', '>=', 1]]},
+     'tone': 'Directive', 'label': "Directive (강력 지시)", 'description': "구체적 행동 지시",
+     'prompt': "톤: Directive - 구체적 행동 지시"},
+    {'id': 'tone.neutral', 'group': 'tone', 'priority': 5,
+     'when': ['e_score', '>=', 2],
+     'tone': 'Neutral', 'label': "Neutral (중립)", 'description': "공감 + 실용적 조언",
+     'prompt': "톤: Neutral - 공감과 조언"},
+    {'id': 'tone.soft', 'group': 'tone', 'priority': 6,
+     'when': {'all': []},
+     'tone': 'Soft', 'label': "Soft (격려)", 'description': "따뜻하고 지지적",
+     'prompt': "톤: Soft - 따뜻한 격려"},
+    
+    # 개입 화면 (메인 우선순위) - 긴급 > 수면 > 운동 > 영양 > 사회
+    {'id': 'screen.emergency', 'group': 'screen', 'priority': 1,
+     'when': ['emergency_mode', '==', True], 'screen': 'emergency'},
+    {'id': 'screen.sleep', 'group': 'screen', 'priority': 2,
+     'when': {'any': [
+         ['sleep_intervention', '==', True],
+         {'all': [['boundary_zone', '==', True], ['recovery_confirmed', '==', False], ['sleep_debt', '>=', 5]]}
+     ]},
+     'screen': 'sleep'},
+    {'id': 'screen.exercise', 'group': 'screen', 'priority': 3,
+     'when': ['exercise_days', '>=', 3], 'screen': 'exercise'},
+    {'id': 'screen.nutrition', 'group': 'screen', 'priority': 4,
+     'when': ['meal_hours', '>=', 12], 'screen': 'nutrition'},
+    {'id': 'screen.social', 'group': 'screen', 'priority': 5,
+     'when': ['isolation', '>=', 70], 'screen': 'social'},
     
-    # 5순위: E3 + (운동 3일+ or 고립 40+)
-    if e_score >= 3 and (days_exercise >= 3 or isolation >= 40):
+    # Level 1 경고 (상단 띠)
+    {'id': 'warning.exercise', 'group': 'warning', 'priority': 1,
+     'when': {'all': [['exercise_days', '>=', 1], ['exercise_days', '<', 3]]}, 'warning': 'exercise'},
+    {'id': 'warning.nutrition', 'group': 'warning', 'priority': 2,
+     'when': {'all': [['meal_hours', '>=', 6], ['meal_hours', '<', 12]]}, 'warning': 'nutrition'},
+    {'id': 'warning.social', 'group': 'warning', 'priority': 3,
+     'when': {'all': [['isolation', '>=', 40], ['isolation', '<', 70]]}, 'warning': 'social'}
+]
+
+def compile_condition(condition, rule_id):
+    """조건 → 스냅샷 dict를 받는 predicate (지표/연산자는 컴파일 시점에 검증)"""
+    if isinstance(condition, dict):
+        if len(condition) != 1 or next(iter(condition)) not in ('all', 'any'):
+            raise ValueError(f"규칙 {rule_id}: 조건은 all/any 중 하나여야 합니다 - {condition}")
+        
+        combine = all if 'all' in condition else any
+        parts = tuple(compile_condition(part, rule_id) for part in next(iter(condition.values())))
+        return lambda snapshot: combine(part(snapshot) for part in parts)
+    
+    if not isinstance(condition, (list, tuple)) or len(condition) != 3:
+        raise ValueError(f"규칙 {rule_id}: 조건은 [지표, 연산자, 값] 형식이어야 합니다 - {condition}")
+    
+    metric, op, value = condition
+    if metric not in INTERVENTION_METRICS:
+        raise ValueError(f"규칙 {rule_id}: 알 수 없는 지표 '{metric}'")
+    if op not in RULE_OPERATORS:
+        raise ValueError(f"규칙 {rule_id}: 알 수 없는 연산자 '{op}'")
+    
+    compare = RULE_OPERATORS[op]
+    if op in ('==', '!='):
+        return lambda snapshot: compare(snapshot[metric], value)
+    # 대소 비교는 값이 없는 지표(None)에서 거짓
+    return lambda snapshot: snapshot[metric] is not None and compare(snapshot[metric], value)
+
+# message 검증용 스냅샷 - 모든 지표에 숫자 0 (형식 지정자 {x:.0f}까지 통과)
+RULE_MESSAGE_CHECK_SNAPSHOT = {metric: 0 for metric in INTERVENTION_METRICS}
+
+def check_rule_message(message, rule_id):
+    """message 템플릿을 컴파일 시점에 검증 (오타 지표가 평가 중 KeyError로 터지지 않게)"""
+    try:
+        str(message).format(**RULE_MESSAGE_CHECK_SNAPSHOT)
+    except KeyError as e:
+        raise ValueError(f"규칙 {rule_id}: message에 알 수 없는 지표 {e}") from None
+    except (ValueError, IndexError) as e:
+        raise ValueError(f"규칙 {rule_id}: message 형식 오류 - {e}") from None
+
+@dataclass(frozen=True)
+class InterventionRule:
+    """컴파일된 규칙 1개"""
+    id: str
+    group: str
+    priority: int
+    predicate: object
+    outputs: dict
+
+class InterventionRuleSet:
+    """규칙 테이블을 그룹별 우선순위 목록으로 컴파일 - 평가는 목록 순회뿐"""
+
+    def __init__(self, rules):
+        self.groups = {group: [] for group in RULE_GROUPS}
+        self.config_error = None
+        
+        for rule in rules:
+            rule_id = rule.get('id', '?')
+            group = rule.get('group')
+            if group not in self.groups:
+                raise ValueError(f"규칙 {rule_id}: 알 수 없는 그룹 '{group}'")
+            if group == 'screen' and rule.get('screen') not in INTERVENTION_SCREEN_NAMES:
+                raise ValueError(f"규칙 {rule_id}: 알 수 없는 화면 '{rule.get('screen')}'")
+            if group == 'warning' and rule.get('warning') not in INTERVENTION_WARNING_NAMES:
+                raise ValueError(f"규칙 {rule_id}: 알 수 없는 경고 '{rule.get('warning')}'")
+            
+            outputs = {
+                key: value for key, value in rule.items()
+                if key not in ('id', 'group', 'priority', 'when', 'enabled')
+            }
+            if 'message' in outputs:
+                check_rule_message(outputs['message'], rule_id)
+            self.groups[group].append(InterventionRule(
+                id=rule_id,
+                group=group,
+                priority=int(rule.get('priority', 0)),
+                predicate=compile_condition(rule.get('when', {'all': []}), rule_id),
+                outputs=outputs
+            ))
+        
+        for compiled in self.groups.values():
+            compiled.sort(key=lambda rule: rule.priority)
+
+    def first_match(self, group, snapshot):
+        for rule in self.groups[group]:
+            if rule.predicate(snapshot):
+                return rule
+        return None
+
+    def evaluate(self, snapshot):
+        """스냅샷 1개 → 개입 결정 (강제 개입 / 톤 / 개입 화면 / Level 1 경고)"""
+        snapshot = dict(snapshot)
+        
+        rule = self.first_match('forced', snapshot)
+        if rule is None:
+            forced = {'required': False, 'tone': None, 'priority': 0, 'message': None, 'rule': None}
+        else:
+            forced = {
+                'required': True,
+                'tone': rule.outputs.get('tone', 'Directive'),
+                'priority': rule.priority,
+                'message': rule.outputs.get('message', "").format(**snapshot),
+                'rule': rule.id
+            }
+        snapshot['forced_tone'] = forced['tone']
+        snapshot['forced_priority'] = forced['priority']
+        
+        rule = self.first_match('tone', snapshot)
+        tone = dict(rule.outputs, rule=rule.id) if rule else {
+            'tone': 'Soft', 'label': "Soft (격려)", 'description': "", 'prompt': "", 'rule': None
+        }
+        
+        rule = self.first_match('screen', snapshot)
+        
         return {
-            'required': True,
-            'tone': 'Directive',
-            'priority': 5,
-            'message': f"💛 주의 필요\n- 감정: E3\n- 운동/사회적 연결 부족\n\n조기 개입이 효과적입니다."
+            'snapshot': snapshot,
+            'forced': forced,
+            'tone': tone,
+            'screen': rule.outputs['screen'] if rule else None,
+            'warnings': [
+                rule.outputs['warning'] for rule in self.groups['warning']
+                if rule.predicate(snapshot)
+            ]
         }
+
+def load_intervention_rules():
+    """기본 규칙 + INTERVENTION_RULES_FILE(JSON 배열) 덮어쓰기
+    
+    같은 id는 항목 단위로 덮어쓰고, 새 id는 추가, "enabled": false면 제거.
+    예: [{"id": "forced.urgent", "when": {"any": [["isolation", ">=", 80], ["meal_hours", ">=", 20]]}}]
+    """
+    rules = OrderedDict((rule['id'], dict(rule)) for rule in DEFAULT_INTERVENTION_RULES)
+    
+    path = get_setting("INTERVENTION_RULES_FILE", "")
+    if path:
+        with open(path, encoding='utf-8') as f:
+            overrides = json.load(f)
+        
+        for override in overrides:
+            rule_id = override['id']
+            if override.get('enabled', True) is False:
+                rules.pop(rule_id, None)
+            elif rule_id in rules:
+                rules[rule_id].update(override)
+            else:
+                rules[rule_id] = dict(override)
+    
+    return list(rules.values())
+
+@st.cache_resource
+def get_intervention_rules():
+    """프로세스 공유 규칙 세트 (1회 컴파일)
+    
+    INTERVENTION_RULES_FILE이 잘못되어도 매 실행마다 죽지 않게 기본 규칙으로 대체하고 config_error에 남긴다.
+    """
+    config_error = None
+    try:
+        rule_set = InterventionRuleSet(load_intervention_rules())
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        config_error = f"{type(e).__name__}: {e}"
+        logging.getLogger(__name__).error("INTERVENTION_RULES_FILE 설정 오류 - 기본 규칙 사용 (%s)", config_error)
+        rule_set = InterventionRuleSet(DEFAULT_INTERVENTION_RULES)
     
-    return {'required': False, 'tone': None, 'priority': 0, 'message': None}
+    rule_set.config_error = config_error
+    return rule_set
 
-def get_tone_description(e_score, isolation, crisis_level, forced_intervention):
-    """Tone Engine - 4단계 톤 설명"""
+@rerun_cached
+def intervention_decision():
+    """이번 실행의 개입 결정 - 지표 스냅샷 1회, 규칙 평가 1회 (기록이 바뀌면 invalidate_metrics로 재평가)
     
-    if forced_intervention and forced_intervention['required']:
-        tone = forced_intervention['tone']
-        if tone == 'Crisis':
-            return "Crisis (위기)", "즉각적이고 단호한 어조"
-        elif tone == 'Directive':
-            return "Directive (강력 지시)", "단호하지만 공감적"
-    
-    if e_score >= 4 or isolation >= 85 or crisis_level >= 3:
-        return "Crisis (위기)", "즉각적 안전 확보 우선"
-    elif e_score >= 3 or isolation >= 70 or crisis_level >= 1:
-        return "Directive (강력 지시)", "구체적 행동 지시"
-    elif e_score >= 2:
-        return "Neutral (중립)", "공감 + 실용적 조언"
-    else:
-        return "Soft (격려)", "따뜻하고 지지적"
+    고립 점수는 render_app() 시작에서 update_isolation_score()로 갱신된 값을 읽기만 한다.
+    """
+    return get_intervention_rules().evaluate({
+        'e_score': st.session_state.emotion_score,
+        'isolation': st.session_state.isolation_score,
+        'crisis_7d': get_crisis_pattern()['recent_7days'],
+        'exercise_days': days_since_last_exercise(),
+        'meal_hours': hours_since_last_meal(),
+        'emergency_mode': bool(st.session_state.emergency_mode),
+        'sleep_intervention': bool(st.session_state.intervention_mode),
+        'sleep_debt': get_sleep_stats()['debt_hours'],
+        'boundary_zone': check_boundary_zone(),
+        'recovery_confirmed': bool(st.session_state.recovery_confirmed)
+    })
+
+# ============================================================================
+# Groq AI 상담 엔진 (라이라 + 제미나이 설계)
+# ============================================================================
+
+def determine_forced_intervention():
+    """강제 개입 필요성 판단 (규칙 테이블 forced 그룹)"""
+    return intervention_decision()['forced']
+
+def get_tone_description():
+    """Tone Engine - 4단계 톤 (이름, 설명)"""
+    tone = intervention_decision()['tone']
+    return tone['label'], tone['description']
 
 def get_system_context():
     """현재 시스템 상태 컨텍스트"""
@@ -693,81 +2355,864 @@ def get_system_context():
 
 def build_system_prompt():
     """Groq API용 System Prompt 생성 (단순화)"""
-    
-    forced = determine_forced_intervention()
+    decision = intervention_decision()
+    snapshot = decision['snapshot']
     
     # 기본 역할 (짧게)
     base_prompt = "당신은 정신건강 회복 AI 상담사입니다. 따뜻하고 공감적으로 대화하되, 짧고 명확하게 답변하세요(3-5문장). 절대 '메뉴', '설정', '대시보드' 같은 시스템 용어는 사용하지 마세요.\n\n"
     
     # 현재 상태 (간단하게)
-    e_score = st.session_state.emotion_score
-    isolation = st.session_state.isolation_score
-    crisis_level = get_crisis_pattern()['recent_7days']
-    
-    base_prompt += f"사용자 상태: 감정 E{e_score}, 고립 {isolation}/100, 위기 {crisis_level}회\n\n"
+    base_prompt += f"사용자 상태: 감정 E{snapshot['e_score']}, 고립 {snapshot['isolation']}/100, 위기 {snapshot['crisis_7d']}회\n\n"
     
     # 톤 적용 (간단하게)
-    if forced and forced['required']:
-        if forced['tone'] == 'Crisis':
-            base_prompt += "톤: 즉각적이고 단호하게. '지금 당장' 강조. 전문가 연락처(1577-0199) 제공.\n"
-        else:
-            base_prompt += "톤: 단호하지만 공감적으로. 명확한 행동 지시.\n"
-    else:
-        if e_score >= 4 or isolation >= 85 or crisis_level >= 3:
-            base_prompt += "톤: Crisis - 즉각 안전 확보\n"
-        elif e_score >= 3 or isolation >= 70 or crisis_level >= 1:
-            base_prompt += "톤: Directive - 구체적 행동 지시\n"
-        elif e_score >= 2:
-            base_prompt += "톤: Neutral - 공감과 조언\n"
-        else:
-            base_prompt += "톤: Soft - 따뜻한 격려\n"
+    base_prompt += decision['tone']['prompt'] + "\n"
     
     return base_prompt
 
-def call_groq_api(messages):
-    """Groq API 호출"""
+class KeepAliveAdapter(HTTPAdapter):
+    """TCP keep-alive 소켓 옵션을 켠 커넥션 풀 어댑터"""
+
+    def __init__(self, keepalive_idle=60, **kwargs):
+        self.keepalive_idle = keepalive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(self.keepalive_idle)))
+        kwargs['socket_options'] = options
+        super().init_poolmanager(*args, **kwargs)
+
+class LLMHttpClient:
+    """세션/리런 간 공유되는 LLM HTTP 클라이언트 - 커넥션 풀 + 요청별 데드라인"""
+
+    def __init__(self, pool_size=20, connect_timeout=5.0, request_timeout=30.0, keepalive_idle=60):
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        
+        self.session = requests.Session()
+        adapter = KeepAliveAdapter(
+            keepalive_idle=keepalive_idle,
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=0
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Connection'] = 'keep-alive'
+        
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='llm-http')
+
+    def _post(self, url, payload, headers, timeout, stream):
+        """워커 스레드에서 실행 - 데드라인은 워커가 요청을 집은 시점부터 (큐 대기 시간 제외)
+
+        requests의 read timeout은 read 1회 기준이라 조금씩 흘러나오는 응답은 끝없이 슬롯을 붙잡는다.
+        그래서 본문을 조각 단위로 읽으며 전체 경과 시간을 확인하고, 넘으면 응답을 닫는다.
+        스트리밍 응답은 response.deadline을 달아 돌려주고 소비 측(iter_sse_deltas)이 같은 방식으로 확인한다.
+        """
+        deadline = time.monotonic() + timeout
+        response = self.session.post(
+            url, json=payload, headers=headers, timeout=(self.connect_timeout, timeout), stream=True
+        )
+        response.deadline = deadline
+        if stream:
+            return response
+        
+        try:
+            response._content = b"".join(iter_response_chunks(response))
+        except BaseException:
+            response.close()
+            raise
+        
+        return response
+
+    def submit(self, url, payload, headers=None, timeout=None, stream=False):
+        """비동기 요청 - concurrent.futures.Future 반환"""
+        timeout = self.request_timeout if timeout is None else timeout
+        return self._executor.submit(self._post, url, payload, headers, timeout, stream)
+
+    def post_json(self, url, payload, headers=None, timeout=None, stream=False):
+        """동기 요청 - 워커가 요청을 집은 뒤 전체 데드라인(timeout초) 초과 시 requests Timeout
+
+        데드라인은 워커 안에서 지키므로(연결/헤더/본문 포함) 여기서는 결과만 기다린다.
+        """
+        return self.submit(url, payload, headers, timeout, stream).result()
+
+# 본문 읽기 단위 (조각마다 데드라인 확인)
+RESPONSE_CHUNK_SIZE = 8192
+
+def check_deadline(response):
+    """응답 전체 데드라인(response.deadline) 초과 시 응답을 닫고 requests Timeout"""
+    deadline = getattr(response, 'deadline', None)
+    if deadline is not None and time.monotonic() > deadline:
+        response.close()
+        raise requests.exceptions.Timeout("LLM 요청 데드라인 초과")
+
+def iter_response_chunks(response):
+    """본문을 도착하는 대로 읽으며 조각마다 데드라인 확인
+
+    iter_content(n)/iter_lines()는 n바이트가 찰 때까지 막히므로 read1(도착한 만큼)을 쓴다.
+    끝까지 읽으면 consumed로 표시해 close()가 커넥션을 닫지 않고 keep-alive 풀에 돌려주게 한다.
+    """
+    raw = response.raw
+    read = getattr(raw, 'read1', None) or raw.read  # urllib3 1.x에는 read1 없음 (amt만큼 막힘)
+    while True:
+        check_deadline(response)
+        chunk = read(RESPONSE_CHUNK_SIZE, decode_content=True)
+        if not chunk:
+            break
+        yield chunk
+    response._content_consumed = True
+
+def iter_response_lines(response):
+    pending = b""
+    for chunk in iter_response_chunks(response):
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+@st.cache_resource
+def get_http_client():
+    """프로세스 공유 HTTP 클라이언트"""
+    return LLMHttpClient(
+        pool_size=int(get_setting("LLM_POOL_SIZE", 20)),
+        connect_timeout=float(get_setting("LLM_CONNECT_TIMEOUT", 5)),
+        request_timeout=float(get_setting("LLM_REQUEST_TIMEOUT", 30)),
+        keepalive_idle=int(get_setting("LLM_KEEPALIVE_IDLE", 60))
+    )
+
+class LLMCallError(Exception):
+    """LLM 호출 실패 - category: config / timeout / network / rate_limit / server / client / format / circuit_open"""
+
+    def __init__(self, category, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.category = category
+        self.status = status
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """연속 실패가 임계치를 넘으면 일정 시간 즉시 실패 (closed → open → half-open)"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._half_open_probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """요청 허용 여부 - half-open에서는 탐색 요청 1개만 통과"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._half_open_probe:
+                self._half_open_probe = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._half_open_probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._half_open_probe = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+def new_circuit_breaker():
+    """프로바이더별 서킷 브레이커 (설정값 적용)"""
+    return CircuitBreaker(
+        failure_threshold=int(get_setting("LLM_BREAKER_THRESHOLD", 5)),
+        reset_timeout=float(get_setting("LLM_BREAKER_RESET", 30))
+    )
+
+# 재시도 대상 HTTP 상태
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+def parse_retry_after(value):
+    """Retry-After 헤더 (초 또는 HTTP-date) → 초"""
+    if not value:
+        return None
     
-    if not GROQ_API_KEY:
-        return "⚠️ Groq API 키가 설정되지 않았습니다. Streamlit secrets에 GROQ_API_KEY를 추가해주세요."
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
     
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
     
-    # Groq API 요청 데이터
-    data = {
-        "model": "llama-3.1-8b-instant",  # 더 안정적인 모델로 변경
-        "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 500,
-        "top_p": 0.9,
-        "stream": False
-    }
+    return max(0.0, retry_at.timestamp() - time.time())
+
+def backoff_delay(attempt, base_delay, max_delay, retry_after=None):
+    """재시도 대기 시간 - Retry-After 우선, 없으면 full-jitter 지수 백오프"""
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def classify_http_error(response):
+    """HTTP 오류 응답 → LLMCallError"""
+    status = response.status_code
+    detail = response.text[:300]
     
-    try:
-        response = requests.post(GROQ_API_URL, headers=headers, json=data, timeout=30)
+    if status == 429:
+        category = 'rate_limit'
+    elif status >= 500:
+        category = 'server'
+    else:
+        category = 'client'
+    
+    return LLMCallError(
+        category,
+        f"API 오류 ({status}): {detail}",
+        status=status,
+        retry_after=parse_retry_after(response.headers.get('Retry-After'))
+    )
+
+def iter_sse_deltas(response):
+    """SSE(chat.completion.chunk) 스트림에서 content 조각 추출
+
+    [DONE] 이후에도 스트림 끝까지 읽어 커넥션이 keep-alive 풀로 돌아가게 한다.
+    조각마다 전체 데드라인을 확인해 조금씩 흘러나오는 스트림이 커넥션을 계속 붙잡지 않게 한다.
+    """
+    done = False
+    for raw_line in iter_response_lines(response):
+        if done or not raw_line:
+            continue
+        
+        line = raw_line.decode('utf-8') if isinstance(raw_line, bytes) else raw_line
+        if not line.startswith('data:'):
+            continue
+        
+        payload = line[5:].strip()
+        if payload == '[DONE]':
+            done = True
+            continue
+        
+        chunk = json.loads(payload)
+        for choice in chunk.get('choices', []):
+            content = choice.get('delta', {}).get('content')
+            if content:
+                yield content
+
+# 기본 생성 파라미터 (LLM_MODEL / LLM_TEMPERATURE / LLM_MAX_TOKENS / LLM_TOP_P 설정 또는 프로바이더별 설정으로 변경)
+DEFAULT_LLM_MODEL = "llama-3.1-8b-instant"
+DEFAULT_LLM_TEMPERATURE = 0.7
+DEFAULT_LLM_MAX_TOKENS = 500
+DEFAULT_LLM_TOP_P = 0.9
+
+# 지연시간 EWMA 가중치
+LATENCY_EWMA_ALPHA = 0.3
+
+class LLMProvider:
+    """LLM 백엔드 인터페이스 - complete()는 응답 전체, stream()은 토큰 조각 제너레이터 (실패 시 LLMCallError)"""
+
+    kind = 'base'
+
+    def __init__(self, name, model=DEFAULT_LLM_MODEL, temperature=DEFAULT_LLM_TEMPERATURE,
+                 max_tokens=DEFAULT_LLM_MAX_TOKENS, top_p=DEFAULT_LLM_TOP_P, breaker=None):
+        self.name = name
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.top_p = top_p
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = None  # 응답(스트리밍은 첫 토큰)까지 걸린 시간 EWMA, 초
+        self.penalty = 0.0       # 마지막 호출 실패 시 더하는 지연 (성공하면 0 - EWMA에는 섞지 않음)
+        self.measured_at = None  # 마지막 성공/실패 시각 (monotonic)
+        self.probed_at = None    # 마지막 탐색 요청 배정 시각
+        self._lock = threading.Lock()  # 세션 간 공유 - EWMA 갱신은 read-modify-write
+
+    @property
+    def rank_latency(self):
+        """순위용 지연 - 미측정이면 0"""
+        return (self.latency or 0.0) + self.penalty
+
+    def record_latency(self, seconds):
+        with self._lock:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += LATENCY_EWMA_ALPHA * (seconds - self.latency)
+            self.penalty = 0.0
+            self.measured_at = time.monotonic()
+
+    def record_failure(self, penalty):
+        with self._lock:
+            self.penalty = penalty
+            self.measured_at = time.monotonic()
+
+    def claim_probe(self, interval):
+        """밀려난 프로바이더에 interval마다 요청 1개를 배정해 지연을 다시 측정 (배정되면 True)"""
+        now = time.monotonic()
+        with self._lock:
+            last = max(self.measured_at or 0.0, self.probed_at or 0.0)
+            if self.measured_at is None or now - last < interval:
+                return False
+            self.probed_at = now
+            return True
+
+    def complete(self, messages):
+        raise NotImplementedError
+
+    def stream(self, messages):
+        raise NotImplementedError
+
+class OpenAICompatibleProvider(LLMProvider):
+    """OpenAI 호환 chat-completions 엔드포인트 (Groq, vLLM, Ollama, mock 서버 등)"""
+
+    kind = 'openai'
+
+    def __init__(self, name, url, api_key="", timeout=None, **params):
+        super().__init__(name, **params)
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def build_request(self, messages, stream=False):
+        """요청 헤더/데이터"""
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": self.top_p,
+            "stream": stream
+        }
         
-        # 에러 상세 정보 출력
-        if response.status_code != 200:
-            error_detail = response.text
-            return f"⚠️ API 오류 ({response.status_code}): {error_detail}"
+        return headers, data
+
+    def open_response(self, messages, stream=False):
+        """재시도/서킷 브레이커를 거쳐 200 응답 반환 (실패 시 LLMCallError)"""
+        if not self.breaker.allow():
+            raise LLMCallError('circuit_open', f"LLM 서비스 일시 차단 중 ({self.name}, 연속 실패)")
+        
+        headers, data = self.build_request(messages, stream=stream)
+        max_attempts = int(get_setting("LLM_RETRY_MAX_ATTEMPTS", 3))
+        base_delay = float(get_setting("LLM_RETRY_BASE_DELAY", 0.5))
+        max_delay = float(get_setting("LLM_RETRY_MAX_DELAY", 8))
+        
+        for attempt in range(max_attempts):
+            try:
+                response = get_http_client().post_json(self.url, data, headers, timeout=self.timeout, stream=stream)
+            except requests.exceptions.Timeout:
+                error = LLMCallError('timeout', "응답 시간이 초과되었습니다.")
+            except requests.exceptions.RequestException as e:
+                error = LLMCallError('network', f"네트워크 오류: {str(e)}")
+            else:
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response
+                
+                error = classify_http_error(response)
+                response.close()
+                
+                if response.status_code not in RETRYABLE_STATUS:
+                    # 요청 자체의 문제 - 서비스는 살아 있으므로 재시도/브레이커 대상 아님
+                    self.breaker.record_success()
+                    raise error
+            
+            if attempt == max_attempts - 1:
+                break
+            
+            time.sleep(backoff_delay(attempt, base_delay, max_delay, error.retry_after))
+        
+        self.breaker.record_failure()
+        raise error
+
+    def complete(self, messages):
+        response = self.open_response(messages)
         
-        result = response.json()
+        try:
+            result = response.json()
+        except ValueError:
+            raise LLMCallError('format', "응답 형식 오류: JSON 아님")
         
         # 응답 형식 확인
         if 'choices' not in result or len(result['choices']) == 0:
-            return f"⚠️ 응답 형식 오류: {result}"
+            raise LLMCallError('format', f"응답 형식 오류: {result}")
         
         return result['choices'][0]['message']['content']
+
+    def stream(self, messages):
+        """소비 측이 중단하면(페이지 이동 등) finally에서 응답을 닫아 커넥션을 풀에 반환한다.
+        재시도는 첫 토큰 이전(연결/상태 코드 단계)까지만 수행한다.
+        """
+        response = self.open_response(messages, stream=True)
+        
+        try:
+            yield from iter_sse_deltas(response)
+        except requests.exceptions.RequestException as e:
+            raise LLMCallError('network', f"스트림 중단: {str(e)}")
+        except ValueError as e:
+            raise LLMCallError('format', f"응답 형식 오류: {str(e)}")
+        finally:
+            response.close()
+
+class StubProvider(LLMProvider):
+    """네트워크 없는 결정적 로컬 스텁 (오프라인/부하 테스트용)
+
+    응답 규칙은 tools/mock_llm_server.py와 같다 - 마지막 사용자 메시지 해시로 고정 응답 선택.
+    """
+
+    kind = 'stub'
+
+    REPLIES = (
+        "이야기해줘서 고마워요. 지금 느끼는 감정을 천천히 같이 살펴봐요.",
+        "많이 지쳤겠어요. 오늘 잠깐이라도 쉬는 시간을 가져보면 어떨까요?",
+        "그 마음 충분히 이해해요. 지금 할 수 있는 작은 행동 하나를 같이 정해봐요.",
+        "혼자 견디지 않아도 괜찮아요. 믿을 수 있는 사람에게 연락해보는 건 어때요?",
+    )
+
+    def __init__(self, name, latency=0.0, token_delay=0.0, **params):
+        super().__init__(name, **params)
+        self.response_latency = latency
+        self.token_delay = token_delay
+
+    def reply_for(self, messages):
+        user_text = ""
+        for message in reversed(messages):
+            if message.get('role') == 'user':
+                user_text = message.get('content', '')
+                break
+        
+        digest = hashlib.sha256(user_text.encode('utf-8')).digest()
+        return self.REPLIES[digest[0] % len(self.REPLIES)]
+
+    def complete(self, messages):
+        if self.response_latency:
+            time.sleep(self.response_latency)
+        return self.reply_for(messages)
+
+    def stream(self, messages):
+        if self.response_latency:
+            time.sleep(self.response_latency)
+        
+        for index, word in enumerate(self.reply_for(messages).split(' ')):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield word if index == 0 else ' ' + word
+
+class ProviderRouter:
+    """지연시간(EWMA) 기반 프로바이더 선택 + 실패 시 다음 프로바이더로 페일오버"""
+
+    def __init__(self, providers, failure_latency=30.0):
+        self.providers = list(providers)
+        self.failure_latency = failure_latency
+        self.config_error = None
+
+    def ordered(self):
+        """차단(open)되지 않은 프로바이더 우선, 그 안에서 평균 지연 짧은 순
+
+        아직 측정되지 않은 프로바이더는 지연 0으로 보고 먼저 한 번 시도한다 (동률이면 설정 순서).
+        지연은 선택될 때만 갱신되므로, 밀려난 프로바이더는 breaker.reset_timeout마다 요청 1개를
+        먼저 보내 다시 측정한다 - 일시 장애 한 번으로 트래픽이 영구히 넘어가지 않게.
+        """
+        def rank(item):
+            index, provider = item
+            return (provider.breaker.state == 'open', provider.rank_latency, index)
+        
+        ranked = [provider for _, provider in sorted(enumerate(self.providers), key=rank)]
+        
+        for provider in ranked[1:]:
+            if provider.breaker.state != 'open' and provider.claim_probe(provider.breaker.reset_timeout):
+                ranked.remove(provider)
+                ranked.insert(0, provider)
+                break
+        
+        return ranked
+
+    def _record_failure(self, provider, error, started, mode):
+        get_metrics().llm_errors.inc(provider=provider.name, category=error.category)
+        
+        # 실패한 프로바이더는 다음 성공 전까지 failure_latency만큼 느린 것으로 간주해 순위를 뒤로 미룸
+        if error.category != 'circuit_open':
+            self._observe(provider, mode, 'error', started)
+            provider.record_failure(max(time.monotonic() - started, self.failure_latency))
+
+    def _observe(self, provider, mode, outcome, started, messages=None, reply=""):
+        """지연 히스토그램 + (완료 시) 추정 토큰 수"""
+        metrics = get_metrics()
+        metrics.llm_latency.observe(time.monotonic() - started, provider=provider.name, mode=mode, outcome=outcome)
+        if messages is not None:
+            metrics.llm_tokens.inc(sum(message_tokens(m) for m in messages), provider=provider.name, kind='prompt')
+            metrics.llm_tokens.inc(estimate_tokens(reply), provider=provider.name, kind='completion')
+
+    def _no_provider_error(self):
+        return LLMCallError('config', "사용 가능한 LLM 프로바이더가 없습니다.")
+
+    def complete(self, messages):
+        error = self._no_provider_error()
+        
+        for provider in self.ordered():
+            started = time.monotonic()
+            try:
+                reply = provider.complete(messages)
+            except LLMCallError as e:
+                self._record_failure(provider, e, started, 'call')
+                error = e
+                continue
+            
+            provider.record_latency(time.monotonic() - started)
+            get_tracer().annotate(provider=provider.name)
+            self._observe(provider, 'call', 'ok', started, messages, reply)
+            return reply
+        
+        raise error
+
+    def stream(self, messages):
+        """첫 토큰 전까지 실패하면 다음 프로바이더로 넘어감 (첫 토큰 이후 오류는 그대로 전달)"""
+        error = self._no_provider_error()
+        
+        for provider in self.ordered():
+            started = time.monotonic()
+            tokens = provider.stream(messages)
+            try:
+                first = next(tokens, None)
+            except LLMCallError as e:
+                tokens.close()
+                self._record_failure(provider, e, started, 'stream')
+                error = e
+                continue
+            
+            provider.record_latency(time.monotonic() - started)
+            get_tracer().annotate(provider=provider.name)
+            
+            pieces = []
+            outcome = 'cancelled'  # 소비 측이 중간에 닫은 경우
+            try:
+                if first is not None:
+                    pieces.append(first)
+                    yield first
+                for token in tokens:
+                    pieces.append(token)
+                    yield token
+                outcome = 'ok'
+            except LLMCallError as e:
+                outcome = 'error'
+                get_metrics().llm_errors.inc(provider=provider.name, category=e.category)
+                raise
+            finally:
+                tokens.close()
+                self._observe(provider, 'stream', outcome, started, messages, "".join(pieces))
+            return
+        
+        raise error
+
+def load_provider_configs():
+    """LLM_PROVIDERS 설정 → 프로바이더 설정 목록
+
+    LLM_PROVIDERS는 JSON 배열 문자열(환경변수) 또는 secrets의 테이블 배열.
+    예: [{"name": "groq", "kind": "openai", "url": "...", "api_key_setting": "GROQ_API_KEY"},
+         {"name": "local", "kind": "stub"}]
+    없으면 GROQ_API_KEY/GROQ_API_URL 기반 Groq 프로바이더 하나.
+    """
+    raw = get_setting("LLM_PROVIDERS", "")
+    if raw:
+        configs = json.loads(raw) if isinstance(raw, str) else raw
+        return [dict(config) for config in configs]
     
-    except requests.exceptions.Timeout:
-        return "⚠️ 응답 시간이 초과되었습니다. 다시 시도해주세요."
-    except requests.exceptions.RequestException as e:
-        return f"⚠️ 네트워크 오류: {str(e)}"
-    except Exception as e:
-        return f"⚠️ 예상치 못한 오류: {str(e)}"
+    return default_provider_configs()
+
+def default_provider_configs():
+    """GROQ_API_KEY/GROQ_API_URL 기반 기본 프로바이더 (키 없으면 빈 목록)"""
+    if not GROQ_API_KEY:
+        return []
+    
+    return [{'name': 'groq', 'kind': 'openai', 'url': GROQ_API_URL, 'api_key': GROQ_API_KEY}]
+
+def build_provider(config):
+    """프로바이더 설정 dict → LLMProvider"""
+    kind = config.get('kind', 'openai')
+    name = config.get('name', kind)
+    params = {
+        'model': config.get('model', get_setting("LLM_MODEL", DEFAULT_LLM_MODEL)),
+        'temperature': float(config.get('temperature', get_setting("LLM_TEMPERATURE", DEFAULT_LLM_TEMPERATURE))),
+        'max_tokens': int(config.get('max_tokens', get_setting("LLM_MAX_TOKENS", DEFAULT_LLM_MAX_TOKENS))),
+        'top_p': float(config.get('top_p', get_setting("LLM_TOP_P", DEFAULT_LLM_TOP_P))),
+        'breaker': new_circuit_breaker()
+    }
+    
+    if kind == 'stub':
+        return StubProvider(
+            name,
+            latency=float(config.get('latency', 0)),
+            token_delay=float(config.get('token_delay', 0)),
+            **params
+        )
+    
+    if kind == 'openai':
+        api_key = config.get('api_key', "")
+        if not api_key and config.get('api_key_setting'):
+            api_key = get_setting(config['api_key_setting'], "")
+        timeout = config.get('timeout')
+        return OpenAICompatibleProvider(
+            name,
+            config['url'],
+            api_key=api_key,
+            timeout=float(timeout) if timeout is not None else None,
+            **params
+        )
+    
+    raise ValueError(f"알 수 없는 LLM 프로바이더 종류: {kind}")
+
+@st.cache_resource
+def get_llm_router():
+    """프로세스 공유 프로바이더 라우터 (지연/브레이커 상태가 세션 간 공유됨)
+
+    LLM_PROVIDERS가 잘못되어도 모든 페이지가 죽지 않게 Groq 기본 설정으로 대체하고 config_error에 남긴다.
+    """
+    config_error = None
+    try:
+        providers = [build_provider(config) for config in load_provider_configs()]
+    except (ValueError, TypeError, KeyError) as e:
+        config_error = f"{type(e).__name__}: {e}"
+        logging.getLogger(__name__).error("LLM_PROVIDERS 설정 오류 - Groq 기본 설정 사용 (%s)", config_error)
+        providers = [build_provider(config) for config in default_provider_configs()]
+    
+    router = ProviderRouter(providers, failure_latency=float(get_setting("LLM_REQUEST_TIMEOUT", 30)))
+    router.config_error = config_error
+    return router
+
+def stream_llm(messages):
+    """LLM 스트리밍 호출 - 토큰 조각을 도착하는 대로 yield (실패 시 LLMCallError)"""
+    return get_llm_router().stream(messages)
+
+def get_fallback_reply(e_score):
+    """LLM 장애 시 E-Score 톤에 맞춘 템플릿 응답 (get_emotion_response 재사용)"""
+    isolation = st.session_state.isolation_score
+    crisis_pattern = get_crisis_pattern()
+    
+    message = get_emotion_response(e_score, isolation, crisis_pattern)
+    if message is None:
+        message = get_emotion_response(4, isolation, crisis_pattern)
+    
+    return "💬 지금 AI 상담 연결이 잠시 원활하지 않아요. 대신 지금 상태에 맞는 안내를 먼저 드릴게요.\n" + message
+
+class ReplyCache:
+    """LLM 응답 캐시 - TTL + LRU, 적중/미스/우회 카운트"""
+
+    def __init__(self, max_entries=256, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
 
+@st.cache_resource
+def get_reply_cache():
+    """프로세스 공유 응답 캐시 (LLM_REPLY_CACHE_SIZE=0이면 비활성)"""
+    max_entries = int(get_setting("LLM_REPLY_CACHE_SIZE", 256))
+    if max_entries <= 0:
+        return None
+    return ReplyCache(max_entries, float(get_setting("LLM_REPLY_CACHE_TTL", 600)))
+
+def normalize_cache_text(text):
+    """캐시 키용 정규화 - 대소문자/공백/끝 문장부호 차이 무시"""
+    text = re.sub(r'\s+', ' ', text.strip().lower())
+    return text.rstrip(' .!?~ㅠㅜ')
+
+def reply_cache_key(system_prompt, history, user_text):
+    """정규화된 시스템 프롬프트 + 최근 대화 지문 + 사용자 입력 → 캐시 키"""
+    digest = hashlib.sha256()
+    digest.update(normalize_cache_text(system_prompt).encode('utf-8'))
+    for msg in history:
+        digest.update(b'\x00' + msg['role'].encode('utf-8') + b'\x01')
+        digest.update(normalize_cache_text(msg['content']).encode('utf-8'))
+    digest.update(b'\x02' + normalize_cache_text(user_text).encode('utf-8'))
+    return digest.hexdigest()
+
+def should_bypass_reply_cache(analysis):
+    """위기/강제 개입 중에는 캐시 사용 안 함"""
+    forced = analysis.forced_intervention
+    return analysis.has_crisis or analysis.e_score >= 5 or bool(forced and forced['required'])
+
+# 토큰 추정 보정값 (Llama 3 BPE 기준 실측 근사)
+TOKENS_PER_HANGUL = 1.2
+CHARS_PER_TOKEN_OTHER = 4.0
+MESSAGE_OVERHEAD_TOKENS = 4
+HANGUL_PATTERN = re.compile(r'[\uac00-\ud7a3\u3131-\u318e]')
+
+def estimate_tokens(text):
+    """로컬 토큰 수 추정 - 한글 음절/자모와 그 외 문자를 따로 보정"""
+    hangul = len(HANGUL_PATTERN.findall(text))
+    other = len(text) - hangul
+    return int(math.ceil(hangul * TOKENS_PER_HANGUL + other / CHARS_PER_TOKEN_OTHER))
+
+def message_tokens(message):
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+def fit_chat_context(system_prompt, history, budget):
+    """토큰 예산에 맞춰 전송할 메시지 구성
+
+    시스템 프롬프트와 마지막 사용자 턴은 항상 포함하고, 남은 예산만큼
+    최근 턴부터 거꾸로 채운다. 반환: (messages, dropped_history)
+    """
+    system_message = {"role": "system", "content": system_prompt}
+    if not history:
+        return [system_message], []
+    
+    last_turn = history[-1]
+    used = message_tokens(system_message) + message_tokens(last_turn)
+    
+    start = len(history) - 1
+    while start > 0:
+        cost = message_tokens(history[start - 1])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    
+    # 대화가 어시스턴트 응답으로 시작하지 않도록 정리
+    if start < len(history) - 1 and history[start]['role'] == 'assistant':
+        start += 1
+    
+    messages = [system_message] + [
+        {"role": msg['role'], "content": msg['content']} for msg in history[start:]
+    ]
+    return messages, history[:start]
+
+# 대화 요약 설정
+CHAT_HISTORY_MAX = 200       # 화면/세션 보관 메시지 수
+SUMMARY_KEEP_RECENT = 6      # 요약하지 않고 원문으로 보내는 최근 메시지 수
+SUMMARY_EVERY_TURNS = 4      # 이 턴 수만큼 창 밖에 쌓이면 요약에 접어 넣음
+SUMMARY_MAX_TOKENS = 400
+
+def extract_key_sentence(text, max_chars=80):
+    """키워드 히트가 가장 많은 문장 1개 추출 (동점이면 앞 문장)"""
+    sentences = [part.strip() for part in re.split(r'(?<=[.!?])\s+|\n+', text) if part.strip()]
+    if not sentences:
+        return ""
+    
+    best = max(sentences, key=lambda sentence: sum(len(v) for v in scan_keywords(sentence).values()))
+    return best if len(best) <= max_chars else best[:max_chars - 1] + "…"
+
+def summarize_message(msg):
+    """메시지 1개 → 요약 한 줄"""
+    if msg['role'] == 'user':
+        hits = scan_keywords(msg['content'])
+        emotions = [level for (category, level) in hits if category == 'emotion']
+        line = f"- 사용자: {extract_key_sentence(msg['content'])}"
+        if emotions:
+            line += f" ({', '.join(emotions)})"
+        return line
+    
+    return f"- 상담사: {extract_key_sentence(msg['content'], 60)}"
+
+def compact_summary(lines, max_tokens):
+    """요약 예산 초과 시 상담사 줄부터, 그다음 오래된 줄부터 제거"""
+    while len(lines) > 1 and sum(estimate_tokens(line) for line in lines) > max_tokens:
+        for i, line in enumerate(lines):
+            if line.startswith("- 상담사"):
+                del lines[i]
+                break
+        else:
+            del lines[0]
+    return lines
+
+def update_chat_summary():
+    """창 밖으로 밀려난 턴이 충분히 쌓이면 누적 요약에 접어 넣기 (추출식, 로컬)"""
+    history = st.session_state.ai_chat_history
+    pending = [msg for msg in history if not msg.get('summarized')]
+    
+    if len(pending) < SUMMARY_KEEP_RECENT + SUMMARY_EVERY_TURNS * 2 and len(history) <= CHAT_HISTORY_MAX:
+        return
+    
+    summary = st.session_state.chat_summary
+    for msg in pending[:-SUMMARY_KEEP_RECENT]:
+        if not msg.get('error'):
+            line = summarize_message(msg)
+            if not summary or summary[-1] != line:
+                summary.append(line)
+        msg['summarized'] = True
+    
+    compact_summary(summary, SUMMARY_MAX_TOKENS)
+    
+    if len(history) > CHAT_HISTORY_MAX:
+        del history[:len(history) - CHAT_HISTORY_MAX]
+
+def get_conversation_summary():
+    """시스템 프롬프트에 붙일 이전 대화 요약"""
+    if not st.session_state.get('chat_summary'):
+        return ""
+    return "\n[이전 대화 요약]\n" + "\n".join(st.session_state.chat_summary)
+
+def render_stream(tokens):
+    """토큰 스트림을 화면에 점진적으로 출력하고 전체 텍스트 반환"""
+    try:
+        if hasattr(st, 'write_stream'):
+            return st.write_stream(tokens)
+        
+        placeholder = st.empty()
+        text = ""
+        for token in tokens:
+            text += token
+            placeholder.markdown(text + "▌")
+        placeholder.markdown(text)
+        return text
+    finally:
+        tokens.close()
+
+@traced()
 def show_emotion_dashboard():
     """감정 패턴 대시보드"""
     st.subheader("💭 감정 패턴 분석 (Phase 2)")
@@ -783,9 +3228,9 @@ def show_emotion_dashboard():
         st.metric("현재 감정 레벨", f"{level_emoji[e_score]} {level_text[e_score]}")
     
     with col2:
-        recent_7 = [e for e in st.session_state.emotion_history 
-                    if datetime.fromisoformat(e['timestamp']) > datetime.now() - timedelta(days=7)]
-        avg_score = sum([e['e_score'] for e in recent_7]) / len(recent_7) if recent_7 else 1
+        week_ago = (rerun_now() - timedelta(days=7)).timestamp()
+        recent_7 = st.session_state.emotion_history.since(week_ago)
+        avg_score = sum([e.e_score for e in recent_7]) / len(recent_7) if recent_7 else 1
         st.metric("7일 평균", f"E{avg_score:.1f}")
     
     with col3:
@@ -849,16 +3294,15 @@ def show_emotion_dashboard():
             result = detect_emotion_level(emotion_input)
             record_emotion_event(result['score'], result['emotions'], emotion_input)
             
-            st.success(f"✅ 분석 완료! 감정 레벨: E{result['score']}")
-            
             # 감지된 감정 표시
+            details = []
             if any(result['emotions'].values()):
-                st.write("**감지된 감정:**")
+                details.append("**감지된 감정:**")
                 for emotion, keywords in result['emotions'].items():
                     if keywords:
-                        st.write(f"- {emotion}: {', '.join(keywords)}")
+                        details.append(f"- {emotion}: {', '.join(keywords)}")
             
-            time.sleep(1)
+            flash(f"✅ 분석 완료! 감정 레벨: E{result['score']}", details=details)
             st.rerun()
         else:
             st.warning("감정을 입력해주세요.")
@@ -872,9 +3316,9 @@ def show_emotion_dashboard():
         recent_5 = st.session_state.emotion_history[-5:]
         
         for record in reversed(recent_5):
-            timestamp = datetime.fromisoformat(record['timestamp']).strftime("%m/%d %H:%M")
-            e_score = record['e_score']
-            emotions = record['detected_emotions']
+            timestamp = record.timestamp.strftime("%m/%d %H:%M")
+            e_score = record.e_score
+            emotions = record.detected_emotions
             
             level_emoji = {1: '✅', 2: '💛', 3: '🧡', 4: '❤️', 5: '🚨'}
             
@@ -888,63 +3332,140 @@ def show_emotion_dashboard():
 # 2-2. V2.5 - Exercise Intervention System (NEW)
 # ============================================================================
 
+# 운동 간격(사이 쉰 날 수) 히스토그램 구간 - (라벨, 최소, 최대)
+EXERCISE_GAP_BUCKETS = (
+    ("0일", 0, 0),
+    ("1일", 1, 1),
+    ("2일", 2, 2),
+    ("3-6일", 3, 6),
+    ("7일+", 7, None)
+)
+
+class ExerciseDayIndex:
+    """운동한 날 ordinal 정렬 배열 (중복 없음) - 연속/간격/주간 빈도 계산용"""
+
+    def __init__(self, days=()):
+        self._days = array('l', sorted(set(days)))
+
+    def add(self, day):
+        """운동한 날 추가 - 이미 있으면 무시"""
+        index = bisect_left(self._days, day)
+        if index == len(self._days) or self._days[index] != day:
+            self._days.insert(index, day)
+
+    def __len__(self):
+        return len(self._days)
+
+    def __contains__(self, day):
+        index = bisect_left(self._days, day)
+        return index < len(self._days) and self._days[index] == day
+
+    @property
+    def last_day(self):
+        return self._days[-1] if self._days else None
+
+    def summary(self, today):
+        """한 번 순회로 현재 연속 / 최장 연속 / 간격 히스토그램"""
+        days = self._days
+        if not days:
+            return {'streak': 0, 'longest_streak': 0, 'gaps': {}}
+        
+        gaps = {}
+        longest = run = 1
+        for prev, day in zip(days, days[1:]):
+            rest = day - prev - 1
+            gaps[rest] = gaps.get(rest, 0) + 1
+            run = run + 1 if rest == 0 else 1
+            if run > longest:
+                longest = run
+        
+        return {
+            # 오늘 운동해야 연속 유지 (어제까지의 연속은 0)
+            'streak': run if days[-1] == today else 0,
+            'longest_streak': longest,
+            'gaps': gaps
+        }
+
+    def bitmap(self, start, length):
+        """start(ordinal)부터 length일 운동 여부 0/1 목록"""
+        lo = bisect_left(self._days, start)
+        hi = bisect_left(self._days, start + length)
+        
+        if np is not None:
+            bits = np.zeros(length, dtype=np.int32)
+            bits[np.asarray(self._days[lo:hi], dtype=np.int64) - start] = 1
+            return bits
+        
+        bits = [0] * length
+        for day in self._days[lo:hi]:
+            bits[day - start] = 1
+        return bits
+
+    def rolling_counts(self, today, length, window=7):
+        """오늘까지 length일 동안 각 날짜 기준 최근 window일 운동 일수"""
+        bits = self.bitmap(today - length - window + 2, length + window - 1)
+        
+        if np is not None:
+            return np.convolve(bits, np.ones(window, dtype=np.int32), mode='valid').tolist()
+        
+        counts = []
+        total = sum(bits[:window - 1])
+        for index in range(window - 1, len(bits)):
+            total += bits[index]
+            counts.append(total)
+            total -= bits[index - window + 1]
+        return counts
+
+    def weekly_frequency(self, today, weeks=4):
+        """최근 weeks주 (오늘 포함 7일 단위) 주별 운동 일수 - 오래된 주부터"""
+        return self.rolling_counts(today, 7 * (weeks - 1) + 1)[::7]
+
+def gap_histogram(gaps):
+    """쉰 날 수별 개수 → EXERCISE_GAP_BUCKETS 구간별 개수"""
+    histogram = {label: 0 for label, _, _ in EXERCISE_GAP_BUCKETS}
+    for rest, count in gaps.items():
+        for label, low, high in EXERCISE_GAP_BUCKETS:
+            if rest >= low and (high is None or rest <= high):
+                histogram[label] += count
+                break
+    return histogram
+
 def record_exercise(duration_minutes, intensity, mood_after):
     """운동 기록 추가"""
-    exercise_record = {
-        'date': datetime.now().date().isoformat(),
-        'timestamp': datetime.now().isoformat(),
-        'duration_minutes': duration_minutes,
-        'intensity': intensity,  # "가벼움", "보통", "강함"
-        'mood_after': mood_after  # 1-10 scale
-    }
+    now = datetime.now()
+    exercise_record = ExerciseRecord(
+        now.timestamp(),
+        duration_minutes,
+        encode_label(INTENSITY_LEVELS, intensity, 1),  # "가벼움", "보통", "강함"
+        mood_after  # 1-10 scale
+    )
     
+    # 최근 365일치만 유지 (RecordHistory horizon_days)
     st.session_state.exercise_records.append(exercise_record)
-    st.session_state.last_exercise_date = datetime.now().date()
+    persist_record('exercise_records', exercise_record)
+    st.session_state.exercise_index.add(exercise_record.day)
     
-    # 연속 운동일 계산
-    calculate_exercise_streak()
-    
-    # 최근 90일치만 유지
-    if len(st.session_state.exercise_records) > 90:
-        st.session_state.exercise_records = st.session_state.exercise_records[-90:]
+    invalidate_metrics()
 
-def calculate_exercise_streak():
-    """연속 운동일 계산"""
-    if len(st.session_state.exercise_records) == 0:
-        st.session_state.exercise_streak = 0
-        return
-    
-    today = datetime.now().date()
-    streak = 0
+@rerun_cached
+def get_exercise_stats():
+    """운동 지표 (이번 실행 기준 날짜) - 연속/최장 연속/운동 일수/최근 4주 주별 빈도/간격"""
+    index = st.session_state.exercise_index
+    today = rerun_now().date().toordinal()
     
-    # 최근 기록부터 역순으로 체크
-    check_date = today
-    
-    for i in range(30):  # 최대 30일 체크
-        date_str = check_date.isoformat()
-        has_exercise = any(r['date'] == date_str for r in st.session_state.exercise_records)
-        
-        if has_exercise:
-            streak += 1
-            check_date = check_date - timedelta(days=1)
-        else:
-            break
-    
-    st.session_state.exercise_streak = streak
+    stats = index.summary(today)
+    stats['total_days'] = len(index)
+    stats['weekly'] = index.weekly_frequency(today, weeks=4)
+    return stats
 
+@rerun_cached
 def days_since_last_exercise():
     """마지막 운동 이후 경과 일수"""
-    if st.session_state.last_exercise_date is None:
+    last_day = st.session_state.exercise_index.last_day
+    if last_day is None:
         return 999  # 운동 기록 없음
     
-    today = datetime.now().date()
-    last_date = st.session_state.last_exercise_date
-    
-    if isinstance(last_date, str):
-        last_date = datetime.fromisoformat(last_date).date()
-    
-    delta = (today - last_date).days
-    return delta
+    return rerun_now().date().toordinal() - last_day
 
 def get_exercise_intervention_message():
     """운동 부족 시 강력한 개입 메시지"""
@@ -1085,16 +3606,7 @@ def get_exercise_intervention_message():
             'message': message
         }
 
-def check_exercise_intervention():
-    """운동 개입 필요 여부 체크"""
-    days = days_since_last_exercise()
-    
-    # 1일 이하는 개입 안 함
-    if days <= 0:
-        return None
-    
-    return get_exercise_intervention_message()
-
+@traced()
 def show_exercise_intervention():
     """운동 개입 화면 표시"""
     intervention = get_exercise_intervention_message()
@@ -1128,18 +3640,16 @@ def show_exercise_intervention():
     
     if st.button("✅ 운동 완료!", use_container_width=True, type="primary"):
         record_exercise(duration, intensity, mood)
-        st.success("🎉 잘했어! 이게 회복이다!")
-        st.balloons()
-        time.sleep(2)
+        flash("🎉 잘했어! 이게 회복이다!", balloons=True)
         st.rerun()
 
+@traced()
 def show_exercise_dashboard():
     """운동 관리 대시보드"""
     st.subheader("🏃 운동 관리 대시보드")
     
     days = days_since_last_exercise()
-    streak = st.session_state.exercise_streak
-    total_records = len(st.session_state.exercise_records)
+    stats = get_exercise_stats()
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -1152,10 +3662,10 @@ def show_exercise_dashboard():
             st.metric("마지막 운동", "기록 없음")
     
     with col2:
-        st.metric("연속 운동", f"{streak}일 🔥")
+        st.metric("연속 운동", f"{stats['streak']}일 🔥")
     
     with col3:
-        st.metric("총 운동 일수", f"{total_records}일")
+        st.metric("총 운동 일수", f"{stats['total_days']}일")
     
     with col4:
         if days == 0:
@@ -1170,6 +3680,23 @@ def show_exercise_dashboard():
     
     st.markdown("---")
     
+    # 운동 패턴 (최근 4주 주별 빈도 + 운동 간격)
+    if stats['total_days'] > 0:
+        st.subheader("📈 운동 패턴")
+        
+        st.caption(f"주별 운동 일수 (최근 4주) | 최장 연속 {stats['longest_streak']}일")
+        week_labels = ["3주 전", "2주 전", "지난주", "이번 주"]
+        previous = None
+        for col, label, count in zip(st.columns(4), week_labels, stats['weekly']):
+            with col:
+                st.metric(label, f"{count}일", delta=None if previous is None else count - previous)
+            previous = count
+        
+        st.caption("운동 사이 쉰 날 (횟수)")
+        st.bar_chart({'횟수': gap_histogram(stats['gaps'])})
+        
+        st.markdown("---")
+    
     # 운동-수면 연계 분석
     if len(st.session_state.exercise_records) > 0 and len(st.session_state.sleep_data) > 0:
         st.subheader("📊 운동 ↔ 수면 연계 분석")
@@ -1193,15 +3720,15 @@ def show_exercise_dashboard():
         recent_5 = st.session_state.exercise_records[-5:]
         
         for record in reversed(recent_5):
-            date = record['date']
-            duration = record['duration_minutes']
-            intensity = record['intensity']
-            mood = record['mood_after']
+            date = record.date.isoformat()
+            duration = record.duration_minutes
+            intensity = record.intensity
+            mood = record.mood_after
             
             with st.expander(f"🏃 {date} - {duration}분 ({intensity})"):
                 st.write(f"**운동 강도:** {intensity}")
                 st.write(f"**소요 시간:** {duration}분")
-                st.write(f"**운동 후 기분:** {mood}/10")
+                st.write(f"**운동 후 기분:** {mood}/10" if mood else "**운동 후 기분:** 기록 없음 (가져온 기록)")
     
     st.markdown("---")
     
@@ -1221,47 +3748,145 @@ def show_exercise_dashboard():
     
     if st.button("✅ 운동 기록 추가", use_container_width=True, type="primary"):
         record_exercise(duration, intensity, mood)
-        st.success("🎉 운동 기록이 추가되었습니다!")
-        st.balloons()
-        time.sleep(1)
+        flash("🎉 운동 기록이 추가되었습니다!", balloons=True)
         st.rerun()
 
 # ============================================================================
 # 2-3. V2.5 - Nutrition Intervention System (NEW)
 # ============================================================================
 
+class MealDayIndex:
+    """식사 기록 일자 버킷 - day % horizon 링 슬롯 (하루 조회 O(1), horizon 밖 기록은 버림)
+
+    슬롯마다 날짜 태그, 식사 종류별 횟수, 정렬된 식사 시각(epoch) 목록을 가진다.
+    """
+
+    def __init__(self, records=(), horizon=HISTORY_HORIZON_DAYS['meal_records']):
+        self.horizon = horizon
+        self.last_ts = None
+        self._day = array('l', [-1]) * horizon
+        self._counts = array('H', [0]) * (horizon * len(MEAL_TYPES))
+        self._times = [None] * horizon
+        
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """식사 1건 반영 - 같은 슬롯에 더 최근 날짜가 있으면(horizon 밖) 무시"""
+        slot = record.day % self.horizon
+        width = len(MEAL_TYPES)
+        
+        if self._day[slot] != record.day:
+            if self._day[slot] > record.day:
+                return False
+            self._day[slot] = record.day
+            self._counts[slot * width:(slot + 1) * width] = array('H', [0]) * width
+            self._times[slot] = []
+        
+        self._counts[slot * width + record.meal_type_code] += 1
+        insort(self._times[slot], record.ts)
+        if self.last_ts is None or record.ts > self.last_ts:
+            self.last_ts = record.ts
+        return True
+
+    def _slot(self, day):
+        slot = day % self.horizon
+        return slot if self._day[slot] == day else None
+
+    def count_on_day(self, day):
+        slot = self._slot(day)
+        if slot is None:
+            return 0
+        width = len(MEAL_TYPES)
+        return sum(self._counts[slot * width:(slot + 1) * width])
+
+    def type_count_on_day(self, day, meal_type_code):
+        slot = self._slot(day)
+        if slot is None:
+            return 0
+        return self._counts[slot * len(MEAL_TYPES) + meal_type_code]
+
+    def rolling_average(self, today, days):
+        """오늘 포함 최근 days일 하루 평균 식사 횟수"""
+        return sum(self.count_on_day(day) for day in range(today - days + 1, today + 1)) / days
+
+    def regularity(self, today, days):
+        """식사 종류별로 최근 days일 중 챙겨 먹은 날의 비율"""
+        return {
+            meal_type: sum(
+                1 for day in range(today - days + 1, today + 1)
+                if self.type_count_on_day(day, code)
+            ) / days
+            for code, meal_type in enumerate(MEAL_TYPES)
+        }
+
+    def _last_before(self, day):
+        """day 이전 마지막 식사 시각 (horizon 안에서)"""
+        for previous in range(day - 1, day - self.horizon, -1):
+            slot = self._slot(previous)
+            if slot is not None and self._times[slot]:
+                return self._times[slot][-1]
+        return None
+
+    def longest_gap(self, today, days, now_ts):
+        """최근 days일 안에 끝났거나 진행 중인 가장 긴 공복 (초) - 기록 없으면 None"""
+        previous = self._last_before(today - days + 1)
+        longest = None
+        
+        for day in range(today - days + 1, today + 1):
+            slot = self._slot(day)
+            if slot is None:
+                continue
+            for ts in self._times[slot]:
+                if previous is not None and (longest is None or ts - previous > longest):
+                    longest = ts - previous
+                previous = ts
+        
+        if previous is not None and (longest is None or now_ts - previous > longest):
+            longest = now_ts - previous
+        return longest
+
 def record_meal(meal_type, quality, notes=""):
     """식사 기록 추가"""
-    meal_record = {
-        'timestamp': datetime.now().isoformat(),
-        'date': datetime.now().date().isoformat(),
-        'meal_type': meal_type,  # "아침", "점심", "저녁", "간식"
-        'quality': quality,  # "양질", "보통", "부실"
-        'notes': notes
-    }
+    now = datetime.now()
+    meal_record = MealRecord(
+        now.timestamp(),
+        encode_label(MEAL_TYPES, meal_type, 3),  # "아침", "점심", "저녁", "간식/음료"
+        encode_label(MEAL_QUALITIES, quality, 1),  # "양질", "보통", "부실"
+        notes
+    )
     
+    # 최근 365일치만 유지 (RecordHistory horizon_days)
     st.session_state.meal_records.append(meal_record)
-    st.session_state.last_meal_time = datetime.now()
+    persist_record('meal_records', meal_record)
+    st.session_state.meal_index.add(meal_record)
     
-    # 최근 90일치만 유지
-    if len(st.session_state.meal_records) > 270:  # 하루 3끼 x 90일
-        st.session_state.meal_records = st.session_state.meal_records[-270:]
+    invalidate_metrics()
 
+@rerun_cached
 def hours_since_last_meal():
     """마지막 식사 후 경과 시간 (시간 단위)"""
-    if st.session_state.last_meal_time is None:
+    last_ts = st.session_state.meal_index.last_ts
+    if last_ts is None:
         return 999  # 기록 없음
     
-    last_time = st.session_state.last_meal_time
-    
-    if isinstance(last_time, str):
-        last_time = datetime.fromisoformat(last_time)
-    
-    now = datetime.now()
-    delta = now - last_time
-    hours = delta.total_seconds() / 3600
+    return (rerun_now().timestamp() - last_ts) / 3600
+
+@rerun_cached
+def get_nutrition_stats():
+    """영양 지표 (이번 실행 기준) - 오늘 횟수, 7/30일 평균, 종류별 규칙성(14일), 최장 공복(7일)"""
+    index = st.session_state.meal_index
+    now = rerun_now()
+    today = now.date().toordinal()
+    longest_gap = index.longest_gap(today, 7, now.timestamp())
     
-    return hours
+    return {
+        'today_count': index.count_on_day(today),
+        'avg_7d': index.rolling_average(today, 7),
+        'avg_30d': index.rolling_average(today, 30),
+        'regularity': index.regularity(today, 14),
+        'longest_gap_hours': None if longest_gap is None else longest_gap / 3600
+    }
 
 def get_nutrition_intervention_message():
     """식사 부족 시 강력한 개입 메시지"""
@@ -1415,15 +4040,7 @@ def get_nutrition_intervention_message():
             'message': message
         }
 
-def check_nutrition_intervention():
-    """영양 개입 필요 여부 체크"""
-    hours = hours_since_last_meal()
-    
-    if hours < 6:
-        return None
-    
-    return get_nutrition_intervention_message()
-
+@traced()
 def show_nutrition_intervention():
     """영양 개입 화면 표시"""
     intervention = get_nutrition_intervention_message()
@@ -1458,27 +4075,16 @@ def show_nutrition_intervention():
     if st.button("✅ 식사 완료!", use_container_width=True, type="primary"):
         quality_short = quality.split()[0]  # "양질", "보통", "부실"
         record_meal(meal_type, quality_short, notes)
-        st.success("🎉 잘했어! 먹는 게 회복이다!")
-        if quality_short == "양질":
-            st.balloons()
-        time.sleep(2)
+        flash("🎉 잘했어! 먹는 게 회복이다!", balloons=quality_short == "양질")
         st.rerun()
 
+@traced()
 def show_nutrition_dashboard():
     """영양 관리 대시보드"""
     st.subheader("🍽️ 영양 관리 대시보드")
     
     hours = hours_since_last_meal()
-    total_meals = len(st.session_state.meal_records)
-    
-    # 오늘 식사 횟수
-    today = datetime.now().date().isoformat()
-    today_meals = [m for m in st.session_state.meal_records if m['date'] == today]
-    
-    # 최근 7일 평균
-    week_ago = (datetime.now() - timedelta(days=7)).date().isoformat()
-    recent_meals = [m for m in st.session_state.meal_records if m['date'] >= week_ago]
-    avg_meals_per_day = len(recent_meals) / 7 if recent_meals else 0
+    stats = get_nutrition_stats()
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -1493,10 +4099,14 @@ def show_nutrition_dashboard():
             st.metric("마지막 식사", "기록 없음")
     
     with col2:
-        st.metric("오늘 식사", f"{len(today_meals)}회")
+        st.metric("오늘 식사", f"{stats['today_count']}회")
     
     with col3:
-        st.metric("7일 평균", f"{avg_meals_per_day:.1f}회/일")
+        st.metric(
+            "7일 평균",
+            f"{stats['avg_7d']:.1f}회/일",
+            delta=f"{stats['avg_7d'] - stats['avg_30d']:+.1f} (30일 대비)"
+        )
     
     with col4:
         if hours < 6:
@@ -1509,6 +4119,15 @@ def show_nutrition_dashboard():
             status = "❌ 위험"
         st.metric("상태", status)
     
+    # 식사 규칙성 (최근 14일 중 챙겨 먹은 날) + 최장 공복
+    if stats['longest_gap_hours'] is not None:
+        cols = st.columns(len(MEAL_TYPES) + 1)
+        for col, (meal_type, ratio) in zip(cols, stats['regularity'].items()):
+            with col:
+                st.metric(f"{meal_type} (14일)", f"{ratio * 14:.0f}일")
+        with cols[-1]:
+            st.metric("최장 공복 (7일)", f"{stats['longest_gap_hours']:.0f}시간")
+    
     st.markdown("---")
     
     # 영양-정신건강 연계
@@ -1582,10 +4201,10 @@ def show_nutrition_dashboard():
         recent_10 = st.session_state.meal_records[-10:]
         
         for record in reversed(recent_10):
-            timestamp = datetime.fromisoformat(record['timestamp']).strftime("%m/%d %H:%M")
-            meal_type = record['meal_type']
-            quality = record['quality']
-            notes = record.get('notes', '')
+            timestamp = record.timestamp.strftime("%m/%d %H:%M")
+            meal_type = record.meal_type
+            quality = record.quality
+            notes = record.notes
             
             quality_emoji = "✅" if quality == "양질" else "⚠️" if quality == "보통" else "❌"
             
@@ -1614,10 +4233,7 @@ def show_nutrition_dashboard():
     if st.button("✅ 식사 기록 추가", use_container_width=True, type="primary"):
         quality_short = quality.split()[0]
         record_meal(meal_type, quality_short, notes)
-        st.success("🎉 식사 기록이 추가되었습니다!")
-        if quality_short == "양질":
-            st.balloons()
-        time.sleep(1)
+        flash("🎉 식사 기록이 추가되었습니다!", balloons=quality_short == "양질")
         st.rerun()
 
 # ============================================================================
@@ -1645,9 +4261,11 @@ ISOLATION_KEYWORDS = {
     ]
 }
 
-def detect_isolation_keywords(text):
+@traced()
+def detect_isolation_keywords(text, hits=None):
     """텍스트에서 고립 키워드 감지"""
-    text = text.lower()
+    if hits is None:
+        hits = scan_keywords(text)
     
     detected = {
         'high': [],
@@ -1655,24 +4273,31 @@ def detect_isolation_keywords(text):
         'low': []
     }
     
-    for level, keywords in ISOLATION_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in text:
-                detected[level].append(keyword)
+    for level in ISOLATION_KEYWORDS.keys():
+        detected[level] = list(hits.get(('isolation', level), []))
     
     return detected
 
+@rerun_cached
+def days_since_last_social_contact():
+    """마지막 사회적 접촉 이후 경과 일수"""
+    last_contact = st.session_state.last_social_contact
+    if not last_contact:
+        return 999  # 기록 없음
+    
+    if isinstance(last_contact, str):
+        last_contact = datetime.fromisoformat(last_contact)
+    
+    return (rerun_now() - last_contact).days
+
+@rerun_cached
 def calculate_isolation_score():
     """고립 점수 계산 (0-100)"""
     score = 0
     
     # 1. 마지막 사회적 접촉 경과 시간
     if st.session_state.last_social_contact:
-        last_contact = st.session_state.last_social_contact
-        if isinstance(last_contact, str):
-            last_contact = datetime.fromisoformat(last_contact)
-        
-        days_since = (datetime.now() - last_contact).days
+        days_since = days_since_last_social_contact()
         
         if days_since >= 7:
             score += 30  # 일주일 이상
@@ -1704,32 +4329,68 @@ def calculate_isolation_score():
     elif hours_no_meal >= 12:
         score += 5
     
-    # 5. 최근 고립 키워드 언급
-    recent_warnings = st.session_state.social_warnings
-    score += min(recent_warnings * 5, 15)
+    # 5. 최근 고립 키워드 언급
+    recent_warnings = st.session_state.social_warnings
+    score += min(recent_warnings * 5, 15)
+    
+    return min(score, 100)
+
+# 고립 이력: 1시간 버킷당 1포인트, 최근 7일 (링 버퍼)
+ISOLATION_HISTORY_DAYS = 7
+ISOLATION_HISTORY_MAX = 24 * ISOLATION_HISTORY_DAYS
+
+def load_isolation_history():
+    """저장소의 고립 이력 로드 - 같은 시간 버킷은 마지막 값만 유지
+    
+    버킷 안 덮어쓰기도 저장소에는 행으로 쌓이므로 개수가 아닌 기간(최근 7일치 버킷)으로 읽는다.
+    """
+    history = deque(maxlen=ISOLATION_HISTORY_MAX)
+    
+    bucket = datetime.now().replace(minute=0, second=0, microsecond=0)
+    since = (bucket - timedelta(hours=ISOLATION_HISTORY_MAX - 1)).isoformat()
+    
+    for point in get_record_store().load(get_user_id(), 'isolation_history', since=since):
+        if history and history[-1].get('bucket') == point.get('bucket'):
+            history[-1] = point
+        else:
+            history.append(point)
+    
+    return history
+
+def record_isolation_point(score):
+    """고립 점수 이력 기록 - 점수가 바뀔 때만, 같은 시간대는 덮어쓰기"""
+    history = st.session_state.isolation_history
+    
+    if history and history[-1]['score'] == score:
+        return
+    
+    now = rerun_now()
+    point = {
+        'bucket': now.replace(minute=0, second=0, microsecond=0).isoformat(),
+        'timestamp': now.isoformat(),
+        'score': score,
+        'days_since_contact': days_since_last_social_contact()
+    }
+    
+    if history and history[-1].get('bucket') == point['bucket']:
+        history[-1] = point
+    else:
+        history.append(point)
     
-    return min(score, 100)
+    persist_record('isolation_history', point)
 
 def update_isolation_score():
     """고립 점수 업데이트 및 이력 저장"""
     score = calculate_isolation_score()
+    if score != st.session_state.isolation_score:
+        invalidate_metrics('get_isolation_level', 'intervention_decision')
     st.session_state.isolation_score = score
     
-    # 이력 저장
-    isolation_record = {
-        'timestamp': datetime.now().isoformat(),
-        'score': score,
-        'days_since_contact': (datetime.now() - st.session_state.last_social_contact).days if st.session_state.last_social_contact else 999
-    }
-    
-    st.session_state.isolation_history.append(isolation_record)
-    
-    # 최근 30개만 유지
-    if len(st.session_state.isolation_history) > 30:
-        st.session_state.isolation_history = st.session_state.isolation_history[-30:]
+    record_isolation_point(score)
     
     return score
 
+@rerun_cached
 def get_isolation_level():
     """고립 수준 판단"""
     score = st.session_state.isolation_score
@@ -1753,12 +4414,7 @@ def get_social_intervention_message():
     level = isolation_level['level']
     score = st.session_state.isolation_score
     
-    days_since = 999
-    if st.session_state.last_social_contact:
-        last_contact = st.session_state.last_social_contact
-        if isinstance(last_contact, str):
-            last_contact = datetime.fromisoformat(last_contact)
-        days_since = (datetime.now() - last_contact).days
+    days_since = days_since_last_social_contact()
     
     crisis_pattern = get_crisis_pattern()
     
@@ -1881,16 +4537,7 @@ def get_social_intervention_message():
             'message': message
         }
 
-def check_social_intervention():
-    """사회적 연결 개입 필요 여부 체크"""
-    update_isolation_score()
-    isolation_level = get_isolation_level()
-    
-    if isolation_level['level'] == 0:
-        return None
-    
-    return get_social_intervention_message()
-
+@traced()
 def show_social_intervention():
     """사회적 연결 개입 화면"""
     intervention = get_social_intervention_message()
@@ -1931,28 +4578,25 @@ def show_social_intervention():
     
     if st.button("✅ 접촉 기록하기", use_container_width=True, type="primary"):
         record_social_contact(contact_type, quality, notes)
-        st.success("🎉 잘했어요! 사회적 연결은 회복의 핵심이에요!")
-        if quality == "따뜻했다":
-            st.balloons()
-        time.sleep(2)
+        flash("🎉 잘했어요! 사회적 연결은 회복의 핵심이에요!", balloons=quality == "따뜻했다")
         st.rerun()
 
 def record_social_contact(contact_type, quality, notes=""):
     """사회적 접촉 기록"""
-    interaction = {
-        'timestamp': datetime.now().isoformat(),
-        'date': datetime.now().date().isoformat(),
-        'type': contact_type,
-        'quality': quality,
-        'notes': notes
-    }
+    now = datetime.now()
+    interaction = SocialInteraction(
+        now.timestamp(),
+        encode_label(CONTACT_TYPES, contact_type, 5),
+        encode_label(CONTACT_QUALITIES, quality, 1),
+        notes
+    )
     
+    # 최근 90개만 유지 (RecordHistory maxlen)
     st.session_state.social_interactions.append(interaction)
-    st.session_state.last_social_contact = datetime.now()
+    persist_record('social_interactions', interaction)
+    st.session_state.last_social_contact = now
     
-    # 최근 90일치만 유지
-    if len(st.session_state.social_interactions) > 90:
-        st.session_state.social_interactions = st.session_state.social_interactions[-90:]
+    invalidate_metrics()
     
     # 고립 점수 재계산
     update_isolation_score()
@@ -2075,23 +4719,24 @@ def get_sns_safety_guide():
 # 3-5. Module 5: Social Risk Management Engine (사회 위험 관리 엔진)
 # ============================================================================
 
-def detect_toxic_social_pattern(text):
+# 유해 패턴 키워드
+TOXIC_PATTERNS = {
+    '비교중독': ['부럽', '나만 못', '다들', '남들은', '혼자만'],
+    '악플노출': ['악플', '비난', '욕', '싫어', '공격'],
+    '고립심화': ['삭제', '차단', '끊', '멀리', '안 보고 싶'],
+    'sns중독': ['계속', '멈출 수 없', '하루종일', '새벽까지']
+}
+
+@traced()
+def detect_toxic_social_pattern(text, hits=None):
     """유해한 사회적 패턴 감지"""
-    toxic_patterns = {
-        '비교중독': ['부럽', '나만 못', '다들', '남들은', '혼자만'],
-        '악플노출': ['악플', '비난', '욕', '싫어', '공격'],
-        '고립심화': ['삭제', '차단', '끊', '멀리', '안 보고 싶'],
-        'sns중독': ['계속', '멈출 수 없', '하루종일', '새벽까지']
-    }
+    if hits is None:
+        hits = scan_keywords(text)
     
-    detected = []
-    text_lower = text.lower()
-    
-    for pattern_type, keywords in toxic_patterns.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                detected.append(pattern_type)
-                break
+    detected = [
+        pattern_type for pattern_type in TOXIC_PATTERNS.keys()
+        if hits.get(('toxic', pattern_type))
+    ]
     
     return list(set(detected))
 
@@ -2165,6 +4810,7 @@ SNS에 너무 많은 시간을 쓰고 있나요?
 # 3-6. Social Connection Dashboard (사회적 연결 대시보드)
 # ============================================================================
 
+@traced()
 def show_social_connection_dashboard():
     """사회적 연결 대시보드"""
     st.subheader("🤝 사회적 연결 대시보드")
@@ -2176,16 +4822,11 @@ def show_social_connection_dashboard():
     isolation_level = get_isolation_level()
     
     # 마지막 접촉
-    days_since = 999
-    if st.session_state.last_social_contact:
-        last_contact = st.session_state.last_social_contact
-        if isinstance(last_contact, str):
-            last_contact = datetime.fromisoformat(last_contact)
-        days_since = (datetime.now() - last_contact).days
+    days_since = days_since_last_social_contact()
     
     # 최근 7일 접촉 횟수
-    week_ago = (datetime.now() - timedelta(days=7)).date().isoformat()
-    recent_contacts = [c for c in st.session_state.social_interactions if c['date'] >= week_ago]
+    week_ago = rerun_now().date().toordinal() - 7
+    recent_contact_count = st.session_state.social_interactions.count_since_day(week_ago)
     
     # 메트릭
     col1, col2, col3, col4 = st.columns(4)
@@ -2201,7 +4842,7 @@ def show_social_connection_dashboard():
             st.metric("마지막 접촉", "기록 없음")
     
     with col2:
-        st.metric("7일 접촉", f"{len(recent_contacts)}회")
+        st.metric("7일 접촉", f"{recent_contact_count}회")
     
     with col3:
         color_emoji = {
@@ -2242,92 +4883,81 @@ def show_social_connection_dashboard():
     # Module 3: 현실 세계 연결 제안
     st.subheader("🌍 현실 세계 연결 제안")
     
-    suggestions = get_reality_social_suggestions()
+    static_blocks = get_static_blocks()
+    suggestions = static_blocks['reality_suggestions']
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
         st.markdown("### 즉시 가능")
-        for suggestion in suggestions['즉시 가능']:
-            st.markdown(f"- {suggestion}")
+        st.markdown(suggestions['즉시 가능'])
     
     with col2:
         st.markdown("### 약간의 준비")
-        for suggestion in suggestions['약간의 준비']:
-            st.markdown(f"- {suggestion}")
+        st.markdown(suggestions['약간의 준비'])
     
     with col3:
         st.markdown("### 계획 필요")
-        for suggestion in suggestions['계획 필요']:
-            st.markdown(f"- {suggestion}")
+        st.markdown(suggestions['계획 필요'])
     
     st.markdown("---")
     
     # 지역사회 자원
     st.subheader("📍 지역사회 자원")
     
-    resources = get_community_resources()
+    resources = static_blocks['community_resources']
     
     tab1, tab2, tab3, tab4 = st.tabs(["정신건강", "종교시설", "사회활동", "온라인커뮤니티"])
     
     with tab1:
-        for resource in resources['정신건강']:
-            st.markdown(f"- {resource}")
+        st.markdown(resources['정신건강'])
     
     with tab2:
-        for resource in resources['종교시설']:
-            st.markdown(f"- {resource}")
+        st.markdown(resources['종교시설'])
     
     with tab3:
-        for resource in resources['사회활동']:
-            st.markdown(f"- {resource}")
+        st.markdown(resources['사회활동'])
     
     with tab4:
-        for resource in resources['온라인커뮤니티']:
-            st.markdown(f"- {resource}")
+        st.markdown(resources['온라인커뮤니티'])
     
     st.markdown("---")
     
     # Module 4: 디지털 연결 팁
     st.subheader("📱 디지털 연결 가이드")
     
-    digital_tips = get_digital_connection_tips()
+    digital_tips = static_blocks['digital_tips']
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
         st.markdown("### 초보자용")
-        for tip in digital_tips['초보자용 (쉬움)']:
-            st.markdown(f"- {tip}")
+        st.markdown(digital_tips['초보자용 (쉬움)'])
     
     with col2:
         st.markdown("### 중급자용")
-        for tip in digital_tips['중급자용 (보통)']:
-            st.markdown(f"- {tip}")
+        st.markdown(digital_tips['중급자용 (보통)'])
     
     with col3:
         st.markdown("### 적극적")
-        for tip in digital_tips['적극적 (활발)']:
-            st.markdown(f"- {tip}")
+        st.markdown(digital_tips['적극적 (활발)'])
     
     st.markdown("---")
     
     # Module 5: SNS 안전 가이드
     st.subheader("🛡️ SNS 안전 가이드")
     
-    safety = get_sns_safety_guide()
+    safety = static_blocks['sns_safety']
     
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("### ⚠️ 피해야 할 것")
-        for item in safety['⚠️ 피해야 할 것']:
-            st.markdown(f"{item}")
+        st.markdown(safety['⚠️ 피해야 할 것'])
     
     with col2:
         st.markdown("### ✅ 권장하는 것")
-        for item in safety['✅ 권장하는 것']:
-            st.markdown(f"{item}")
+        st.markdown(safety['✅ 권장하는 것'])
     
     st.markdown("---")
     
@@ -2351,10 +4981,10 @@ def show_social_connection_dashboard():
         recent_10 = st.session_state.social_interactions[-10:]
         
         for record in reversed(recent_10):
-            timestamp = datetime.fromisoformat(record['timestamp']).strftime("%m/%d %H:%M")
-            contact_type = record['type']
-            quality = record['quality']
-            notes = record.get('notes', '')
+            timestamp = record.timestamp.strftime("%m/%d %H:%M")
+            contact_type = record.contact_type
+            quality = record.quality
+            notes = record.notes
             
             quality_emoji = "💙" if quality == "따뜻했다" else "😊" if quality == "괜찮았다" else "😐" if quality == "형식적이었다" else "😔"
             
@@ -2390,10 +5020,7 @@ def show_social_connection_dashboard():
     
     if st.button("✅ 접촉 기록 추가", use_container_width=True, type="primary"):
         record_social_contact(contact_type, quality, notes)
-        st.success("🎉 기록 완료! 사회적 연결은 회복의 핵심이에요!")
-        if quality == "따뜻했다":
-            st.balloons()
-        time.sleep(1)
+        flash("🎉 기록 완료! 사회적 연결은 회복의 핵심이에요!", balloons=quality == "따뜻했다")
         st.rerun()
 
 # ============================================================================
@@ -2408,15 +5035,16 @@ def reset_daily_state():
         st.session_state.recovery_confirmed = False
         st.session_state.last_reset_date = today
 
+@traced()
 def check_boundary_zone():
     """경계 구역 체크"""
     if st.session_state.target_bedtime is None:
         return False
     
-    now = datetime.now().time()
+    now = rerun_now().time()
     target = st.session_state.target_bedtime
     
-    target_dt = datetime.combine(datetime.today(), target)
+    target_dt = datetime.combine(rerun_now().date(), target)
     boundary_start = (target_dt - timedelta(hours=1)).time()
     
     if boundary_start <= now <= target:
@@ -2429,29 +5057,23 @@ def check_boundary_zone():
     return False
 
 def calculate_realtime_sleep_debt():
-    """실시간 수면 부족량 계산"""
-    if len(st.session_state.sleep_data) == 0:
-        return 0
-    
-    recent_data = st.session_state.sleep_data[-7:]
-    total_hours = sum([record['total_sleep_hours'] for record in recent_data])
-    avg_sleep = total_hours / len(recent_data)
-    
-    recommended_sleep = 7.5
-    daily_deficit = recommended_sleep - avg_sleep
-    total_debt = daily_deficit * len(recent_data)
-    
-    return abs(total_debt)
+    """실시간 수면 부족량 (시간) - 최근 7회 수면 일지 이동 합계"""
+    return get_sleep_stats()['debt_hours']
 
 def trigger_intervention():
     """AI 강제 개입 발동"""
     st.session_state.intervention_mode = True
     st.session_state.intervention_count += 1
 
+@traced()
 def show_intervention():
     """AI 강제 개입 화면"""
+    # 규칙(경계 구역 + 수면 부족)으로 들어온 경우에도 회복 확인 전까지 유지
+    if not st.session_state.intervention_mode:
+        trigger_intervention()
+    
     sleep_debt = calculate_realtime_sleep_debt()
-    current_time = datetime.now().strftime("%H시 %M분")
+    current_time = rerun_now().strftime("%H시 %M분")
     
     st.error(f"""
     🚨 **GINI R.E.S.T. 개입. 당신의 수면 방어 시스템이 무너지고 있습니다.**
@@ -2475,12 +5097,12 @@ def show_intervention():
         if recovery_input.strip() == "수면 복원":
             st.session_state.recovery_confirmed = True
             st.session_state.intervention_mode = False
-            st.success("✅ 회복 의지가 확인되었습니다. 지금 바로 스마트폰을 끄고 침대로 가세요.")
-            time.sleep(2)
+            flash("✅ 회복 의지가 확인되었습니다. 지금 바로 스마트폰을 끄고 침대로 가세요.")
             st.rerun()
         else:
             st.error("❌ '수면 복원'을 정확히 입력해주세요.")
 
+@traced()
 def set_target_bedtime():
     """목표 취침 시간 설정"""
     st.subheader("🎯 목표 취침 시간 설정")
@@ -2495,171 +5117,1177 @@ def set_target_bedtime():
     
     current_target = st.session_state.target_bedtime
     
-    if current_target:
-        st.success(f"✅ 현재 목표 취침 시간: {current_target.strftime('%H:%M')}")
+    if current_target:
+        st.success(f"✅ 현재 목표 취침 시간: {current_target.strftime('%H:%M')}")
+    
+    new_bedtime = st.time_input(
+        "목표 취침 시간 설정",
+        value=current_target if current_target else datetime.now().replace(hour=23, minute=0).time()
+    )
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        if st.button("목표 설정", use_container_width=True):
+            st.session_state.target_bedtime = new_bedtime
+            st.success(f"목표 취침 시간이 {new_bedtime.strftime('%H:%M')}로 설정되었습니다!")
+            st.rerun()
+    
+    with col2:
+        if st.button("목표 해제", use_container_width=True):
+            st.session_state.target_bedtime = None
+            st.info("목표 취침 시간이 해제되었습니다.")
+            st.rerun()
+
+# ============================================================================
+# 2-4. Crisis Dashboard (유지)
+# ============================================================================
+
+@traced()
+def show_crisis_dashboard():
+    """위기 관리 대시보드"""
+    st.subheader("📊 위기 관리 대시보드")
+    
+    pattern = get_crisis_pattern()
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("총 위기 감지", f"{pattern['total_count']}회")
+    
+    with col2:
+        st.metric("최근 7일", f"{pattern['recent_7days']}회")
+    
+    with col3:
+        st.metric("최근 30일", f"{pattern.get('recent_30days', 0)}회")
+    
+    with col4:
+        trend_emoji = "⚠️" if pattern['trend'] == 'worsening' else "📊" if pattern['trend'] == 'concerning' else "✅"
+        trend_text = "악화" if pattern['trend'] == 'worsening' else "주의" if pattern['trend'] == 'concerning' else "안정"
+        st.metric("추세", f"{trend_emoji} {trend_text}")
+    
+    st.markdown("---")
+    
+    if pattern['trend'] == 'worsening':
+        st.error("""
+        ⚠️ **위기 추세 악화 감지**
+        
+        최근 7일간 빈번한 위기 신호가 감지되었습니다.
+        **전문가 상담을 강력히 권장합니다.**
+        
+        📞 자살예방 상담전화: 1393 (24시간)
+        """)
+    elif pattern['trend'] == 'concerning':
+        st.warning("""
+        📊 **주의가 필요한 상태**
+        
+        최근 위기 신호가 감지되었습니다.
+        상태가 지속되면 전문가와 상담하세요.
+        """)
+    else:
+        st.success("""
+        ✅ **안정적인 상태**
+        
+        현재 위기 신호가 적습니다.
+        계속 건강한 패턴을 유지하세요.
+        """)
+    
+    # 최근 위기 이력
+    if len(st.session_state.crisis_history) > 0:
+        st.markdown("---")
+        st.subheader("📋 최근 위기 이력")
+        
+        recent_5 = st.session_state.crisis_history[-5:]
+        
+        for event in reversed(recent_5):
+            timestamp = event.timestamp.strftime("%Y-%m-%d %H:%M")
+            level = event.level
+            level_emoji = "🚨" if level == 3 else "⚠️" if level == 2 else "💛"
+            level_text = "Level 3 (긴급)" if level == 3 else "Level 2 (경고)" if level == 2 else "Level 1 (주의)"
+            
+            with st.expander(f"{level_emoji} {timestamp} - {level_text}"):
+                st.write(f"**감지 키워드:** {', '.join(event.keywords)}")
+                st.write(f"**비유 표현:** {'예' if event.is_metaphor else '아니오'}")
+
+# ============================================================================
+# 3. 면책 조항 (유지)
+# ============================================================================
+
+# 이용 약관 - {storage_notice}만 표시 시점에 치환
+DISCLAIMER_TERMS_TEMPLATE = """
+    ### ⚠️ 이용 약관 및 면책 조항
+    
+    #### 1. 서비스의 성격
+    - 본 서비스는 **정신건강 회복 지원 도구**입니다.
+    - 수면, 운동, 영양, 사회적 연결, 감정 패턴을 관리합니다.
+    - **의학적 진단, 치료, 상담을 제공하지 않습니다.**
+    
+    #### 2. Phase 2 추가 기능
+    - ✅ **Emotion Pattern Engine (감정 패턴 분석)**
+    - ✅ E1-E5 감정 레벨 자동 분석
+    - ✅ Phase 1과 통합 (위기+고립+감정)
+    - ✅ 감정 기반 맞춤 반응 메시지
+    
+    #### 3. Phase 1 기능 (유지)
+    - ✅ 다단계 위기 감지 시스템
+    - ✅ 강력한 운동 개입 시스템
+    - ✅ 강력한 영양 개입 시스템
+    - ✅ 사회적 연결 엔진 (5개 모듈)
+    - ✅ GPS 위치 자동 표시 (긴급 상황용)
+    
+    #### 4. 사용자의 책임
+    - 심각한 정신건강 문제가 있다면 **반드시 전문가와 상담**하세요.
+    - E4-E5 레벨이 지속되면 전문가 도움이 필요합니다.
+    - 응급 상황 시 즉시 119 또는 1393으로 연락하세요.
+    
+    #### 5. 데이터
+    - {storage_notice}
+    
+    #### 6. 면책사항
+    - 본 서비스 사용으로 인한 결과에 대해 개발자는 책임지지 않습니다.
+    """
+
+def get_storage_notice():
+    """현재 저장소 종류 안내 문구"""
+    kind = get_record_store().kind
+    if kind == 'session':
+        return "기록은 이 브라우저 세션에만 보관되며, 창을 닫거나 새로 고치면 사라집니다."
+    
+    where = "서버 데이터베이스에 저장되며" if kind == 'sqlite' else "서버 메모리에 임시 보관되며 (서버 재시작 시 삭제)"
+    return (
+        f"기록은 {where}, 접속 주소의 사용자 ID(`?uid=`)에 연결됩니다. "
+        "같은 주소로 다시 접속하면 이어서 볼 수 있습니다.\n"
+        "- ⚠️ **이 주소는 비밀번호와 같습니다.** 주소를 아는 사람은 누구나 기록을 볼 수 있으니 "
+        "공유하거나 공용 기기 북마크에 남기지 마세요."
+    )
+
+@traced()
+def show_disclaimer():
+    """면책 조항"""
+    st.title("🌙 GINI R.E.S.T.")
+    st.subheader("Human Recovery AI System v3.0 Phase 2")
+    st.caption("✅ Phase 2: Emotion Pattern Engine")
+    
+    st.markdown("---")
+    
+    st.markdown(get_static_blocks()['disclaimer_terms'].format(
+        storage_notice=get_storage_notice()
+    ))
+    
+    st.markdown("---")
+    
+    agree = st.checkbox("위 내용을 모두 읽고 이해했으며, 이에 동의합니다.")
+    
+    if st.button("시작하기", disabled=not agree, use_container_width=True):
+        st.session_state.agreed_to_terms = True
+        st.rerun()
+
+# ============================================================================
+# 2-5. 수면 일지 엔진 (수면 부족 / 효율 / 일주기 변화)
+# ============================================================================
+
+SLEEP_NEED_HOURS = 7.5        # 하루 권장 수면
+SLEEP_WINDOW_NIGHTS = 7       # 이동 합계 기준 (기상일 기준 오늘 포함 최근 일수)
+CHRONOTYPE_EWMA_ALPHA = 0.2   # 창 밖으로 밀려난 밤들의 수면 중간 시각 기준선
+
+class SleepStats:
+    """기상일 기준 최근 window일(오늘 포함) 수면 기록의 이동 합계 - 기록 1건당 O(1) 갱신
+
+    부족량 = 권장 수면 x 기록한 밤 수 - 실제 수면 합 (초과분은 부족을 갚음, 0 미만 없음)
+    효율 = 실제 수면 합 / 누워 있던 시간 합
+    일주기 변화 = 최근 창 수면 중간 시각 평균 - 창 밖으로 밀려난 밤들의 EWMA 기준선 (분, +면 늦어짐)
+    오래된 기록은 날짜가 지나면 창에서 빠진다 (한 달 전 부족량이 남지 않음).
+    """
+
+    def __init__(self, records=(), window=SLEEP_WINDOW_NIGHTS, need_hours=SLEEP_NEED_HOURS,
+                 alpha=CHRONOTYPE_EWMA_ALPHA):
+        self.window = window
+        self.need_seconds = need_hours * 3600
+        self.alpha = alpha
+        self.reset(records)
+
+    def reset(self, records=()):
+        """기록 목록(취침 시각 순)으로 처음부터 다시 누적"""
+        self._recent = deque()  # (기상일, 실제 수면, 누운 시간, 중간 시각, 기상 시각)
+        self._sums = [0.0, 0.0, 0.0, 0.0]
+        self.baseline_midpoint = None
+        self.last_ts = None
+        
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """시간순 마지막 기록 반영 - 과거 기록이면 False (호출 측에서 reset)"""
+        if self.last_ts is not None and record.ts < self.last_ts:
+            return False
+        
+        item = (
+            record.day, record.total_sleep_seconds, record.time_in_bed_seconds,
+            record.midpoint_minutes, record.wake_minutes
+        )
+        self._recent.append(item)
+        for index in range(4):
+            self._sums[index] += item[index + 1]
+        self.last_ts = record.ts
+        
+        self._expire(record.day)
+        return True
+
+    def _expire(self, today):
+        """기상일이 창(today-window+1 ~ today)보다 오래된 밤을 빼고 기준선에 합침"""
+        first_day = today - self.window + 1
+        while self._recent and self._recent[0][0] < first_day:
+            item = self._recent.popleft()
+            for index in range(4):
+                self._sums[index] -= item[index + 1]
+            
+            midpoint = item[3]
+            if self.baseline_midpoint is None:
+                self.baseline_midpoint = midpoint
+            else:
+                self.baseline_midpoint += self.alpha * (midpoint - self.baseline_midpoint)
+
+    def summary(self, today):
+        """today(ordinal) 기준 창의 지표"""
+        self._expire(today)
+        
+        nights = len(self._recent)
+        if nights == 0:
+            return {
+                'nights': 0, 'debt_hours': 0.0, 'avg_sleep_hours': None, 'efficiency': None,
+                'midpoint_minutes': None, 'wake_minutes': None, 'drift_minutes': None
+            }
+        
+        sleep_sum, bed_sum, midpoint_sum, wake_sum = self._sums
+        midpoint = midpoint_sum / nights
+        return {
+            'nights': nights,
+            'debt_hours': max(self.need_seconds * nights - sleep_sum, 0) / 3600,
+            'avg_sleep_hours': sleep_sum / nights / 3600,
+            'efficiency': sleep_sum / bed_sum if bed_sum > 0 else None,
+            'midpoint_minutes': midpoint,
+            'wake_minutes': wake_sum / nights,
+            'drift_minutes': None if self.baseline_midpoint is None else midpoint - self.baseline_midpoint
+        }
+
+def format_midpoint(minutes):
+    """18:00 기준 분 → HH:MM"""
+    clock = int(round(minutes + 18 * 60)) % 1440
+    return f"{clock // 60:02d}:{clock % 60:02d}"
+
+def has_sleep_record(day):
+    """이 기상일(ordinal)에 이미 수면 기록이 있는지"""
+    return day in st.session_state.sleep_data.days
+
+def record_sleep(bedtime, wake_time, latency_minutes, awakenings, awake_minutes):
+    """수면 일지 기록 추가 - 같은 기상일 기록이 이미 있으면 추가하지 않고 False"""
+    if has_sleep_record(wake_time.date().toordinal()):
+        return False
+    
+    sleep_record = SleepRecord(
+        bedtime.timestamp(),
+        wake_time.timestamp(),
+        int(latency_minutes),
+        int(awakenings),
+        int(awake_minutes)
+    )
+    
+    # 최근 365일치만 유지 (RecordHistory horizon_days)
+    history = st.session_state.sleep_data
+    history.append(sleep_record)
+    persist_record('sleep_data', sleep_record)
+    
+    # 지난 날짜를 뒤늦게 기록하면 이동 합계를 다시 계산
+    stats = st.session_state.sleep_stats
+    if not stats.add(sleep_record):
+        stats.reset(history)
+    
+    invalidate_metrics()
+    return True
+
+@rerun_cached
+def get_sleep_stats():
+    """수면 지표 (기상일 기준 최근 7일) - 부족량/평균 수면/효율/수면 중간 시각/일주기 변화"""
+    return st.session_state.sleep_stats.summary(rerun_now().date().toordinal())
+
+def validate_sleep_entry(bedtime, wake_time, latency_minutes, awake_minutes):
+    """수면 일지 입력 검증 - 오류 문구 목록"""
+    errors = []
+    time_in_bed = (wake_time - bedtime).total_seconds() / 60
+    
+    if time_in_bed <= 0:
+        errors.append("기상 시각이 취침 시각보다 늦어야 합니다.")
+    elif time_in_bed > 16 * 60:
+        errors.append("누워 있던 시간이 16시간을 넘습니다. 날짜를 확인해주세요.")
+    elif latency_minutes + awake_minutes >= time_in_bed:
+        errors.append("잠들기까지 걸린 시간과 깨어 있던 시간의 합이 누워 있던 시간보다 깁니다.")
+    
+    if wake_time > rerun_now() + timedelta(minutes=5):
+        errors.append("아직 오지 않은 기상 시각입니다.")
+    
+    if has_sleep_record(wake_time.date().toordinal()):
+        errors.append(f"{wake_time.date().isoformat()} 기상 기록이 이미 있습니다. 하루에 한 번만 기록할 수 있어요.")
+    
+    return errors
+
+@traced()
+def add_sleep_record():
+    """수면 일지 기록"""
+    st.subheader("📝 어젯밤 수면 일지")
+    st.caption("잠자리에 든 시각과 일어난 시각, 잠들기까지 걸린 시간, 밤중에 깬 횟수를 적어주세요.")
+    
+    now = rerun_now()
+    default_bedtime = st.session_state.target_bedtime or datetime.strptime("23:00", "%H:%M").time()
+    
+    with st.form("sleep_entry", clear_on_submit=False):
+        wake_date = st.date_input("기상 날짜", value=now.date(), max_value=now.date())
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            bed_clock = st.time_input("잠자리에 든 시각", value=default_bedtime)
+            latency = st.number_input("잠들기까지 걸린 시간 (분)", min_value=0, max_value=300, value=15, step=5)
+        with col2:
+            wake_clock = st.time_input("일어난 시각", value=datetime.strptime("07:00", "%H:%M").time())
+            awakenings = st.number_input("밤중에 깬 횟수", min_value=0, max_value=20, value=0, step=1)
+        
+        awake_minutes = st.number_input("밤중에 깨어 있던 시간 합계 (분)", min_value=0, max_value=600, value=0, step=5)
+        submitted = st.form_submit_button("✅ 수면 기록 저장", use_container_width=True, type="primary")
+    
+    if submitted:
+        wake_time = datetime.combine(wake_date, wake_clock)
+        bedtime = datetime.combine(wake_date, bed_clock)
+        if bedtime >= wake_time:
+            bedtime -= timedelta(days=1)  # 자정 전에 누운 경우 전날
+        
+        errors = validate_sleep_entry(bedtime, wake_time, latency, awake_minutes)
+        if errors:
+            for error in errors:
+                st.error(f"❌ {error}")
+        else:
+            record_sleep(bedtime, wake_time, latency, awakenings, awake_minutes)
+            hours = (wake_time - bedtime).total_seconds() / 3600 - (latency + awake_minutes) / 60
+            flash(f"🌙 수면 기록 완료! 실제 수면 {hours:.1f}시간")
+            st.rerun()
+    
+    # 최근 수면 기록
+    if len(st.session_state.sleep_data) > 0:
+        st.markdown("---")
+        st.subheader("📋 최근 수면 기록")
+        
+        for record in reversed(st.session_state.sleep_data[-7:]):
+            sleep_hours = record.total_sleep_seconds / 3600
+            efficiency = record.total_sleep_seconds / record.time_in_bed_seconds
+            
+            with st.expander(f"🌙 {record.date.isoformat()} - {sleep_hours:.1f}시간 (효율 {efficiency:.0%})"):
+                st.write(f"**취침:** {record.timestamp.strftime('%m/%d %H:%M')}")
+                st.write(f"**기상:** {record.wake_time.strftime('%m/%d %H:%M')}")
+                st.write(f"**잠들기까지:** {record.latency_minutes}분")
+                st.write(f"**밤중 깸:** {record.awakenings}회 ({record.awake_minutes}분)")
+
+@traced()
+def calculate_sleep_debt():
+    """수면 분석 - 수면 부족량, 효율, 일주기 변화"""
+    stats = get_sleep_stats()
+    
+    if stats['nights'] == 0:
+        if len(st.session_state.sleep_data) > 0:
+            st.info(f"최근 {SLEEP_WINDOW_NIGHTS}일 안의 수면 기록이 없어요. '📊 수면 기록'에서 어젯밤 수면을 적어주세요.")
+        else:
+            st.info("아직 수면 기록이 없어요. '📊 수면 기록'에서 어젯밤 수면을 먼저 적어주세요.")
+        return
+
+    st.subheader(f"💤 최근 {SLEEP_WINDOW_NIGHTS}일 중 {stats['nights']}일 기록 분석")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("수면 부족량", f"{stats['debt_hours']:.1f}시간")
+    
+    with col2:
+        st.metric("평균 수면", f"{stats['avg_sleep_hours']:.1f}시간", delta=f"{stats['avg_sleep_hours'] - SLEEP_NEED_HOURS:+.1f} (권장 대비)")
+    
+    with col3:
+        st.metric("수면 효율", f"{stats['efficiency']:.0%}" if stats['efficiency'] is not None else "-")
+    
+    with col4:
+        drift = stats['drift_minutes']
+        st.metric(
+            "수면 중간 시각",
+            format_midpoint(stats['midpoint_minutes']),
+            delta=None if drift is None else f"{drift:+.0f}분",
+            delta_color="inverse"
+        )
+    
+    st.markdown("---")
+    
+    # 해석
+    if stats['debt_hours'] >= 5:
+        st.error(f"🚨 **수면 부족이 {stats['debt_hours']:.1f}시간 쌓였습니다.** 오늘은 목표 취침 시간을 반드시 지켜주세요.")
+    elif stats['debt_hours'] >= 2:
+        st.warning(f"⚠️ 수면 부족 {stats['debt_hours']:.1f}시간 - 주말 몰아 자기보다 매일 30분씩 일찍 누워보세요.")
+    else:
+        st.success("✅ 수면량 양호!")
+    
+    if stats['efficiency'] is not None and stats['efficiency'] < 0.85:
+        st.warning(
+            f"🛏️ 수면 효율 {stats['efficiency']:.0%} (권장 85% 이상) - 누워서 깨어 있는 시간이 길어요. "
+            "'🧠 CBT-I 교육'의 수면 제한법과 자극 조절법을 확인해보세요."
+        )
+    
+    if drift is not None and abs(drift) >= 60:
+        direction = "늦어지고" if drift > 0 else "빨라지고"
+        st.warning(f"🕐 수면 중간 시각이 이전보다 {abs(drift):.0f}분 {direction} 있어요. 기상 시각을 매일 같게 유지하면 리듬이 돌아옵니다.")
+
+# CBT-I (불면증 인지행동치료) 교육 - (제목, 본문)
+CBTI_SECTIONS = (
+    ("1️⃣ 수면 제한", """
+    **누워 있는 시간을 실제로 자는 시간에 맞춥니다.**
+    
+    - 최근 평균 수면 시간만큼만 침대에 머무르세요 (최소 5시간).
+    - 기상 시각을 먼저 고정하고, 거꾸로 계산해서 취침 시각을 정합니다.
+    - 수면 효율이 1주일 동안 85%를 넘으면 누워 있는 시간을 15분 늘립니다.
+    - 처음 1-2주는 낮에 졸릴 수 있어요. 운전 등 위험한 활동은 조심하세요.
+    """),
+    ("2️⃣ 자극 조절", """
+    **침대 = 잠이라는 연결을 다시 만듭니다.**
+    
+    - 졸릴 때만 잠자리에 듭니다.
+    - 20분 안에 잠들지 못하면 일어나서 다른 방에서 조용한 활동을 하다가 졸리면 돌아오세요.
+    - 침대에서는 잠과 부부관계 외의 활동(스마트폰, TV, 일)을 하지 않습니다.
+    - 얼마나 잤든 매일 같은 시각에 일어납니다.
+    - 낮잠은 피하거나 오후 3시 전 20분 이내로.
+    """),
+    ("3️⃣ 수면 위생", """
+    **잠을 방해하는 습관을 줄입니다.**
+    
+    - ☕ 카페인은 오후 2시 이후 금지
+    - 🍺 술은 잠들게 하지만 새벽에 깨게 만듭니다
+    - 📱 취침 1시간 전부터 화면 끄기 (경계 구역)
+    - 🌡️ 침실은 서늘하고 어둡고 조용하게
+    - ☀️ 아침에 햇빛 10분 - 생체 시계를 맞춥니다
+    - 🏃 규칙적인 운동 (단, 취침 3시간 전까지)
+    """),
+    ("4️⃣ 인지 재구성", """
+    **잠에 대한 걱정이 불면을 키웁니다.**
+    
+    | 이런 생각이 들면 | 이렇게 바꿔보세요 |
+    |---|---|
+    | "8시간 못 자면 내일 망한다" | "짧게 자도 하루는 버틸 수 있다. 몸은 스스로 회복한다" |
+    | "오늘도 못 잘 거야" | "잠은 노력이 아니라 졸림이 데려온다" |
+    | "누워만 있어도 쉬는 거다" | "잠이 안 오면 일어나는 게 오히려 잠을 돕는다" |
+    
+    - 걱정이 많다면 저녁에 '걱정 시간' 15분을 정해 미리 적어두세요.
+    """),
+    ("5️⃣ 이완", """
+    **몸이 긴장을 풀어야 잠이 옵니다.**
+    
+    - 🫁 4-7-8 호흡 또는 박스 호흡 ('🫁 호흡 운동' 메뉴)
+    - 💪 점진적 근육 이완: 발끝부터 5초 힘주고 10초 풀기
+    - 🧘 바디 스캔: 머리부터 발끝까지 감각을 천천히 느끼기
+    """)
+)
+
+# 수면 제한 처방 - 동적 값만 표시 시점에 치환
+CBTI_PRESCRIPTION_TEMPLATE = """
+**🎯 나의 수면 제한 처방 (최근 {window_days}일 중 {nights}일 기록 기준)**
+
+- 평균 실제 수면: **{avg_sleep:.1f}시간** / 수면 효율: **{efficiency:.0%}**
+- 권장 침대 시간: **{window_hours:.1f}시간**
+- 기상 {wake}으로 고정한다면 → 취침 **{bedtime}**
+"""
+
+# 호흡법 - (들숨, 멈춤, 날숨, 멈춤) 초
+BREATHING_PATTERNS = {
+    "4-7-8 호흡 (잠들기 전)": (4, 7, 8, 0),
+    "박스 호흡 (불안할 때)": (4, 4, 4, 4),
+    "이완 호흡 4-6 (언제나)": (4, 0, 6, 0)
+}
+
+BREATHING_STEP_LABELS = ("들이마시기 (코)", "멈추기", "내쉬기 (입)", "멈추기")
+
+def breathing_animation_html(pattern):
+    """호흡 리듬에 맞춰 커졌다 작아지는 원 (CSS 애니메이션 - 서버 스레드를 붙잡지 않음)"""
+    inhale, hold_in, exhale, hold_out = pattern
+    cycle = inhale + hold_in + exhale + hold_out
+    
+    # 단계 경계를 키프레임 %로
+    grown = inhale / cycle * 100
+    held = (inhale + hold_in) / cycle * 100
+    shrunk = (inhale + hold_in + exhale) / cycle * 100
+    
+    return f"""
+    <style>
+    @keyframes gini-breath-{inhale}-{hold_in}-{exhale}-{hold_out} {{
+        0% {{ transform: scale(0.45); }}
+        {grown:.2f}% {{ transform: scale(1); }}
+        {held:.2f}% {{ transform: scale(1); }}
+        {shrunk:.2f}% {{ transform: scale(0.45); }}
+        100% {{ transform: scale(0.45); }}
+    }}
+    </style>
+    <div style="display: flex; justify-content: center; margin: 30px 0;">
+        <div style="width: 180px; height: 180px; border-radius: 50%;
+             background: radial-gradient(circle, #8ec5fc, #4a6fa5);
+             animation: gini-breath-{inhale}-{hold_in}-{exhale}-{hold_out} {cycle}s ease-in-out infinite;">
+        </div>
+    </div>
+    """
+
+def breathing_steps_markdown(pattern):
+    return markdown_lines([
+        f"**{label}** - {seconds}초"
+        for label, seconds in zip(BREATHING_STEP_LABELS, pattern) if seconds
+    ])
+
+@traced()
+def show_cbti_education():
+    """CBT-I 교육 - 정적 본문(캐시) + 내 수면 기록 기반 수면 제한 처방"""
+    st.caption("불면증 인지행동치료(CBT-I)는 수면제보다 효과가 오래가는 1차 치료법입니다.")
+    
+    blocks = get_static_blocks()
+    stats = get_sleep_stats()
+    
+    if stats['nights'] >= 3 and stats['efficiency'] is not None:
+        # 수면 제한: 침대 시간 = 평균 수면 (최소 5시간), 기상 시각은 최근 평균 기상 시각으로 고정
+        window_hours = max(stats['avg_sleep_hours'], 5.0)
+        wake = datetime.strptime(format_midpoint(stats['wake_minutes']), "%H:%M")
+        st.success(blocks['cbti_prescription'].format(
+            window_days=SLEEP_WINDOW_NIGHTS,
+            nights=stats['nights'],
+            avg_sleep=stats['avg_sleep_hours'],
+            efficiency=stats['efficiency'],
+            window_hours=window_hours,
+            wake=wake.strftime("%H:%M"),
+            bedtime=(wake - timedelta(hours=window_hours)).strftime("%H:%M")
+        ))
+    else:
+        st.info(f"💡 최근 {SLEEP_WINDOW_NIGHTS}일 중 3일 이상 수면을 기록하면 내 기록에 맞춘 수면 제한 처방을 보여드려요.")
+    
+    for title, body in blocks['cbti_sections']:
+        with st.expander(title, expanded=title == CBTI_SECTIONS[0][0]):
+            st.markdown(body)
+
+@traced()
+def breathing_exercise():
+    """호흡 운동 - 선택한 호흡법 안내 + 호흡 리듬 애니메이션"""
+    blocks = get_static_blocks()
     
-    new_bedtime = st.time_input(
-        "목표 취침 시간 설정",
-        value=current_target if current_target else datetime.now().replace(hour=23, minute=0).time()
-    )
+    name = st.selectbox("호흡법", list(BREATHING_PATTERNS.keys()))
+    pattern = BREATHING_PATTERNS[name]
+    cycles = st.slider("반복 횟수", 3, 10, 4)
     
-    col1, col2 = st.columns(2)
+    col1, col2 = st.columns([1, 1])
     
     with col1:
-        if st.button("목표 설정", use_container_width=True):
-            st.session_state.target_bedtime = new_bedtime
-            st.success(f"목표 취침 시간이 {new_bedtime.strftime('%H:%M')}로 설정되었습니다!")
-            st.rerun()
+        st.markdown(blocks['breathing_steps'][name])
+        st.caption(f"1회 {sum(pattern)}초 × {cycles}회 = 약 {sum(pattern) * cycles / 60:.1f}분")
     
     with col2:
-        if st.button("목표 해제", use_container_width=True):
-            st.session_state.target_bedtime = None
-            st.info("목표 취침 시간이 해제되었습니다.")
-            st.rerun()
+        st.markdown(blocks['breathing_animation'][name], unsafe_allow_html=True)
+    
+    st.info("""
+    💡 **원이 커질 때 들이마시고, 작아질 때 내쉬세요.**
+    
+    - 어지러우면 멈추고 평소처럼 숨 쉬세요.
+    - 잠자리에서 하면 잠들기까지 걸리는 시간이 줄어듭니다.
+    """)
 
 # ============================================================================
-# 2-4. Crisis Dashboard (유지)
+# 2-6. 웨어러블 내보내기 가져오기 (스트리밍 파서)
 # ============================================================================
 
-def show_crisis_dashboard():
-    """위기 관리 대시보드"""
-    st.subheader("📊 위기 관리 대시보드")
+IMPORT_BATCH_SIZE = 1000          # 세션/저장소 반영 단위
+IMPORT_CHUNK_SIZE = 1 << 16       # 파일 읽기 단위 (바이트/문자)
+MAX_JSON_OBJECT_CHARS = 1 << 20   # JSON 객체 1개 최대 크기 (형식 오류 시 무한 버퍼링 방지)
+ACTIVE_STEPS_THRESHOLD = 7000     # 이 걸음 수 이상인 날은 운동한 날로 기록
+STEPS_PER_MINUTE = 100            # 걸음 수 → 걷기 시간 환산
+SLEEP_SEGMENT_GAP_HOURS = 3       # 수면 구간 사이가 이보다 벌어지면 다른 밤
+MIN_IMPORT_SLEEP_HOURS = 2        # 이보다 짧은 수면(낮잠)은 건너뜀
+MAX_IMPORT_SLEEP_HOURS = 16
+
+# 열/키 이름 별칭 (소문자, '_', '-', 공백 제거 후 비교 - 점(.)이 있으면 마지막 부분만)
+IMPORT_FIELD_ALIASES = {
+    'type': ('type', 'kind', 'category', 'activity', 'activitytype', 'workoutactivitytype', 'activityname'),
+    'start': ('bedtime', 'sleepstart', 'starttime', 'start', 'startdate', 'begin'),
+    'end': ('waketime', 'sleepend', 'endtime', 'end', 'enddate'),
+    'date': ('date', 'datetime', 'day', 'daytime', 'dateofsleep', 'createtime'),
+    'latency': ('latencyminutes', 'minutestofallasleep', 'latency', 'sleeplatency'),
+    'awake': ('awakeminutes', 'minutesawake', 'wakeminutes', 'waso'),
+    'awakenings': ('awakenings', 'awakeningscount', 'awakecount'),
+    'duration': ('durationminutes', 'duration', 'minutes', 'activeminutes', 'activeduration'),
+    'duration_unit': ('durationunit',),
+    'steps': ('steps', 'stepcount', 'totalsteps'),
+    'intensity': ('intensity',),
+    'main_sleep': ('ismainsleep',)
+}
+
+IMPORT_INTENSITY_ALIASES = {
+    'light': 0, 'low': 0, 'easy': 0, '가벼움': 0,
+    'moderate': 1, 'medium': 1, '보통': 1,
+    'vigorous': 2, 'high': 2, 'hard': 2, '강함': 2
+}
+
+IMPORT_KINDS = {
+    "자동 감지": None,
+    "수면": 'sleep',
+    "걸음 수": 'steps',
+    "운동": 'exercise'
+}
+
+# Apple Health export.xml
+HEALTH_SLEEP_TYPE = 'HKCategoryTypeIdentifierSleepAnalysis'
+HEALTH_STEP_TYPE = 'HKQuantityTypeIdentifierStepCount'
+
+def normalize_field_name(name):
+    name = str(name).strip().lower().rsplit('.', 1)[-1]
+    return re.sub(r'[\s_\-]', '', name)
+
+FIELD_NAME_LOOKUP = {
+    alias: field for field, aliases in IMPORT_FIELD_ALIASES.items() for alias in aliases
+}
+
+def parse_export_time(value):
+    """내보내기 시각 → epoch 초 (ISO / '2024-01-01 23:10:00 +0900' / epoch 초·밀리초) - 실패 시 None"""
+    if isinstance(value, (int, float)):
+        return value / 1000 if value > 1e11 else float(value)
+    if not value:
+        return None
     
-    pattern = get_crisis_pattern()
+    # 대부분의 행은 ISO 형식 - 첫 시도에서 끝냄 (행마다 호출되는 경로)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        pass
     
-    col1, col2, col3, col4 = st.columns(4)
+    text = str(value).strip()
+    if text.replace('.', '', 1).isdigit():
+        return parse_export_time(float(text))
     
-    with col1:
-        st.metric("총 위기 감지", f"{pattern['total_count']}회")
+    # Apple Health 형식: 공백 + ±HHMM 오프셋
+    if len(text) > 6 and text[-5] in '+-' and text[-6] == ' ':
+        text = f"{text[:-6]}{text[-5:-2]}:{text[-2:]}"
     
-    with col2:
-        st.metric("최근 7일", f"{pattern['recent_7days']}회")
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    
+    for fmt in ("%m/%d/%y %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M", "%Y/%m/%d %H:%M", "%m/%d/%Y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+def parse_number(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+class CountingReader(io.RawIOBase):
+    """읽은 바이트 수를 세는 원본 스트림 래퍼 (진행률 계산용)"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        self.bytes_read += size
+        return size
+
+def open_export(fileobj, filename):
+    """업로드 파일 → (형식, 바이너리 스트림, 전체 크기, CountingReader) - zip이면 안의 첫 데이터 파일"""
+    name = filename.lower()
+    size = getattr(fileobj, 'size', None)
+    
+    if name.endswith('.zip'):
+        archive = zipfile.ZipFile(fileobj)
+        members = [
+            info for info in archive.infolist()
+            if info.filename.lower().endswith(('.xml', '.csv', '.json', '.jsonl', '.ndjson'))
+            and 'export_cda' not in info.filename.lower()
+        ]
+        if not members:
+            raise ValueError("zip 안에 XML/CSV/JSON 파일이 없습니다.")
+        # Apple Health zip은 export.xml 우선
+        member = next((m for m in members if m.filename.lower().endswith('export.xml')), members[0])
+        fileobj, name, size = archive.open(member), member.filename.lower(), member.file_size
+    
+    counter = CountingReader(fileobj)
+    stream = io.BufferedReader(counter, buffer_size=IMPORT_CHUNK_SIZE)
+    
+    if name.endswith('.xml'):
+        kind = 'xml'
+    elif name.endswith(('.jsonl', '.ndjson', '.json')):
+        kind = 'json'
+    elif name.endswith('.csv'):
+        kind = 'csv'
+    else:
+        head = stream.peek(64).lstrip()
+        kind = 'xml' if head.startswith(b'<') else 'json' if head[:1] in (b'[', b'{') else 'csv'
     
-    with col3:
-        st.metric("최근 30일", f"{pattern.get('recent_30days', 0)}회")
+    return kind, stream, size, counter
+
+def iter_csv_rows(stream):
+    """CSV → {표준 필드: 값} (헤더 매핑 1회, Samsung Health 첫 줄 메타데이터 건너뜀)"""
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline=''))
     
-    with col4:
-        trend_emoji = "⚠️" if pattern['trend'] == 'worsening' else "📊" if pattern['trend'] == 'concerning' else "✅"
-        trend_text = "악화" if pattern['trend'] == 'worsening' else "주의" if pattern['trend'] == 'concerning' else "안정"
-        st.metric("추세", f"{trend_emoji} {trend_text}")
+    header = next(reader, None)
+    if header and len(header) <= 3 and header[0].startswith('com.samsung'):
+        header = next(reader, None)
+    if not header:
+        return
     
-    st.markdown("---")
+    columns = [
+        (index, FIELD_NAME_LOOKUP.get(normalize_field_name(name), normalize_field_name(name)))
+        for index, name in enumerate(header)
+    ]
     
-    if pattern['trend'] == 'worsening':
-        st.error("""
-        ⚠️ **위기 추세 악화 감지**
+    for row in reader:
+        yield {field: row[index] for index, field in columns if index < len(row) and row[index] != ''}
+
+JSON_SEPARATORS = re.compile(r'[\s,\[\]]*')
+# {"activities-steps": [...], "sleep": [...]} 처럼 목록을 감싼 최상위 객체 안쪽 구분자 (키 문자열은 값으로 읽혀 버려짐)
+JSON_WRAPPED_SEPARATORS = re.compile(r'[\s,:\[\]}]*')
+JSON_WRAPPER_START = re.compile(r'\s*\{\s*"[^"\\]*"\s*:\s*\[')
+
+def iter_json_objects(stream):
+    """JSON 배열 / JSON Lines / 목록을 감싼 객체에서 dict를 raw_decode로 하나씩 (파일 전체를 읽지 않음)"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace')
+    decoder = json.JSONDecoder()
+    buffer = text.read(IMPORT_CHUNK_SIZE)
+    eof = not buffer
+    
+    wrapper = JSON_WRAPPER_START.match(buffer)
+    separators = JSON_WRAPPED_SEPARATORS if wrapper else JSON_SEPARATORS
+    position = buffer.index('{') + 1 if wrapper else 0
+    
+    while True:
+        position = separators.match(buffer, position).end()
         
-        최근 7일간 빈번한 위기 신호가 감지되었습니다.
-        **전문가 상담을 강력히 권장합니다.**
+        if position < len(buffer):
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError("JSON 형식이 올바르지 않습니다.")
+                if len(buffer) - position > MAX_JSON_OBJECT_CHARS:
+                    raise ValueError("JSON 객체가 너무 크거나 형식이 올바르지 않습니다.")
+            else:
+                # 청크 끝에서 잘린 숫자/문자열은 다음 청크와 합쳐 다시 읽음
+                if end < len(buffer) or eof or isinstance(value, (dict, list)):
+                    position = end
+                    if isinstance(value, dict):
+                        yield value
+                    continue
         
-        📞 자살예방 상담전화: 1393 (24시간)
-        """)
-    elif pattern['trend'] == 'concerning':
-        st.warning("""
-        📊 **주의가 필요한 상태**
+        if eof:
+            return
         
-        최근 위기 신호가 감지되었습니다.
-        상태가 지속되면 전문가와 상담하세요.
-        """)
+        chunk = text.read(IMPORT_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+def iter_json_rows(stream):
+    """JSON 객체 → {표준 필드: 값} (키 이름 정규화는 키마다 한 번)"""
+    fields = {}
+    for data in iter_json_objects(stream):
+        row = {}
+        for key, value in data.items():
+            field = fields.get(key)
+            if field is None:
+                name = normalize_field_name(key)
+                field = fields[key] = FIELD_NAME_LOOKUP.get(name, name)
+            row[field] = value
+        yield row
+
+def classify_import_row(row, hint=None):
+    """행 → 'sleep' / 'steps' / 'exercise' / None"""
+    if hint:
+        return hint
+    
+    type_name = str(row.get('type', '')).lower()
+    if 'sleep' in type_name or '수면' in type_name:
+        return 'sleep'
+    if 'step' in type_name or '걸음' in type_name:
+        return 'steps'
+    if 'steps' in row:
+        return 'steps'
+    if any(field in row for field in ('latency', 'awake', 'awakenings', 'main_sleep')):
+        return 'sleep'
+    if 'duration' in row or type_name:
+        return 'exercise'
+    return None
+
+def sleep_from_row(row):
+    """수면 행 → SleepRecord (형식 오류면 None)"""
+    if str(row.get('main_sleep', 'true')).lower() == 'false':
+        return None  # 낮잠 등 보조 수면
+    
+    bedtime = parse_export_time(row.get('start'))
+    wake = parse_export_time(row.get('end'))
+    if bedtime is None or wake is None:
+        return None
+    
+    return make_sleep_record(
+        bedtime, wake,
+        parse_number(row.get('latency')),
+        parse_number(row.get('awakenings')),
+        parse_number(row.get('awake'))
+    )
+
+def make_sleep_record(bedtime, wake, latency_minutes, awakenings, awake_minutes):
+    time_in_bed = (wake - bedtime) / 3600
+    if not MIN_IMPORT_SLEEP_HOURS <= time_in_bed <= MAX_IMPORT_SLEEP_HOURS:
+        return None
+    
+    latency_minutes = max(int(latency_minutes), 0)
+    awake_minutes = max(int(awake_minutes), 0)
+    if latency_minutes + awake_minutes >= time_in_bed * 60:
+        return None
+    
+    return SleepRecord(bedtime, wake, latency_minutes, max(int(awakenings), 0), awake_minutes)
+
+def exercise_from_row(row):
+    """운동 행 → ExerciseRecord (시작~종료 우선, 없으면 duration + 단위 추정)"""
+    start = parse_export_time(row.get('start') or row.get('date'))
+    if start is None:
+        return None
+    
+    end = parse_export_time(row.get('end'))
+    if end is not None and end > start:
+        minutes = (end - start) / 60
     else:
-        st.success("""
-        ✅ **안정적인 상태**
-        
-        현재 위기 신호가 적습니다.
-        계속 건강한 패턴을 유지하세요.
-        """)
+        minutes = parse_number(row.get('duration'))
+        unit = str(row.get('duration_unit', '')).lower()
+        if unit in ('s', 'sec', 'second', 'seconds') or (not unit and minutes > 24 * 60 * 60):
+            minutes /= 60 if minutes <= 24 * 60 * 60 else 60000  # 초 / 밀리초
+        elif unit in ('h', 'hr', 'hour', 'hours'):
+            minutes *= 60
+        elif not unit and minutes > 24 * 60:
+            minutes /= 60  # 초 단위로 보임
+    
+    if not 1 <= minutes <= 24 * 60:
+        return None
     
-    # 최근 위기 이력
-    if len(st.session_state.crisis_history) > 0:
-        st.markdown("---")
-        st.subheader("📋 최근 위기 이력")
+    intensity = IMPORT_INTENSITY_ALIASES.get(str(row.get('intensity', '')).strip().lower(), 1)
+    return ExerciseRecord(start, int(round(minutes)), intensity, 0)
+
+def steps_from_row(row):
+    """걸음 수 행 → (날짜 ordinal, 걸음 수)"""
+    ts = parse_export_time(row.get('date') or row.get('start'))
+    steps = parse_number(row.get('steps', row.get('value', row.get('count'))), None)
+    if ts is None or steps is None:
+        return None
+    return epoch_to_day(ts), steps
+
+def iter_row_events(rows, hint=None):
+    """표준화된 행 → ('sleep', SleepRecord) / ('exercise', ExerciseRecord) / ('steps', day, 걸음, 출처) / ('skip',)"""
+    for row in rows:
+        kind = classify_import_row(row, hint)
         
-        recent_5 = st.session_state.crisis_history[-5:]
+        if kind == 'sleep':
+            record = sleep_from_row(row)
+            yield ('sleep', record) if record else ('skip',)
+        elif kind == 'exercise':
+            record = exercise_from_row(row)
+            yield ('exercise', record) if record else ('skip',)
+        elif kind == 'steps':
+            parsed = steps_from_row(row)
+            yield ('steps', parsed[0], parsed[1], None) if parsed else ('skip',)
+        else:
+            yield ('skip',)
+
+class SleepSegmentMerger:
+    """출처별 수면 구간(InBed/Asleep/Awake)을 밤 단위 SleepRecord로 합침 - 같은 밤의 구간은 연달아 온다고 가정"""
+
+    def __init__(self):
+        self._open = {}  # source -> 진행 중인 밤
+
+    def add(self, source, start, end, value):
+        night = self._open.get(source)
+        finished = None
         
-        for event in reversed(recent_5):
-            timestamp = datetime.fromisoformat(event['timestamp']).strftime("%Y-%m-%d %H:%M")
-            level = event['level']
-            level_emoji = "🚨" if level == 3 else "⚠️" if level == 2 else "💛"
-            level_text = "Level 3 (긴급)" if level == 3 else "Level 2 (경고)" if level == 2 else "Level 1 (주의)"
+        gap = SLEEP_SEGMENT_GAP_HOURS * 3600
+        if night is not None and (start - night['end'] > gap or night['start'] - end > gap):
+            finished = self._close(night)
+            night = None
+        
+        if night is None:
+            night = {'start': start, 'end': end, 'in_bed': None, 'asleep': None, 'awake': 0.0, 'awakenings': 0}
+            self._open[source] = night
+        
+        night['start'] = min(night['start'], start)
+        night['end'] = max(night['end'], end)
+        if value.endswith('InBed'):
+            night['in_bed'] = start if night['in_bed'] is None else min(night['in_bed'], start)
+        elif value.endswith('Awake'):
+            night['awake'] += (end - start) / 60
+            night['awakenings'] += 1
+        else:  # Asleep / AsleepCore / AsleepDeep / AsleepREM / AsleepUnspecified
+            night['asleep'] = start if night['asleep'] is None else min(night['asleep'], start)
+        
+        return finished
+
+    def _close(self, night):
+        if night['asleep'] is None:
+            return None  # 누워만 있던 기록
+        bedtime = night['in_bed'] if night['in_bed'] is not None else night['start']
+        latency = max(night['asleep'] - bedtime, 0) / 60
+        return make_sleep_record(bedtime, night['end'], latency, night['awakenings'], night['awake'])
+
+    def close_all(self):
+        nights = [self._close(night) for night in self._open.values()]
+        self._open = {}
+        return [night for night in nights if night]
+
+def iter_health_xml(stream):
+    """Apple Health 형식 XML을 iterparse로 - 처리한 요소는 바로 비워서 메모리 일정"""
+    merger = SleepSegmentMerger()
+    context = ET.iterparse(stream, events=('start', 'end'))
+    _, root = next(context)
+    
+    for event, elem in context:
+        if event != 'end':
+            continue
+        
+        tag = elem.tag
+        if tag == 'Record':
+            record_type = elem.get('type')
             
-            with st.expander(f"{level_emoji} {timestamp} - {level_text}"):
-                st.write(f"**감지 키워드:** {', '.join(event['keywords'])}")
-                st.write(f"**비유 표현:** {'예' if event['is_metaphor'] else '아니오'}")
+            if record_type == HEALTH_STEP_TYPE:
+                start = elem.get('startDate', '')
+                try:
+                    day = date.fromisoformat(start[:10]).toordinal()  # 기록된 현지 날짜
+                except ValueError:
+                    yield ('skip',)
+                else:
+                    yield ('steps', day, parse_number(elem.get('value')), elem.get('sourceName'))
+            
+            elif record_type == HEALTH_SLEEP_TYPE:
+                start = parse_export_time(elem.get('startDate'))
+                end = parse_export_time(elem.get('endDate'))
+                if start is None or end is None or end <= start:
+                    yield ('skip',)
+                else:
+                    night = merger.add(elem.get('sourceName'), start, end, elem.get('value', ''))
+                    if night:
+                        yield ('sleep', night)
+            
+            root.clear()
+        
+        elif tag == 'Workout':
+            record = exercise_from_row({
+                'start': elem.get('startDate'),
+                'end': elem.get('endDate'),
+                'duration': elem.get('duration'),
+                'duration_unit': elem.get('durationUnit')
+            })
+            yield ('exercise', record) if record else ('skip',)
+            root.clear()
+    
+    for night in merger.close_all():
+        yield ('sleep', night)
+
+def iter_import_events(kind, stream, hint=None):
+    if kind == 'xml':
+        return iter_health_xml(stream)
+    if kind == 'json':
+        return iter_row_events(iter_json_rows(stream), hint)
+    return iter_row_events(iter_csv_rows(stream), hint)
+
+def steps_to_exercise(day, steps):
+    """하루 걸음 수 → 걷기 운동 기록 (정오 기준, 기분 미기록)"""
+    minutes = min(int(steps / STEPS_PER_MINUTE), 180)
+    ts = datetime.combine(date.fromordinal(day), datetime.min.time()).timestamp() + 12 * 3600
+    return ExerciseRecord(ts, minutes, 1 if steps >= 10000 else 0, 0)
+
+class ImportBatcher:
+    """가져온 기록 중복 제거 + 배치 단위로 세션 이력/저장소에 반영"""
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = {'sleep_data': [], 'exercise_records': []}
+        self.counts = {'sleep': 0, 'exercise': 0, 'duplicates': 0, 'skipped': 0}
+        
+        # 보관 기간(HISTORY_HORIZON_DAYS) 밖 기록은 다음 로드 때 보이지 않으므로 저장하지 않고 건너뜀
+        self.first_day = {name: horizon_start_day(HISTORY_HORIZON_DAYS[name]) for name in self.pending}
+        
+        # 세션 + 저장소(보관 기간 안) 기록 기준 중복 키 (수면: 기상일, 운동: 시작 분, 걸음: 운동한 날)
+        store = get_record_store()
+        user_id = get_user_id()
+        self.sleep_days = {r.day for r in st.session_state.sleep_data}
+        self.sleep_days.update(
+            SleepRecord.from_dict(d).day
+            for d in store.load(user_id, 'sleep_data', since=horizon_since(HISTORY_HORIZON_DAYS['sleep_data']))
+        )
+        exercise = list(st.session_state.exercise_records) + [
+            ExerciseRecord.from_dict(d)
+            for d in store.load(user_id, 'exercise_records', since=horizon_since(HISTORY_HORIZON_DAYS['exercise_records']))
+        ]
+        self.exercise_minutes = {int(r.ts // 60) for r in exercise}
+        self.exercise_days = {r.day for r in exercise}
+
+    def add_sleep(self, record):
+        if record.day < self.first_day['sleep_data']:
+            self.counts['skipped'] += 1
+            return
+        if record.day in self.sleep_days:
+            self.counts['duplicates'] += 1
+            return
+        self.sleep_days.add(record.day)
+        self._queue('sleep_data', record)
+
+    def add_exercise(self, record, by_day=False):
+        if record.day < self.first_day['exercise_records']:
+            self.counts['skipped'] += 1
+            return
+        seen = record.day in self.exercise_days if by_day else int(record.ts // 60) in self.exercise_minutes
+        if seen:
+            self.counts['duplicates'] += 1
+            return
+        self.exercise_minutes.add(int(record.ts // 60))
+        self.exercise_days.add(record.day)
+        self._queue('exercise_records', record)
+
+    def _queue(self, history, record):
+        pending = self.pending[history]
+        pending.append(record)
+        if len(pending) >= self.batch_size:
+            self.flush(history)
+
+    def flush(self, history=None):
+        for name in (history,) if history else tuple(self.pending):
+            records = self.pending[name]
+            if not records:
+                continue
+            self.pending[name] = []
+            
+            st.session_state[name].extend(records)
+            persist_records(name, records)
+            self.counts['sleep' if name == 'sleep_data' else 'exercise'] += len(records)
 
-# ============================================================================
-# 3. 면책 조항 (유지)
-# ============================================================================
+def import_wearable_export(fileobj, filename, hint=None, progress=None):
+    """웨어러블 내보내기 파일 스트리밍 가져오기 → 결과 집계 dict
 
-def show_disclaimer():
-    """면책 조항"""
-    st.title("🌙 GINI R.E.S.T.")
-    st.subheader("Human Recovery AI System v3.0 Phase 2")
-    st.caption("✅ Phase 2: Emotion Pattern Engine")
-    
-    st.markdown("---")
-    
-    st.markdown("""
-    ### ⚠️ 이용 약관 및 면책 조항
-    
-    #### 1. 서비스의 성격
-    - 본 서비스는 **정신건강 회복 지원 도구**입니다.
-    - 수면, 운동, 영양, 사회적 연결, 감정 패턴을 관리합니다.
-    - **의학적 진단, 치료, 상담을 제공하지 않습니다.**
-    
-    #### 2. Phase 2 추가 기능
-    - ✅ **Emotion Pattern Engine (감정 패턴 분석)**
-    - ✅ E1-E5 감정 레벨 자동 분석
-    - ✅ Phase 1과 통합 (위기+고립+감정)
-    - ✅ 감정 기반 맞춤 반응 메시지
-    
-    #### 3. Phase 1 기능 (유지)
-    - ✅ 다단계 위기 감지 시스템
-    - ✅ 강력한 운동 개입 시스템
-    - ✅ 강력한 영양 개입 시스템
-    - ✅ 사회적 연결 엔진 (5개 모듈)
-    - ✅ GPS 위치 자동 표시 (긴급 상황용)
+    progress(비율 0-1, 집계 dict)는 읽은 바이트 기준 1% 단위로 호출.
+    중간에 실패해도 이미 반영된 배치는 남으므로, 남은 배치 반영과 파생 상태 재구성은 항상 수행하고
+    예외에 import_counts(그때까지의 집계)를 붙여 다시 던진다.
+    """
+    kind, stream, size, counter = open_export(fileobj, filename)
+    batcher = ImportBatcher()
+    daily_steps = {}  # day -> {출처: 걸음 수} (여러 기기 중복 합산 방지 - 출처별 최댓값)
+    reported = 0
     
-    #### 4. 사용자의 책임
-    - 심각한 정신건강 문제가 있다면 **반드시 전문가와 상담**하세요.
-    - E4-E5 레벨이 지속되면 전문가 도움이 필요합니다.
-    - 응급 상황 시 즉시 119 또는 1393으로 연락하세요.
+    try:
+        for event in iter_import_events(kind, stream, hint):
+            tag = event[0]
+            if tag == 'sleep':
+                batcher.add_sleep(event[1])
+            elif tag == 'exercise':
+                batcher.add_exercise(event[1])
+            elif tag == 'steps':
+                sources = daily_steps.setdefault(event[1], {})
+                sources[event[3]] = sources.get(event[3], 0) + event[2]
+            else:
+                batcher.counts['skipped'] += 1
+            
+            if progress and size:
+                fraction = min(counter.bytes_read / size, 1.0)
+                if fraction - reported >= 0.01:
+                    reported = fraction
+                    progress(fraction, batcher.counts)
+        
+        # 걸음 수는 하루 합계가 끝까지 모여야 하므로 파일을 다 읽은 경우에만 반영
+        for day in sorted(daily_steps):
+            steps = max(daily_steps[day].values())
+            if steps >= ACTIVE_STEPS_THRESHOLD:
+                batcher.add_exercise(steps_to_exercise(day, steps), by_day=True)
+    except Exception as e:
+        e.import_counts = batcher.counts  # finally의 마지막 flush까지 반영된 같은 dict
+        raise
+    finally:
+        batcher.flush()
+        
+        # 파생 상태는 이력 기준으로 한 번에 재구성
+        st.session_state.exercise_index = ExerciseDayIndex(st.session_state.exercise_records.days)
+        st.session_state.sleep_stats.reset(st.session_state.sleep_data)
+        invalidate_metrics()
+    
+    if progress:
+        progress(1.0, batcher.counts)
+    return dict(batcher.counts, format=kind, step_days=len(daily_steps))
+
+@traced()
+def show_import_page():
+    """웨어러블 수면/걸음/운동 데이터 가져오기"""
+    st.caption("Apple 건강(export.zip / export.xml), Fitbit(JSON), Samsung Health(CSV) 등 내보내기 파일을 그대로 올려주세요.")
+    
+    uploaded = st.file_uploader(
+        "내보내기 파일",
+        type=['zip', 'xml', 'csv', 'json', 'jsonl', 'ndjson'],
+        key="import_file"
+    )
+    kind_label = st.selectbox(
+        "데이터 종류",
+        list(IMPORT_KINDS.keys()),
+        help="열 이름으로 종류를 알 수 없는 CSV/JSON(예: Fitbit 걸음 수)은 직접 골라주세요. XML은 항상 자동 감지."
+    )
     
-    #### 5. 데이터
-    - 브라우저 세션에만 저장됩니다.
-    - 서버에 저장하지 않습니다.
+    st.info(f"""
+    💡 **가져오는 방식**
     
-    #### 6. 면책사항
-    - 본 서비스 사용으로 인한 결과에 대해 개발자는 책임지지 않습니다.
+    - 수면: 기상일 기준 하루 1건 (이미 있는 날은 건너뜀), {MIN_IMPORT_SLEEP_HOURS}시간 미만 낮잠 제외
+    - 걸음 수: 하루 {ACTIVE_STEPS_THRESHOLD:,}보 이상인 날을 걷기 운동으로 기록 (여러 기기는 가장 많은 쪽)
+    - 운동: 시작 시각이 같은 기록은 건너뜀
+    - 최근 {HISTORY_HORIZON_DAYS['sleep_data']}일 안의 기록만 가져옴 (그 이전 기록은 건너뜀)
     """)
     
-    st.markdown("---")
-    
-    agree = st.checkbox("위 내용을 모두 읽고 이해했으며, 이에 동의합니다.")
+    if uploaded is None:
+        return
     
-    if st.button("시작하기", disabled=not agree, use_container_width=True):
-        st.session_state.agreed_to_terms = True
+    if st.button("📥 가져오기 시작", use_container_width=True, type="primary"):
+        bar = st.progress(0.0, text="파일 읽는 중...")
+        
+        def report(fraction, counts):
+            bar.progress(fraction, text=f"{fraction:.0%} - 수면 {counts['sleep']}건, 운동 {counts['exercise']}건")
+        
+        try:
+            result = import_wearable_export(uploaded, uploaded.name, IMPORT_KINDS[kind_label], report)
+        except (ValueError, ET.ParseError, zipfile.BadZipFile, UnicodeDecodeError) as e:
+            counts = getattr(e, 'import_counts', None)
+            if not counts or not (counts['sleep'] or counts['exercise']):
+                st.error(f"❌ 가져오기 실패: {e}")
+                return
+            
+            # 일부는 이미 저장됨 - 다시 그려서 갱신된 지표를 보여줌
+            flash(
+                f"⚠️ 수면 {counts['sleep']}건, 운동 {counts['exercise']}건 반영 후 중단: {e}",
+                kind='warning',
+                details=["다시 가져오면 이미 반영된 기록은 중복으로 건너뜁니다. 파일을 확인한 뒤 다시 시도해주세요."]
+            )
+            st.rerun()
+        
+        flash(
+            f"🎉 가져오기 완료! 수면 {result['sleep']}건, 운동 {result['exercise']}건",
+            details=[f"중복 {result['duplicates']}건, 건너뜀 {result['skipped']}건 ({result['format'].upper()})"],
+            balloons=bool(result['sleep'] or result['exercise'])
+        )
         st.rerun()
 
 # ============================================================================
 # 기존 기능들 (간략화 - 실제로는 원본 유지)
 # ============================================================================
 
-def add_sleep_record():
-    """수면 기록 (유지)"""
-    st.info("수면 기록 기능 - v2.0 유지")
-
-def calculate_sleep_debt():
-    """수면 분석 (유지)"""
-    st.info("수면 분석 기능 - v2.0 유지")
-
-def show_cbti_education():
-    """CBT-I 교육 (유지)"""
-    st.info("CBT-I 교육 - v2.0 유지")
-
-def breathing_exercise():
-    """호흡 운동 (유지)"""
-    st.info("호흡 운동 - v2.0 유지")
-
+@traced()
 def show_education():
     """AI 상담 - Groq API 기반 진짜 대화형"""
     st.title("💬 AI 상담")
@@ -2667,19 +6295,18 @@ def show_education():
     
     st.markdown("---")
     
-    # API 키 확인
-    if not GROQ_API_KEY:
-        st.error("⚠️ **Groq API 키가 없습니다.** Streamlit secrets에 `GROQ_API_KEY`를 추가해주세요.")
+    # LLM 프로바이더 확인
+    router = get_llm_router()
+    if router.config_error:
+        st.warning(f"⚠️ `LLM_PROVIDERS` 설정을 읽지 못해 기본 설정을 사용합니다. ({router.config_error})")
+    
+    if not router.providers:
+        st.error("⚠️ **LLM 설정이 없습니다.** Streamlit secrets에 `GROQ_API_KEY` 또는 `LLM_PROVIDERS`를 추가해주세요.")
         return
     
     # 현재 상태 표시
     forced_intervention = determine_forced_intervention()
-    tone_name, tone_desc = get_tone_description(
-        st.session_state.emotion_score,
-        st.session_state.isolation_score,
-        get_crisis_pattern()['recent_7days'],
-        forced_intervention
-    )
+    tone_name, tone_desc = get_tone_description()
     
     col1, col2 = st.columns([3, 1])
     
@@ -2705,6 +6332,9 @@ def show_education():
     if 'ai_chat_history' not in st.session_state:
         st.session_state.ai_chat_history = []
     
+    if 'chat_summary' not in st.session_state:
+        st.session_state.chat_summary = []
+    
     for msg in st.session_state.ai_chat_history:
         with st.chat_message(msg['role']):
             st.write(msg['content'])
@@ -2719,33 +6349,63 @@ def show_education():
         with st.chat_message("user"):
             st.write(user_input)
         
-        # 감정 분석
-        emotion_result = detect_emotion_level(user_input)
-        record_emotion_event(emotion_result['score'], emotion_result['emotions'], user_input)
-        
-        # 위기 키워드 체크
-        has_crisis, crisis_level_detected, _ = check_crisis_keywords(user_input)
+        # 감정/위기/고립 통합 분석 (기록 포함)
+        analysis = analyze_message(user_input)
+        st.session_state.last_message_analysis = analysis
         
         # E5 or 위기 시 Crisis 모드
-        if emotion_result['score'] >= 5 or has_crisis:
+        if analysis.e_score >= 5 or analysis.has_crisis:
             st.session_state.emergency_mode = True
-            st.session_state.crisis_level = max(3, crisis_level_detected)
+            st.session_state.crisis_level = max(3, analysis.crisis_level)
             st.rerun()
         
-        # Groq API 호출
-        system_prompt = build_system_prompt()
-        recent_history = st.session_state.ai_chat_history[-10:]
+        # LLM 호출
+        # 오래된 턴은 누적 요약으로 접고, 요약은 시스템 프롬프트에 포함
+        update_chat_summary()
+        system_prompt = build_system_prompt() + get_conversation_summary()
+        
+        # 오류/대체 응답/요약된 턴은 원문 맥락에서 제외, 토큰 예산 내에서 최근 턴 우선
+        history = [
+            msg for msg in st.session_state.ai_chat_history
+            if not msg.get('error') and not msg.get('summarized')
+        ]
+        messages, _ = fit_chat_context(
+            system_prompt,
+            history,
+            int(get_setting("LLM_CONTEXT_BUDGET", 3000))
+        )
         
-        messages = [{"role": "system", "content": system_prompt}]
-        for msg in recent_history:
-            messages.append({"role": msg['role'], "content": msg['content']})
+        # 응답 캐시 (위기/강제 개입 시 우회)
+        reply_cache = get_reply_cache()
+        cache_key = None
+        cached_reply = None
+        if reply_cache is not None:
+            if should_bypass_reply_cache(analysis):
+                reply_cache.record_bypass()
+            else:
+                cache_key = reply_cache_key(system_prompt, messages[1:-1], user_input)
+                cached_reply = reply_cache.get(cache_key)
         
         with st.chat_message("assistant"):
-            with st.spinner("생각 중..."):
-                ai_response = call_groq_api(messages)
+            if cached_reply is not None:
+                ai_response = cached_reply
                 st.write(ai_response)
+                is_error = False
+            else:
+                with get_tracer().span('llm.stream') as span:
+                    try:
+                        ai_response = render_stream(stream_llm(messages))
+                        is_error = False
+                    except LLMCallError as e:
+                        span.set('error', e.category)
+                        ai_response = get_fallback_reply(analysis.e_score)
+                        st.write(ai_response)
+                        is_error = True
+                
+                if cache_key is not None and not is_error and ai_response:
+                    reply_cache.put(cache_key, ai_response)
         
-        st.session_state.ai_chat_history.append({'role': 'assistant', 'content': ai_response})
+        st.session_state.ai_chat_history.append({'role': 'assistant', 'content': ai_response, 'error': is_error})
     
     # 히스토리 관리
     if len(st.session_state.ai_chat_history) > 0:
@@ -2754,6 +6414,7 @@ def show_education():
         with col1:
             if st.button("🗑️ 대화 내역 지우기", use_container_width=True):
                 st.session_state.ai_chat_history = []
+                st.session_state.chat_summary = []
                 st.rerun()
         with col2:
             st.caption(f"총 {len(st.session_state.ai_chat_history)}개 메시지")
@@ -2779,6 +6440,7 @@ def show_education():
 # 메인 앱
 # ============================================================================
 
+@traced()
 def show_emergency_with_location():
     """긴급 모드 with 위치 정보"""
     level = st.session_state.crisis_level
@@ -2997,59 +6659,144 @@ def show_emergency_with_location():
         st.session_state.crisis_level = 0
         st.rerun()
 
-def main():
-    """메인 앱"""
-    init_session_state()
-    reset_daily_state()
+# ============================================================================
+# 관리자 화면 (숨김)
+# ============================================================================
+
+def is_admin_request():
+    """?admin= 값이 ADMIN_TOKEN과 일치할 때만 True (토큰 미설정 시 항상 False)"""
+    token = get_setting("ADMIN_TOKEN", "")
+    if not token:
+        return False
     
-    if not st.session_state.agreed_to_terms:
-        show_disclaimer()
-        return
+    try:
+        supplied = st.query_params.get('admin')
+    except Exception:
+        return False
+    
+    return bool(supplied) and hmac.compare_digest(str(supplied), str(token))
+
+def show_admin_page():
+    """숨김 관리자 화면 - 스팬 타이밍 + 운영 지표"""
+    st.title("🛠️ 관리자")
+    show_span_timings()
+    
+    st.markdown("---")
+    show_metrics_exposition()
+
+def show_span_timings():
+    """전체 세션의 스팬별 p50/p95 타이밍"""
+    st.subheader("⏱️ 실행 구간 타이밍")
     
-    # 1순위: Emergency Crisis Mode with Location
-    if st.session_state.emergency_mode:
-        show_emergency_with_location()
+    tracer = get_tracer()
+    if not tracer.enabled:
+        st.info("추적이 꺼져 있습니다. `GINI_TRACE=1`로 켜세요.")
         return
     
-    # 2순위: Sleep Intervention Mode
-    if st.session_state.intervention_mode:
-        show_intervention()
+    caption = f"스팬별 최근 {tracer.window}회 기준 (전체 세션 합산)"
+    if tracer.export_path:
+        caption += f" | 내보내기: {tracer.export_path} ({tracer.export_format})"
+    st.caption(caption)
+    
+    rows = tracer.stats()
+    if not rows:
+        st.info("아직 수집된 스팬이 없습니다.")
         return
     
-    # 3순위: Exercise Intervention Check (Level 2+)
-    exercise_intervention = check_exercise_intervention()
-    if exercise_intervention and exercise_intervention['level'] >= 2:
-        show_exercise_intervention()
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    
+    if st.button("통계 초기화"):
+        tracer.reset()
+        st.rerun()
+
+def show_metrics_exposition():
+    """운영 지표 내보내기 상태 + 현재 값 (Prometheus 텍스트)"""
+    st.subheader("📈 운영 지표")
+    
+    registry = get_metrics().registry
+    if registry.export_status:
+        for status in registry.export_status:
+            st.caption(status)
+    else:
+        st.caption("내보내기 꺼짐 (지표 기록 안 함) - `GINI_METRICS_PORT` 또는 `GINI_METRICS_FILE`로 켜세요.")
+    
+    with st.expander("현재 값"):
+        st.code(registry.render(), language="text")
+
+# 규칙 결정 → 개입 화면 / Level 1 경고 메시지
+INTERVENTION_SCREENS = {
+    'emergency': show_emergency_with_location,
+    'sleep': show_intervention,
+    'exercise': show_exercise_intervention,
+    'nutrition': show_nutrition_intervention,
+    'social': show_social_intervention
+}
+
+INTERVENTION_WARNINGS = {
+    'exercise': get_exercise_intervention_message,
+    'nutrition': get_nutrition_intervention_message,
+    'social': get_social_intervention_message
+}
+
+def main():
+    """메인 앱"""
+    try:
+        with get_tracer().span('rerun'):
+            render_app()
+    finally:
+        get_record_store().flush()
+
+def render_app():
+    """화면 렌더링 (메뉴 라우팅)"""
+    # 숨김 관리자 화면 (?admin=<ADMIN_TOKEN>)
+    if is_admin_request():
+        show_admin_page()
         return
     
-    # 4순위: Nutrition Intervention Check (Level 2+)
-    nutrition_intervention = check_nutrition_intervention()
-    if nutrition_intervention and nutrition_intervention['level'] >= 2:
-        show_nutrition_intervention()
+    init_session_state()
+    begin_rerun()
+    reset_daily_state()
+    
+    metrics = get_metrics()
+    metrics.reruns.inc()
+    metrics.active_sessions.touch(st.session_state.session_key)
+    
+    show_flash_messages()
+    
+    if not st.session_state.agreed_to_terms:
+        show_disclaimer()
         return
     
-    # 5순위: Social Intervention Check (Level 2+)
-    social_intervention = check_social_intervention()
-    if social_intervention and social_intervention['level'] >= 2:
-        show_social_intervention()
+    # 고립 점수 갱신 (실행당 1회 - 개입 결정과 사이드바가 같은 값을 읽음)
+    update_isolation_score()
+    
+    # 개입 화면 (규칙 테이블 screen 그룹: 긴급 > 수면 > 운동 > 영양 > 사회)
+    decision = intervention_decision()
+    if decision['screen'] is not None:
+        INTERVENTION_SCREENS[decision['screen']]()
         return
     
     # 경계 구역 체크
-    in_boundary = check_boundary_zone()
+    in_boundary = decision['snapshot']['boundary_zone']
     if in_boundary and not st.session_state.recovery_confirmed:
         if st.session_state.target_bedtime:
             st.warning(f"""
             ⚠️ **경계 구역 활성화**
             
             취침 시간 {st.session_state.target_bedtime.strftime('%H:%M')}까지 1시간 미만 남았습니다.
+            현재 수면 부족량: {decision['snapshot']['sleep_debt']:.1f}시간
             """)
     
     # 사이드바
-    with st.sidebar:
+    with st.sidebar, get_tracer().span('sidebar'):
         st.title("🌙 GINI R.E.S.T.")
         st.caption("v3.0 Phase 2 ✅")
         st.caption("Emotion Pattern Engine")
         
+        rules = get_intervention_rules()
+        if rules.config_error:
+            st.warning(f"⚠️ `INTERVENTION_RULES_FILE` 설정을 읽지 못해 기본 규칙을 사용합니다. ({rules.config_error})")
+        
         st.markdown("---")
         
         # 상태 표시
@@ -3057,10 +6804,6 @@ def main():
         days_no_exercise = days_since_last_exercise()
         hours_no_meal = hours_since_last_meal()
         
-        # 고립 점수 업데이트
-        update_isolation_score()
-        isolation_level = get_isolation_level()
-        
         # 위기 상태
         if pattern['trend'] == 'worsening':
             st.error(f"⚠️ 위기: {pattern['recent_7days']}회/7일")
@@ -3086,12 +6829,7 @@ def main():
             st.error(f"🚨 식사: {hours_no_meal:.0f}시간 전")
         
         # 사회적 연결 상태 (NEW)
-        days_since_social = 999
-        if st.session_state.last_social_contact:
-            last_contact = st.session_state.last_social_contact
-            if isinstance(last_contact, str):
-                last_contact = datetime.fromisoformat(last_contact)
-            days_since_social = (datetime.now() - last_contact).days
+        days_since_social = days_since_last_social_contact()
         
         if days_since_social == 0:
             st.success("🤝 사회적 연결: 오늘 ✅")
@@ -3103,6 +6841,15 @@ def main():
             st.info("🤝 사회적 연결: 기록 없음")
         
         # 수면 상태
+        sleep_stats = get_sleep_stats()
+        if sleep_stats['nights'] > 0:
+            if sleep_stats['debt_hours'] >= 5:
+                st.error(f"🚨 수면 부족: {sleep_stats['debt_hours']:.1f}시간")
+            elif sleep_stats['debt_hours'] >= 2:
+                st.warning(f"⚠️ 수면 부족: {sleep_stats['debt_hours']:.1f}시간")
+            else:
+                st.success("💤 수면: 양호 ✅")
+        
         if st.session_state.target_bedtime:
             st.info(f"🎯 목표: {st.session_state.target_bedtime.strftime('%H:%M')}")
         
@@ -3121,15 +6868,17 @@ def main():
                 "📊 수면 기록",
                 "💤 수면 분석",
                 "🧠 CBT-I 교육",
-                "🫁 호흡 운동"
+                "🫁 호흡 운동",
+                "📥 데이터 가져오기"
             ]
         )
         
         st.markdown("---")
         st.caption(f"수면: {len(st.session_state.sleep_data)}일")
         st.caption(f"위기: {pattern['total_count']}회")
-        st.caption(f"운동: {len(st.session_state.exercise_records)}일")
-        st.caption(f"연속: {st.session_state.exercise_streak}일 🔥")
+        exercise_stats = get_exercise_stats()
+        st.caption(f"운동: {exercise_stats['total_days']}일")
+        st.caption(f"연속: {exercise_stats['streak']}일 🔥")
         st.caption(f"식사: {len(st.session_state.meal_records)}회")
         st.caption(f"사회: {len(st.session_state.social_interactions)}회")  # NEW
         st.caption(f"고립: {st.session_state.isolation_score}/100")  # NEW
@@ -3139,23 +6888,13 @@ def main():
             st.session_state.crisis_level = 3
             st.rerun()
     
-    # Level 1 경고 (상단 띠)
-    warnings_shown = 0
-    
-    # 운동 Level 1 경고
-    if exercise_intervention and exercise_intervention['level'] == 1:
-        st.warning(exercise_intervention['message'])
-        warnings_shown += 1
-    
-    # 영양 Level 1 경고
-    if nutrition_intervention and nutrition_intervention['level'] == 1:
-        st.warning(nutrition_intervention['message'])
-        warnings_shown += 1
+    get_tracer().annotate(page=menu)
     
-    # 사회적 연결 Level 1 경고 (NEW)
-    if social_intervention and social_intervention['level'] == 1:
-        st.warning(social_intervention['message'])
-        warnings_shown += 1
+    # Level 1 경고 (상단 띠)
+    for name in decision['warnings']:
+        intervention = INTERVENTION_WARNINGS[name]()
+        if intervention:
+            st.warning(intervention['message'])
     
     # 메뉴별 화면
     if menu == "🎯 Phase 2 설정":
@@ -3179,7 +6918,7 @@ def main():
             st.metric("감정 레벨", f"E{e_score}")
         
         with col4:
-            st.metric("운동 일수", f"{len(st.session_state.exercise_records)}일")
+            st.metric("운동 일수", f"{get_exercise_stats()['total_days']}일")
         
         with col5:
             st.metric("식사 기록", f"{len(st.session_state.meal_records)}회")
@@ -3225,6 +6964,10 @@ def main():
     elif menu == "🫁 호흡 운동":
         st.title("🫁 호흡 운동")
         breathing_exercise()
+    
+    elif menu == "📥 데이터 가져오기":
+        st.title("📥 데이터 가져오기")
+        show_import_page()
 
 if __name__ == "__main__":
     main()
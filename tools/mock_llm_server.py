@@ -0,0 +1,215 @@
+"""OpenAI 호환 chat-completions 목(mock) 서버 (로컬/오프라인 테스트용)
+
+사용법:
+    python tools/mock_llm_server.py --port 8765 --latency 0.2
+
+앱 연결:
+    GROQ_API_URL=http://127.0.0.1:8765/v1/chat/completions GROQ_API_KEY=test streamlit run gini_rest_vi.py
+
+여러 프로바이더 (페일오버/지연 라우팅 확인):
+    LLM_PROVIDERS='[{"name": "mock", "url": "http://127.0.0.1:8765/v1/chat/completions"}, {"name": "local", "kind": "stub"}]'
+
+네트워크 없이 돌릴 때는 앱 내장 스텁 프로바이더(kind "stub")를 쓰면 된다 - 응답 규칙은 이 서버와 같다.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_REPLIES = [
+    "이야기해줘서 고마워요. 지금 느끼는 감정을 천천히 같이 살펴봐요.",
+    "많이 지쳤겠어요. 오늘 잠깐이라도 쉬는 시간을 가져보면 어떨까요?",
+    "그 마음 충분히 이해해요. 지금 할 수 있는 작은 행동 하나를 같이 정해봐요.",
+    "혼자 견디지 않아도 괜찮아요. 믿을 수 있는 사람에게 연락해보는 건 어때요?",
+]
+
+def pick_reply(messages):
+    """마지막 사용자 메시지 기준 결정적(deterministic) 응답"""
+    user_text = ""
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            user_text = message.get('content', '')
+            break
+
+    digest = hashlib.sha256(user_text.encode('utf-8')).digest()
+    return CANNED_REPLIES[digest[0] % len(CANNED_REPLIES)]
+
+def build_completion(model, content):
+    return {
+        'id': f"chatcmpl-mock-{int(time.time() * 1000)}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop'
+        }],
+        'usage': {
+            'prompt_tokens': 0,
+            'completion_tokens': len(content),
+            'total_tokens': len(content)
+        }
+    }
+
+def build_chunk(model, content=None, finish_reason=None):
+    delta = {'content': content} if content is not None else {}
+    return {
+        'id': 'chatcmpl-mock-stream',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+    }
+
+def split_tokens(content):
+    """공백 단위로 토큰 흉내 (공백 포함)"""
+    tokens = []
+    for word in content.split(' '):
+        tokens.append(word if not tokens else ' ' + word)
+    return tokens
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    latency = 0.0
+    token_delay = 0.0
+    error_rate = 0.0
+    error_status = 503
+    retry_after = None
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # 클라이언트가 연결을 먼저 끊음 (스트림 취소 등)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'invalid json'}})
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self._send_error_response()
+            return
+
+        model = payload.get('model', 'mock')
+        content = pick_reply(payload.get('messages', []))
+
+        if payload.get('stream'):
+            self._send_stream(model, content)
+        else:
+            self._send_json(200, build_completion(model, content))
+
+    def _send_error_response(self):
+        """장애 주입 - 설정된 상태 코드(+Retry-After)로 응답"""
+        data = json.dumps({'error': {'message': 'injected failure'}}).encode('utf-8')
+        self.send_response(self.error_status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if self.retry_after is not None:
+            self.send_header('Retry-After', str(self.retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_event(self, body):
+        text = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+        self._write_chunk(f"data: {text}\n\n".encode('utf-8'))
+
+    def _send_stream(self, model, content):
+        """SSE 스트리밍 응답 (chunked transfer)"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            for token in split_tokens(content):
+                if self.token_delay:
+                    time.sleep(self.token_delay)
+                self._send_event(build_chunk(model, token))
+
+            self._send_event(build_chunk(model, finish_reason='stop'))
+            self._send_event('[DONE]')
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 클라이언트가 스트림을 중간에 끊음 (취소)
+            self.close_connection = True
+
+def serve(host="127.0.0.1", port=8765, latency=0.0, token_delay=0.0,
+          error_rate=0.0, error_status=503, retry_after=None, background=False):
+    """목 서버 실행 - background=True면 데몬 스레드로 띄우고 서버 객체 반환"""
+    handler = type('ConfiguredMockLLMHandler', (MockLLMHandler,), {
+        'latency': latency,
+        'token_delay': token_delay,
+        'error_rate': error_rate,
+        'error_status': error_status,
+        'retry_after': retry_after
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    if background:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 호환 mock LLM 서버")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="응답 지연 (초)")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="스트리밍 토큰 간 지연 (초)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="장애 주입 비율 (0-1)")
+    parser.add_argument('--error-status', type=int, default=503, help="장애 주입 상태 코드")
+    parser.add_argument('--retry-after', type=int, default=None, help="장애 응답 Retry-After (초)")
+    args = parser.parse_args()
+
+    print(f"mock LLM server: http://{args.host}:{args.port}/v1/chat/completions")
+    serve(args.host, args.port, args.latency, args.token_delay,
+          args.error_rate, args.error_status, args.retry_after)
+
+if __name__ == "__main__":
+    main()